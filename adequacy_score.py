@@ -0,0 +1,210 @@
+import json
+import argparse
+
+import rep_score
+import drop_score
+import input_files
+
+################################################################################################
+###                                 AUXILIARY FUNCTIONS                                      ###
+################################################################################################
+
+class AdequacyResult(object):
+    """ REP-score and DROP-score of a prediction, with the penalties and the per-sentence scores.
+        The DROP-score fields are None when no alignments are given """
+
+    def __init__(self, rep_scores, normalized_rep_scores, bp, rep_sentence_scores,
+                 drop_score=None, lp=None, drop_sentence_scores=None, nw_ref=None, nw_can=None):
+
+        # Dictionaries indexed by the value of n
+        self.rep_scores = rep_scores
+        self.normalized_rep_scores = normalized_rep_scores
+        self.rep_sentence_scores = rep_sentence_scores
+        self.bp = bp
+
+        self.drop_score = drop_score
+        self.lp = lp
+        self.drop_sentence_scores = drop_sentence_scores
+
+        # Number of words of each reference and of the prediction
+        self.nw_ref = nw_ref
+        self.nw_can = nw_can
+
+    def as_dict(self):
+        """ Returns the result as a dictionary that can be serialized to json """
+
+        return {"rep_score": self.rep_scores,
+                "normalized_rep_score": self.normalized_rep_scores,
+                "bp": self.bp,
+                "rep_sentence_scores": self.rep_sentence_scores,
+                "drop_score": self.drop_score,
+                "lp": self.lp,
+                "drop_sentence_scores": self.drop_sentence_scores,
+                "nw_ref": self.nw_ref,
+                "nw_can": self.nw_can}
+
+    def format(self):
+        """ Returns the result with the same output lines as rep_score.py and drop_score.py """
+
+        lines = list()
+
+        if len(self.rep_scores) == 1:
+            n_grams, = self.rep_scores
+            lines.append("REP_SCORE: {}, BP: {:.2f}, NORMALIZED_REP_SCORE: {:.2f}".format(
+                self.rep_scores[n_grams], self.bp, self.normalized_rep_scores[n_grams]))
+        else:
+            lines.append("N\tREP_SCORE\tBP\tNORMALIZED_REP_SCORE")
+            for n_grams in self.rep_scores:
+                lines.append("{}\t{}\t{:.2f}\t{:.2f}".format(n_grams, self.rep_scores[n_grams], self.bp,
+                                                             self.normalized_rep_scores[n_grams]))
+
+        if self.drop_score is not None:
+            lines.append("LP: {:.2f} DSW: {:.2f}".format(self.lp, self.drop_score))
+
+        return "\n".join(lines)
+
+
+def rep_result(all_n_gram_scores, consec_scores, nw_ref, nw_can, n_grams_list, w1, w2):
+    """ Returns the AdequacyResult with the REP-score, given the per-sentence n-gram and consecutive
+        words scores (see rep_score.profile_multi_rep_scores) and the number of words of each
+        reference and of the prediction """
+
+    # Both metrics are normalized by the reference length closest to the prediction
+    ref_length = rep_score.closest_reference_length(nw_ref, nw_can)
+    assert ref_length > 0, "No valid reference file."
+
+    bp = rep_score.brevity_penalty(ref_length, nw_can)
+    rep_scores = rep_score.calculate_total_values(all_n_gram_scores, consec_scores, w1, w2)
+    normalized_rep_scores = dict((n_grams, bp*100*float(rep_scores[n_grams])/ref_length)
+                                 for n_grams in n_grams_list)
+    rep_sentence_scores = dict((n_grams, rep_score.calculate_final_scores(all_n_gram_scores[n_grams],
+                                                                          consec_scores, w1, w2))
+                               for n_grams in n_grams_list)
+
+    return AdequacyResult(dict((n_grams, rep_scores[n_grams]) for n_grams in n_grams_list),
+                          normalized_rep_scores, bp, rep_sentence_scores, nw_ref=nw_ref, nw_can=nw_can)
+
+
+def add_drop_score(result, src_ref_ixs, src_mt_ixs, src_ref_content=None):
+    """ Adds the DROP-score to an AdequacyResult, given the aligned source indeces of the references
+        and of the prediction in CSR layout (see drop_score.load_alignments) and, if stopwords are
+        filtered, the mask of drop_score.content_masks """
+
+    ref_length = drop_score.closest_reference_length(result.nw_ref, result.nw_can)
+    assert ref_length > 0, "No valid reference file."
+
+    tot, nr_src_ref_aligned_words, drop_sentence_scores = drop_score.count_dropped_words(
+        src_ref_ixs, src_mt_ixs, src_ref_content)
+
+    result.lp = drop_score.length_penalty(ref_length, result.nw_can)
+    result.drop_score = drop_score.drop_score_value(tot, nr_src_ref_aligned_words, result.lp)
+    result.drop_sentence_scores = drop_sentence_scores
+
+    return result
+
+
+def score_adequacy(references, candidate, n_grams_list=(2,), w1=1.0, w2=2.0, src_ref_align=None,
+                   src_mt_align=None, src_path=None, stopwords_path=None, engine="python"):
+    """
+    Returns the AdequacyResult of a prediction. Each file is read only once,
+    and the tokenized sentences and the number of words are shared by both
+    metrics.
+
+    Inputs:
+    - references     : list with the paths to the tokenized reference files
+    - candidate      : path to the tokenized prediction
+    - n_grams_list   : list with the values of n of the REP-score
+    - w1, w2         : multipliers lambda 1 and lambda 2 of the REP-score
+    - src_ref_align  : list with the paths to the source/reference alignments
+                       (only for the DROP-score)
+    - src_mt_align   : path to the source/prediction alignments (only for the
+                       DROP-score)
+    - src_path       : path to the source file (only to filter stopwords)
+    - stopwords_path : path to the stopwords file (only to filter stopwords)
+    - engine         : "python" or "numpy", the engine of the REP-score
+    """
+
+    n_grams_list = list(dict.fromkeys(n_grams_list))
+
+    ref_sentence_list = [ [line.split() for line in input_files.open_input(path)] for path in references]
+    pred_sentence_list = [line.split() for line in input_files.open_input(candidate)]
+
+    assert all(len(ref) == len(pred_sentence_list) for ref in ref_sentence_list), \
+                "Reference and predicted text files should have the same length"
+
+    nw_ref = [sum([len(x) for x in ref]) for ref in ref_sentence_list]
+    nw_can = sum([len(x) for x in pred_sentence_list])
+
+    # REP-score
+    if engine == "python":
+        ref_profiles = rep_score.build_reference_profile_lists(ref_sentence_list, n_grams_list)
+        all_n_gram_scores, consec_scores = rep_score.profile_multi_rep_scores(ref_profiles, pred_sentence_list,
+                                                                              n_grams_list)
+    else:
+        all_n_gram_scores, consec_scores = rep_score.numpy_multi_rep_scores(ref_sentence_list, pred_sentence_list,
+                                                                            n_grams_list)
+
+    result = rep_result(all_n_gram_scores, consec_scores, nw_ref, nw_can, n_grams_list, w1, w2)
+
+    # DROP-score
+    if src_ref_align and src_mt_align:
+        src_ref_ixs = drop_score.load_reference_alignments(src_ref_align)
+        src_mt_ixs = drop_score.load_alignments(src_mt_align, 0)
+
+        src_ref_content = None
+        if stopwords_path:
+            src_ref_content, = drop_score.content_masks(src_ref_ixs, drop_score.encode_source(input_files.open_input(src_path)),
+                                                        [drop_score.load_stopwords(stopwords_path)])
+
+        add_drop_score(result, src_ref_ixs, src_mt_ixs, src_ref_content)
+
+    return result
+
+################################################################################################
+###                                     MAIN FUNCTION                                        ###
+################################################################################################
+
+def main():
+
+    parser = argparse.ArgumentParser()
+
+    # Optional arguments
+    rep_score.add_n_grams_argument(parser)
+    rep_score.add_weight_arguments(parser, tandem=False)
+    parser.add_argument("--engine", choices=["python", "numpy"], default="python",
+                        help="Provide the engine used to compute the REP-score")
+    parser.add_argument("--src_ref_align", nargs='+',
+                        help="Path to the source/reference alignments")
+    parser.add_argument("--src_mt_align", type=str,
+                        help="Path to the source/prediction alignments")
+    drop_score.add_stopwords_arguments(parser, several=False)
+    parser.add_argument("--json", action="store_true",
+                        help="Print the result, including the per-sentence scores, as json")
+
+    # Required arguments
+    required = parser.add_argument_group("required arguments")
+    required.add_argument("-r", "--reference", nargs='+', required=True,
+                          help="Provide a list with the paths to the tokenized reference files")
+    required.add_argument("-p", "--predicted", type=str, required=True,
+                          help="Provide the path to the tokenized obtained translation")
+
+    args = parser.parse_args()
+
+    n_grams_list = rep_score.n_grams_from_arguments(args)
+    drop_score.check_stopwords_arguments(args)
+
+    if bool(args.src_ref_align) != bool(args.src_mt_align):
+        print("Both --src_ref_align and --src_mt_align are needed to compute the DROP-score")
+        exit()
+
+    result = score_adequacy(args.reference, args.predicted, n_grams_list, args.w1, args.w2, args.src_ref_align,
+                            args.src_mt_align, args.src_path, args.stopwords_path, args.engine)
+
+    if args.json:
+        print(json.dumps(result.as_dict()))
+    else:
+        print(result.format())
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,243 @@
+import os
+import shlex
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import sharding
+import rep_score
+import drop_score
+import batch_score
+import input_files
+import result_store
+import reference_cache
+
+################################################################################################
+###                                 AUXILIARY FUNCTIONS                                      ###
+################################################################################################
+
+class AlignerProcess(object):
+    """
+    Persistent aligner process. The command must read "source ||| target"
+    lines from stdin and write one alignment line, in fast_align format, for
+    each of them (e.g. fast_align's force_align.py, or stub_aligner.py), so
+    that the model is loaded only once for every system.
+    """
+
+    def __init__(self, command):
+
+        # Python aligners write each line as soon as it is aligned instead of buffering the output
+        env = dict(os.environ, PYTHONUNBUFFERED="1")
+
+        self.command = command
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        universal_newlines=True, bufsize=1, env=env)
+
+    def align(self, pairs):
+        """ Returns the list with the alignment lines of a list of "source ||| target" lines """
+
+        # Write from another thread, so that a full pipe on either side never blocks both processes
+        # If the aligner exits, the error is raised when reading its output
+        def write():
+            try:
+                for pair in pairs:
+                    self.process.stdin.write(pair + "\n")
+                self.process.stdin.flush()
+            except BrokenPipeError:
+                pass
+
+        writer = threading.Thread(target=write)
+        writer.start()
+
+        alignments = list()
+        for _ in pairs:
+            line = self.process.stdout.readline()
+            if not line:
+                raise RuntimeError("The aligner {} exited before aligning every line".format(self.command))
+            alignments.append(line)
+
+        writer.join()
+
+        return alignments
+
+    def close(self):
+        """ Stops the aligner process """
+
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.process.wait()
+
+
+class AlignerPool(object):
+    """ Pool of persistent aligner processes. The lines of each system are split into one
+        chunk per process, aligned in parallel and merged in order. The processes are started
+        by the first call to align, so no aligner is loaded if no system has to be aligned """
+
+    def __init__(self, command, workers):
+
+        self.command = command
+        self.workers = workers
+        self.aligners = list()
+        self.executor = ThreadPoolExecutor(workers)
+
+    def align(self, pairs):
+        """ Returns the list with the alignment lines of a list of "source ||| target" lines """
+
+        if not self.aligners:
+            self.aligners = [AlignerProcess(self.command) for _ in range(self.workers)]
+
+        chunks = sharding.line_ranges(len(pairs), len(self.aligners))
+        futures = [self.executor.submit(aligner.align, pairs[first:last])
+                   for aligner, (first, last) in zip(self.aligners, chunks)]
+
+        return [line for future in futures for line in future.result()]
+
+    def close(self):
+        """ Stops every aligner process """
+
+        self.executor.shutdown()
+        for aligner in self.aligners:
+            aligner.close()
+
+
+def aligner_input(src_lines, mt_lines):
+    """ Returns the "source ||| target" lines given to the aligner, as built by paste and sed
+        in run_several.sh """
+
+    assert len(src_lines) == len(mt_lines), "Source and predicted text files should have the same length"
+
+    return [(src.rstrip("\n") + "\t" + mt.rstrip("\n")).replace("\t", " ||| ")
+            for src, mt in zip(src_lines, mt_lines)]
+
+
+def system_result_key(args, n_grams_list, candidate):
+    """ Returns the paths and the parameters that identify the statistics of a system in the
+        result store. They are only reused if the system is aligned with the same command """
+
+    paths = args.reference + args.src_ref_align + [args.src_path]
+    if args.stopwords_path:
+        paths.append(args.stopwords_path)
+
+    params = {"n": n_grams_list, "w1": args.w1, "w2": args.w2, "nr_align": len(args.src_ref_align),
+              "stopwords": bool(args.stopwords_path), "aligner": args.aligner}
+
+    return paths + [candidate], params
+
+
+def score_systems(reference_set, src_lines, candidates, aligner_pool, w1, w2, store=None, result_keys=None):
+    """
+    Returns a list with the scores of each system (see batch_score.result_from_statistics).
+    The alignments are kept in memory, and the next system is aligned while the
+    current one is scored.
+
+    Inputs:
+    - reference_set : batch_score.ReferenceSet with the source/reference alignments
+    - src_lines     : list with the lines of the source file
+    - candidates    : list with the paths to the tokenized translations of each system
+    - aligner_pool  : AlignerPool used to align the source with each system
+    - w1, w2        : multipliers lambda 1 and lambda 2 of the REP-score
+    - store         : result_store.ResultStore with the statistics of previous runs (None to
+                      score every system)
+    - result_keys   : list with the key of each system in the store (None for the systems read
+                      from the standard input, which are never stored)
+    """
+
+    def align(candidate):
+        mt_lines = list(input_files.open_input(candidate))
+        alignments = aligner_pool.align(aligner_input(src_lines, mt_lines))
+        return mt_lines, drop_score.parse_alignments("".join(alignments).encode("utf-8"), 0)
+
+    # The systems whose files did not change are neither aligned nor scored again
+    all_arrays = [None for _ in candidates]
+    if store is not None:
+        all_arrays = [None if key is None else store.lookup("align_pipeline", key) for key in result_keys]
+    missing = [ix for ix, arrays in enumerate(all_arrays) if arrays is None]
+
+    with ThreadPoolExecutor(1) as executor:
+        future = executor.submit(align, candidates[missing[0]]) if missing else None
+
+        for position, ix in enumerate(missing):
+            mt_lines, src_mt_ixs = future.result()
+
+            # Start aligning the next system before scoring the current one
+            if position + 1 < len(missing):
+                future = executor.submit(align, candidates[missing[position+1]])
+
+            pred_sentence_list = [line.split() for line in mt_lines]
+            all_arrays[ix] = batch_score.statistics_to_arrays(
+                reference_set.sentence_statistics(pred_sentence_list, src_mt_ixs, w1, w2))
+
+            if store is not None and result_keys[ix] is not None:
+                store.store(result_keys[ix], all_arrays[ix])
+
+    return [batch_score.result_from_statistics(reference_set, batch_score.statistics_from_arrays(arrays))
+            for arrays in all_arrays]
+
+################################################################################################
+###                                     MAIN FUNCTION                                        ###
+################################################################################################
+
+def main():
+
+    parser = argparse.ArgumentParser()
+
+    # Optional arguments
+    rep_score.add_n_grams_argument(parser)
+    rep_score.add_weight_arguments(parser, tandem=False)
+    parser.add_argument("--aligner-workers", dest="aligner_workers", type=int, default=1,
+                        help="Number of persistent aligner processes")
+    drop_score.add_stopwords_arguments(parser, several=False, src_path=False)
+    reference_cache.add_cache_arguments(parser)
+    result_store.add_result_arguments(parser)
+
+    # Required arguments
+    required = parser.add_argument_group("required arguments")
+    required.add_argument("--aligner", type=str, required=True,
+                          help="Command of the aligner (e.g. \"python3 stub_aligner.py\")")
+    required.add_argument("--src_path", type=str, required=True,
+                          help="Path to the test source language file")
+    required.add_argument("--src_ref_align", nargs='+', required=True,
+                          help="Path to the source/reference alignments")
+    required.add_argument("-r", "--reference", nargs='+', required=True,
+                          help="Provide a list with the paths to the tokenized reference files")
+    required.add_argument("-p", "--predicted", nargs='+', required=True,
+                          help="Provide a list with the paths to the tokenized translations of each system")
+
+    args = parser.parse_args()
+
+    n_grams_list = rep_score.n_grams_from_arguments(args)
+    drop_score.check_stopwords_arguments(args, src_path=False)
+
+    # Compute the reference statistics only once
+    reference_set = batch_score.ReferenceSet(args.reference, n_grams_list, args.src_ref_align, args.src_path,
+                                             args.stopwords_path, reference_cache.cache_from_arguments(args))
+
+    if min(reference_set.nw_ref) == 0:
+        print("No valid reference file.")
+        exit(0)
+
+    src_lines = list(input_files.open_input(args.src_path))
+
+    store = result_store.store_from_arguments(args)
+    result_keys = None
+    if store is not None:
+        # The standard input can only be read once, so its results are never stored
+        result_keys = [None if input_files.is_stdin(candidate) else
+                       store.key("align_pipeline", *system_result_key(args, n_grams_list, candidate))
+                       for candidate in args.predicted]
+
+    aligner_pool = AlignerPool(shlex.split(args.aligner), args.aligner_workers)
+    try:
+        results = score_systems(reference_set, src_lines, args.predicted, aligner_pool, args.w1, args.w2,
+                                store, result_keys)
+    finally:
+        aligner_pool.close()
+
+    print(batch_score.format_table(args.predicted, results, n_grams_list))
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,103 @@
+import json
+import numpy as np
+
+################################################################################################
+###                                 AUXILIARY FUNCTIONS                                      ###
+################################################################################################
+
+# Binary alignment files start with the magic bytes and the version, followed by the length of
+# a json header and the header, which has the name, dtype, offset and length of every array
+MAGIC = b"ALIGNBIN"
+VERSION = 1
+EXTENSION = ".alignbin"
+
+# Every array starts at a multiple of this offset, so that it can be memory-mapped
+ALIGNMENT = 64
+
+
+def is_alignment_store(path):
+    """ Returns True if the path is a binary alignment file (see write_alignment_store) """
+
+    return path.endswith(EXTENSION)
+
+
+def padding(offset):
+    """ Returns the number of bytes needed to move an offset to the next multiple of ALIGNMENT """
+
+    return -offset % ALIGNMENT
+
+
+class AlignmentStore(object):
+    """ Arrays of one or more pre-parsed .align files, memory-mapped from a binary alignment
+        file, and the paths of the .align files it was converted from """
+
+    __slots__ = ("paths", "arrays")
+
+    def __init__(self, paths, arrays):
+        self.paths = paths
+        self.arrays = arrays
+
+    def __len__(self):
+        return len(self.paths)
+
+    def csr(self, name):
+        """ Returns the (ixs, offsets) pair of arrays stored as name_ixs and name_offsets """
+
+        return self.arrays[name + "_ixs"], self.arrays[name + "_offsets"]
+
+
+def write_alignment_store(path, paths, arrays):
+    """
+    Writes several arrays to a binary alignment file.
+
+    Inputs:
+    - path   : path to the binary alignment file
+    - paths  : list with the paths to the .align files the arrays come from
+    - arrays : dictionary with the arrays, by name
+    """
+
+    arrays = dict((name, np.ascontiguousarray(array)) for name, array in arrays.items())
+
+    # The offsets of the arrays are relative to the end of the header
+    entries = dict()
+    offset = 0
+    for name, array in arrays.items():
+        entries[name] = {"dtype": array.dtype.str, "offset": offset, "length": len(array)}
+        offset += array.nbytes + padding(array.nbytes)
+
+    header = json.dumps({"paths": list(paths), "arrays": entries}).encode("utf-8")
+    start = len(MAGIC) + 16 + len(header)
+
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.array([VERSION, len(header)], dtype="<u8").tobytes())
+        f.write(header)
+        f.write(b"\0" * padding(start))
+        for array in arrays.values():
+            f.write(array.tobytes())
+            f.write(b"\0" * padding(array.nbytes))
+
+
+def load_alignment_store(path):
+    """ Returns the AlignmentStore of a binary alignment file, with its arrays memory-mapped """
+
+    with open(path, 'rb') as f:
+        magic = f.read(len(MAGIC))
+        assert magic == MAGIC, "{} is not a binary alignment file".format(path)
+        version, header_length = np.frombuffer(f.read(16), dtype="<u8").tolist()
+        assert version == VERSION, "{} was written by another version, convert the .align files again".format(path)
+        header = json.loads(f.read(header_length).decode("utf-8"))
+
+    start = len(MAGIC) + 16 + header_length
+    start += padding(start)
+
+    arrays = dict()
+    for name, entry in header["arrays"].items():
+        # An empty array can not be memory-mapped
+        if entry["length"] == 0:
+            arrays[name] = np.zeros(0, dtype=entry["dtype"])
+        else:
+            arrays[name] = np.memmap(path, dtype=entry["dtype"], mode='r', offset=start + entry["offset"],
+                                     shape=(entry["length"],))
+
+    return AlignmentStore(header["paths"], arrays)
@@ -0,0 +1,267 @@
+import argparse
+import numpy as np
+
+import rep_score
+import bootstrap
+import drop_score
+import input_files
+import result_store
+import reference_cache
+
+################################################################################################
+###                                 AUXILIARY FUNCTIONS                                      ###
+################################################################################################
+
+class ReferenceSet(object):
+    """ Reference-side statistics that are computed once and shared by every scored system:
+        the reference n-gram profiles, the reference lengths and the indexes of the source
+        words aligned with the references """
+
+    def __init__(self, references, n_grams_list, src_ref_align=None, src_path=None, stopwords_path=None,
+                 cache=None):
+
+        self.references = references
+        self.n_grams_list = n_grams_list
+
+        # Reference profiles for every value of n and number of words of each reference
+        self.profiles, self.nw_ref = rep_score.load_reference_profiles(references, n_grams_list, cache)
+        self.nr_sentences = len(self.profiles[2])
+
+        # Source words that were aligned with some reference word, and the ones that are not stopwords
+        self.src_ref_ixs = None
+        self.src_ref_content = None
+        if src_ref_align:
+            self.src_ref_ixs, _ = drop_score.load_reference_statistics(src_ref_align, references, cache)
+            if stopwords_path:
+                self.src_ref_content, = drop_score.load_content_masks(self.src_ref_ixs, src_path,
+                                                                      [stopwords_path], cache)
+
+    def sentence_statistics(self, pred_sentence_list, src_mt_ixs, w1, w2):
+        """ Returns a dictionary with the per-sentence statistics of a system, whose sums give its
+            corpus scores: the number of words ("nw_can"), the final repetition score for each value
+            of n (("REP_SCORE", n)) and, if the source/prediction alignments are given, the number
+            of skipped ("nr_skipped") and aligned ("nr_aligned") source words """
+
+        statistics = self.rep_statistics(pred_sentence_list, w1, w2)
+
+        if src_mt_ixs is not None:
+            statistics.update(self.drop_statistics(src_mt_ixs))
+
+        return statistics
+
+    def rep_statistics(self, pred_sentence_list, w1, w2):
+        """ Returns the per-sentence statistics of the REP-score of a system (see sentence_statistics) """
+
+        assert len(pred_sentence_list) == self.nr_sentences, \
+                    "Reference and predicted text files should have the same length"
+
+        statistics = {"nw_can": [len(x) for x in pred_sentence_list]}
+
+        n_gram_scores, consec_scores = rep_score.profile_multi_rep_scores(self.profiles, pred_sentence_list,
+                                                                          self.n_grams_list)
+        for n_grams in self.n_grams_list:
+            statistics[("REP_SCORE", n_grams)] = rep_score.calculate_final_scores(n_gram_scores[n_grams],
+                                                                                  consec_scores, w1, w2)
+
+        return statistics
+
+    def drop_statistics(self, src_mt_ixs):
+        """ Returns the per-sentence statistics of the DROP-score of a system (see sentence_statistics),
+            given its source/prediction alignments in CSR layout """
+
+        src_ref_contents = [] if self.src_ref_content is None else [self.src_ref_content]
+        nr_skipped, nr_aligned = drop_score.sentence_dropped_words(self.src_ref_ixs, src_mt_ixs, src_ref_contents)
+
+        # The last row is the filtered one if stopwords are filtered
+        return {"nr_skipped": nr_skipped[-1], "nr_aligned": nr_aligned[-1]}
+
+    def sentence_lengths(self):
+        """ Returns a list with the number of words of each sentence of each reference """
+
+        return [ [len(line.split()) for line in input_files.open_input(path)] for path in self.references]
+
+
+def statistics_to_arrays(statistics):
+    """ Returns the arrays stored in the result store for the output of
+        ReferenceSet.sentence_statistics """
+
+    return dict(("{}_{}".format(*name) if isinstance(name, tuple) else name, np.asarray(values))
+                for name, values in statistics.items())
+
+
+def statistics_from_arrays(arrays):
+    """ Returns the output of ReferenceSet.sentence_statistics from the stored arrays """
+
+    statistics = dict()
+
+    for name, values in arrays.items():
+        if name.startswith("REP_SCORE_"):
+            statistics[("REP_SCORE", int(name[len("REP_SCORE_"):]))] = values.tolist()
+        elif name == "nw_can":
+            statistics[name] = values.tolist()
+        else:
+            statistics[name] = np.asarray(values)
+
+    return statistics
+
+
+def system_result_key(reference_set, args, candidate, align):
+    """ Returns the paths and the parameters that identify the statistics of a system in the
+        result store """
+
+    paths = list(reference_set.references) + list(args.src_ref_align or [])
+    if args.stopwords_path:
+        paths += [args.src_path, args.stopwords_path]
+    paths += [candidate] + ([align] if align else [])
+
+    params = {"n": reference_set.n_grams_list, "w1": args.w1, "w2": args.w2,
+              "nr_align": len(args.src_ref_align or []), "stopwords": bool(args.stopwords_path),
+              "drop": bool(align)}
+
+    return paths, params
+
+
+def result_from_statistics(reference_set, statistics):
+    """ Returns a dictionary with the scores of a single system against the reference set, given
+        its per-sentence statistics (see ReferenceSet.sentence_statistics) """
+
+    nw_can = sum(statistics["nw_can"])
+
+    result = dict()
+
+    # REP-score, normalized by the reference length closest to the prediction
+    ref_length = rep_score.closest_reference_length(reference_set.nw_ref, nw_can)
+    bp = rep_score.brevity_penalty(ref_length, nw_can)
+    result["BP"] = bp
+
+    for n_grams in reference_set.n_grams_list:
+        total_value = sum(statistics[("REP_SCORE", n_grams)])
+        result[("REP_SCORE", n_grams)] = total_value
+        result[("NORMALIZED_REP_SCORE", n_grams)] = bp*100*float(total_value)/ref_length
+
+    # DROP-score
+    if "nr_skipped" in statistics:
+        ref_length = drop_score.closest_reference_length(reference_set.nw_ref, nw_can)
+        lp = drop_score.length_penalty(ref_length, nw_can)
+        tot = int(statistics["nr_skipped"].sum())
+        nr_src_ref_aligned_words = int(statistics["nr_aligned"].sum())
+        result["LP"] = lp
+        result["DSW"] = drop_score.drop_score_value(tot, nr_src_ref_aligned_words, lp)
+
+    return result
+
+
+def format_table(names, results, n_grams_list):
+    """ Returns the results of every system as a tab separated table with one row per system """
+
+    columns = ["BP"]
+    for n_grams in n_grams_list:
+        columns += [("REP_SCORE", n_grams), ("NORMALIZED_REP_SCORE", n_grams)]
+    if any("DSW" in result for result in results):
+        columns += ["LP", "DSW"]
+
+    def header(column):
+        if isinstance(column, tuple):
+            return column[0] if len(n_grams_list) == 1 else "{}_{}".format(*column)
+        return column
+
+    def value(result, column):
+        if column not in result:
+            return "-"
+        if isinstance(column, tuple) and column[0] == "REP_SCORE":
+            return str(result[column])
+        return "{:.2f}".format(result[column])
+
+    lines = ["\t".join(["SYSTEM"] + [header(column) for column in columns])]
+    for name, result in zip(names, results):
+        lines.append("\t".join([name] + [value(result, column) for column in columns]))
+
+    return "\n".join(lines)
+
+################################################################################################
+###                                     MAIN FUNCTION                                        ###
+################################################################################################
+
+def main():
+
+    parser = argparse.ArgumentParser()
+
+    # Optional arguments
+    rep_score.add_n_grams_argument(parser)
+    rep_score.add_weight_arguments(parser, tandem=False)
+    parser.add_argument("--src_ref_align", nargs='+',
+                        help="Path to the source/reference alignments")
+    parser.add_argument("--src_mt_align", nargs='+',
+                        help="Path to the source/prediction alignments of each system (same order as -p)")
+    drop_score.add_stopwords_arguments(parser, several=False)
+    parser.add_argument("--bootstrap", type=int, default=0,
+                        help="Number of bootstrap resamples used to compute confidence intervals and p-values")
+    parser.add_argument("--confidence", type=float, default=bootstrap.DEFAULT_CONFIDENCE,
+                        help="Confidence level of the bootstrap intervals")
+    parser.add_argument("--seed", type=int, default=bootstrap.DEFAULT_SEED,
+                        help="Seed of the bootstrap resamples")
+    reference_cache.add_cache_arguments(parser)
+    result_store.add_result_arguments(parser)
+
+    # Required arguments
+    required = parser.add_argument_group("required arguments")
+    required.add_argument("-r", "--reference", nargs='+', required=True,
+                          help="Provide a list with the paths to the tokenized reference files")
+    required.add_argument("-p", "--predicted", nargs='+', required=True,
+                          help="Provide a list with the paths to the tokenized translations of each system")
+
+    args = parser.parse_args()
+
+    n_grams_list = rep_score.n_grams_from_arguments(args)
+    drop_score.check_stopwords_arguments(args)
+
+    if args.src_mt_align:
+        assert args.src_ref_align, "The source/reference alignments are needed to compute the DROP-score"
+        assert len(args.src_mt_align) == len(args.predicted), \
+                    "Provide one source/prediction alignment file for each system"
+
+    # Compute the reference statistics only once
+    reference_set = ReferenceSet(args.reference, n_grams_list, args.src_ref_align,
+                                 args.src_path, args.stopwords_path,
+                                 reference_cache.cache_from_arguments(args))
+
+    # The scores are normalized by the shortest reference (see rep_score.closest_reference_length),
+    # so they are undefined as soon as one of the references is empty
+    if min(reference_set.nw_ref) == 0:
+        print("No valid reference file.")
+        exit(0)
+
+    # Score every system against the same reference statistics, reusing the stored statistics
+    # of the systems whose files did not change
+    store = result_store.store_from_arguments(args)
+    src_mt_align = args.src_mt_align or [None for _ in args.predicted]
+    all_statistics = list()
+    for candidate, align in zip(args.predicted, src_mt_align):
+
+        def build():
+            pred_sentence_list = [line.split() for line in input_files.open_input(candidate)]
+            src_mt_ixs = drop_score.load_alignments(align, 0) if align else None
+            return statistics_to_arrays(reference_set.sentence_statistics(pred_sentence_list, src_mt_ixs,
+                                                                          args.w1, args.w2))
+
+        if store is None:
+            arrays = build()
+        else:
+            arrays = store.get("batch_score", *system_result_key(reference_set, args, candidate, align), build)
+
+        all_statistics.append(statistics_from_arrays(arrays))
+
+    results = [result_from_statistics(reference_set, statistics) for statistics in all_statistics]
+
+    print(format_table(args.predicted, results, n_grams_list))
+
+    if args.bootstrap > 0:
+        # Score every system on the same resamples of the sentences
+        all_samples = bootstrap.bootstrap_scores(reference_set.sentence_lengths(), all_statistics, n_grams_list,
+                                                 args.bootstrap, args.seed)
+        print()
+        print(bootstrap.format_bootstrap_table(args.predicted, results, all_samples, args.confidence))
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,432 @@
+import os
+import sys
+import json
+import argparse
+import platform
+import subprocess
+
+import numpy as np
+
+import rep_score
+import profiling
+import drop_score
+
+################################################################################################
+###                                 AUXILIARY FUNCTIONS                                      ###
+################################################################################################
+
+CORPUS_VERSION = 2
+RESULTS_VERSION = 1
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+DEFAULT_DATA_DIR = "benchmark_data"
+DEFAULT_TOLERANCE = 0.25
+DEFAULT_MIN_SECONDS = 0.05
+
+# Number of sentences generated at once
+GENERATE_CHUNK = 100000
+
+
+def generator_parameters(args):
+    """ Returns the dictionary with the parameters of a synthetic corpus """
+
+    return {"version": CORPUS_VERSION, "sentences": args.sentences, "references": args.references,
+            "repetition_rate": args.repetition_rate, "reference_repetition_rate": args.reference_repetition_rate,
+            "vocab_size": args.vocab_size, "stopwords": args.stopwords, "seed": args.seed}
+
+
+def draw_words(rng, nr_words, vocab_size):
+    """ Returns nr_words word ids with a Zipf distribution, so that the first ids are the most
+        frequent ones (the stopwords of the source) """
+
+    return (rng.zipf(1.3, nr_words) - 1) % vocab_size
+
+
+def repeat_words(rng, words, lengths, rate):
+    """ Returns the words and the sentence lengths after repeating each word with probability rate """
+
+    counts = 1 + (rng.random(len(words)) < rate)
+    sentence_ids = np.repeat(np.arange(len(lengths)), lengths)
+
+    return np.repeat(words, counts), np.bincount(sentence_ids, weights=counts, minlength=len(lengths)).astype(np.int64)
+
+
+def format_lines(prefix, words, lengths):
+    """ Returns the lines of a tokenized text, given the word ids and the length of each sentence """
+
+    vocab = np.array(["{}{}".format(prefix, ix) for ix in range(int(words.max()) + 1)] if len(words) else [],
+                     dtype=object)
+    tokens = vocab[words].tolist()
+    bounds = np.concatenate(([0], np.cumsum(lengths))).tolist()
+
+    return [" ".join(tokens[bounds[ix]:bounds[ix+1]]) + "\n" for ix in range(len(lengths))]
+
+
+def format_alignments(rng, src_lengths, tgt_lengths):
+    """ Returns the lines, in fast_align format, of a monotone alignment where each source word
+        is aligned with probability 0.85 (the first word of each sentence is always aligned) """
+
+    sentence_ids = np.repeat(np.arange(len(src_lengths)), src_lengths)
+    first = np.concatenate(([0], np.cumsum(src_lengths)[:-1]))
+    src_ixs = np.arange(len(sentence_ids)) - first[sentence_ids]
+    tgt_ixs = src_ixs * tgt_lengths[sentence_ids] // src_lengths[sentence_ids]
+
+    keep = (rng.random(len(src_ixs)) < 0.85) | (src_ixs == 0)
+    sentence_ids, src_ixs, tgt_ixs = sentence_ids[keep], src_ixs[keep], tgt_ixs[keep]
+
+    # Format every pair from a table of the "i-j" strings
+    width = int(tgt_ixs.max()) + 1
+    table = np.array(["{}-{}".format(i, j) for i in range(int(src_ixs.max()) + 1) for j in range(width)],
+                     dtype=object)
+    pairs = table[src_ixs * width + tgt_ixs].tolist()
+    bounds = np.concatenate(([0], np.cumsum(np.bincount(sentence_ids, minlength=len(src_lengths))))).tolist()
+
+    return [" ".join(pairs[bounds[ix]:bounds[ix+1]]) + "\n" for ix in range(len(src_lengths))]
+
+
+def generate_corpus(data_dir, parameters):
+    """
+    Writes a synthetic corpus to data_dir: the source (src), the references
+    (ref0, ref1, ...), the candidate (mt), the alignments of the source with
+    each of them (src_ref0.align, ..., src_mt.align), in fast_align format,
+    the binary alignment file of the references (src_ref.alignbin) and two
+    stopwords lists of the source (stopwords and stopwords_small).
+
+    The references and the candidate repeat each word with probability
+    reference_repetition_rate and repetition_rate, respectively. The
+    candidate is a copy of the first reference with 30% of the words
+    replaced, before the repetitions are added.
+    """
+
+    assert parameters["references"] >= 1, "The corpus needs at least one reference"
+
+    os.makedirs(data_dir, exist_ok=True)
+    if os.path.exists(os.path.join(data_dir, "corpus.json")):
+        os.remove(os.path.join(data_dir, "corpus.json"))
+
+    rng = np.random.default_rng(parameters["seed"])
+    vocab_size = parameters["vocab_size"]
+    nr_references = parameters["references"]
+
+    names = ["src", "mt", "src_mt.align"] + ["ref{}".format(k) for k in range(nr_references)] + \
+            ["src_ref{}.align".format(k) for k in range(nr_references)]
+    files = dict((name, open(os.path.join(data_dir, name), 'w')) for name in names)
+
+    try:
+        for first in range(0, parameters["sentences"], GENERATE_CHUNK):
+            nr_sentences = min(GENERATE_CHUNK, parameters["sentences"] - first)
+
+            src_lengths = rng.integers(3, 31, nr_sentences)
+            files["src"].writelines(format_lines("s", draw_words(rng, src_lengths.sum(), vocab_size), src_lengths))
+
+            for k in range(nr_references):
+                lengths = np.maximum(1, src_lengths + rng.integers(-2, 3, nr_sentences))
+                words = draw_words(rng, lengths.sum(), vocab_size)
+
+                if k == 0:
+                    replaced = rng.random(len(words)) < 0.3
+                    mt_words = np.where(replaced, draw_words(rng, len(words), vocab_size), words)
+                    mt_words, mt_lengths = repeat_words(rng, mt_words, lengths, parameters["repetition_rate"])
+
+                words, lengths = repeat_words(rng, words, lengths, parameters["reference_repetition_rate"])
+                files["ref{}".format(k)].writelines(format_lines("t", words, lengths))
+                files["src_ref{}.align".format(k)].writelines(format_alignments(rng, src_lengths, lengths))
+
+            files["mt"].writelines(format_lines("t", mt_words, mt_lengths))
+            files["src_mt.align"].writelines(format_alignments(rng, src_lengths, mt_lengths))
+
+    finally:
+        for f in files.values():
+            f.close()
+
+    # The most frequent source words are the stopwords
+    with open(os.path.join(data_dir, "stopwords"), 'w') as f:
+        f.writelines("s{}\n".format(ix) for ix in range(parameters["stopwords"]))
+    with open(os.path.join(data_dir, "stopwords_small"), 'w') as f:
+        f.writelines("s{}\n".format(ix) for ix in range(max(1, parameters["stopwords"] // 4)))
+
+    drop_score.convert_alignments([os.path.join(data_dir, "src_ref{}.align".format(k)) for k in range(nr_references)],
+                                  os.path.join(data_dir, "src_ref.alignbin"))
+
+    # Written last, so that an interrupted run is generated again
+    with open(os.path.join(data_dir, "corpus.json"), 'w') as f:
+        json.dump(parameters, f)
+
+
+def corpus_exists(data_dir, parameters):
+    """ Returns True if data_dir has a complete corpus generated with the same parameters """
+
+    try:
+        with open(os.path.join(data_dir, "corpus.json"), 'r') as f:
+            return json.load(f) == parameters
+    except (OSError, ValueError):
+        return False
+
+
+def benchmark_rep(data_dir, n_grams_list):
+    """ Times the stages of rep_score.py (python engine) and of the numpy engine """
+
+    corpus = json.load(open(os.path.join(data_dir, "corpus.json"), 'r'))
+    references = [os.path.join(data_dir, "ref{}".format(k)) for k in range(corpus["references"])]
+    all_n_grams = sorted(set(n_grams_list) | {2})
+    timer = profiling.Profiler()
+
+    with timer.stage("read"):
+        ref_sentence_list = [ [line.split() for line in open(path, 'r')] for path in references]
+        pred_sentence_list = [line.split() for line in open(os.path.join(data_dir, "mt"), 'r')]
+
+    with timer.stage("create_ngram_sentence_list"):
+        n_gram_pred_sentence_lists = [rep_score.create_ngram_sentence_list(pred_sentence_list, n_grams)
+                                      for n_grams in all_n_grams]
+
+    with timer.stage("count_repetitions"):
+        for n_gram_pred_sentence_list in n_gram_pred_sentence_lists:
+            rep_score.count_repetitions(n_gram_pred_sentence_list, 0)
+
+    del n_gram_pred_sentence_lists
+
+    with timer.stage("build_reference_profiles"):
+        ref_profiles = rep_score.build_reference_profile_lists(ref_sentence_list, n_grams_list)
+
+    with timer.stage("profile_scores"):
+        rep_score.profile_multi_rep_scores(ref_profiles, pred_sentence_list, n_grams_list)
+
+    del ref_profiles
+
+    with timer.stage("numpy_scores"):
+        rep_score.numpy_multi_rep_scores(ref_sentence_list, pred_sentence_list, n_grams_list)
+
+    return timer.stages
+
+
+def benchmark_drop(data_dir):
+    """ Times the stages of drop_score.py, filtering the stopwords """
+
+    corpus = json.load(open(os.path.join(data_dir, "corpus.json"), 'r'))
+    src_ref_align = [os.path.join(data_dir, "src_ref{}.align".format(k)) for k in range(corpus["references"])]
+    src_mt_align = os.path.join(data_dir, "src_mt.align")
+    stopwords_paths = [os.path.join(data_dir, name) for name in ("stopwords", "stopwords_small")]
+    timer = profiling.Profiler()
+
+    with timer.stage("list_of_indeces"):
+        drop_score.list_of_indeces(src_mt_align, 0)
+
+    with timer.stage("parse_alignments"):
+        all_src_ref_ixs = [drop_score.load_alignments(path, 0) for path in src_ref_align]
+        src_mt_ixs = drop_score.load_alignments(src_mt_align, 0)
+
+    with timer.stage("union_alignments"):
+        src_ref_ixs = drop_score.union_alignments(all_src_ref_ixs)
+
+    with timer.stage("load_alignment_store"):
+        drop_score.load_reference_alignments([os.path.join(data_dir, "src_ref.alignbin")])
+
+    with timer.stage("content_masks"):
+        source_words = drop_score.load_source_words(os.path.join(data_dir, "src"))
+        stopword_lists = [drop_score.load_stopwords(path) for path in stopwords_paths]
+        src_ref_contents = drop_score.content_masks(src_ref_ixs, source_words, stopword_lists)
+
+    with timer.stage("count_dropped_words"):
+        drop_score.count_dropped_words_masks(src_ref_ixs, src_mt_ixs, src_ref_contents)
+
+    return timer.stages
+
+
+BENCHMARKS = ["rep", "drop"]
+
+
+def measure(benchmark, data_dir, n_grams_list, repeat):
+    """ Returns the stages of a benchmark, each one run in a new process repeat times, keeping
+        the fastest time and the smallest peak memory of every stage """
+
+    stages = dict()
+
+    for _ in range(repeat):
+        command = [sys.executable, os.path.abspath(__file__), "measure", benchmark, data_dir,
+                   "-n"] + [str(n_grams) for n_grams in n_grams_list]
+        output = json.loads(subprocess.run(command, check=True, stdout=subprocess.PIPE).stdout)
+
+        for name, values in output.items():
+            if name not in stages:
+                stages[name] = values
+            else:
+                stages[name] = dict((key, min(stages[name][key], values[key])) for key in values)
+
+    return stages
+
+
+def compare_results(results, baseline, tolerance, memory_tolerance, min_seconds):
+    """
+    Returns a list with one row for each stage of the baseline that is also
+    in the results, and the number of regressions. A stage regresses if it is
+    slower than the baseline by more than tolerance (and by more than
+    min_seconds, to ignore the noise of the fastest stages), or if its peak
+    memory grows by more than memory_tolerance.
+    """
+
+    rows = list()
+    nr_regressions = 0
+
+    for size, benchmarks in baseline["results"].items():
+        for benchmark, stages in benchmarks.items():
+            for name, base in stages.items():
+                current = results["results"].get(size, dict()).get(benchmark, dict()).get(name)
+                if current is None:
+                    continue
+
+                ratio = current["seconds"] / base["seconds"] if base["seconds"] > 0 else 1.0
+                memory_ratio = current["peak_memory_kb"] / base["peak_memory_kb"] if base["peak_memory_kb"] else 1.0
+
+                status = "ok"
+                if ratio > 1 + tolerance and current["seconds"] - base["seconds"] > min_seconds:
+                    status = "SLOWER"
+                elif memory_ratio > 1 + memory_tolerance:
+                    status = "MEMORY"
+                elif ratio < 1 - tolerance and base["seconds"] - current["seconds"] > min_seconds:
+                    status = "faster"
+
+                nr_regressions += status in ("SLOWER", "MEMORY")
+                rows.append((size, benchmark, name, current["seconds"], base["seconds"], ratio,
+                             current["peak_memory_kb"], base["peak_memory_kb"], status))
+
+    return rows, nr_regressions
+
+
+def format_comparison(rows):
+    """ Returns a tab separated table with the comparison of the results with the baseline """
+
+    lines = ["\t".join(["SIZE", "BENCHMARK", "STAGE", "SECONDS", "BASELINE", "RATIO", "PEAK_MB", "BASELINE_MB",
+                        "STATUS"])]
+
+    for size, benchmark, name, seconds, base_seconds, ratio, memory, base_memory, status in rows:
+        lines.append("{}\t{}\t{}\t{:.3f}\t{:.3f}\t{:.2f}\t{:.1f}\t{:.1f}\t{}".format(
+            size, benchmark, name, seconds, base_seconds, ratio, memory/1024, base_memory/1024, status))
+
+    return "\n".join(lines)
+
+
+def format_results(results):
+    """ Returns a tab separated table with the time and the peak memory of each stage """
+
+    lines = ["\t".join(["SIZE", "BENCHMARK", "STAGE", "SECONDS", "PEAK_MB"])]
+
+    for size, benchmarks in results["results"].items():
+        for benchmark, stages in benchmarks.items():
+            for name, values in stages.items():
+                lines.append("{}\t{}\t{}\t{:.3f}\t{:.1f}".format(size, benchmark, name, values["seconds"],
+                                                                values["peak_memory_kb"]/1024))
+
+    return "\n".join(lines)
+
+################################################################################################
+###                                     MAIN FUNCTION                                        ###
+################################################################################################
+
+def add_generator_arguments(parser):
+    """ Adds the arguments of the synthetic corpus generator to a parser """
+
+    parser.add_argument("--references", type=int, default=2,
+                        help="Number of references")
+    parser.add_argument("--repetition-rate", dest="repetition_rate", type=float, default=0.1,
+                        help="Probability of repeating each word of the candidate")
+    parser.add_argument("--reference-repetition-rate", dest="reference_repetition_rate", type=float, default=0.02,
+                        help="Probability of repeating each word of the references")
+    parser.add_argument("--vocab-size", dest="vocab_size", type=int, default=5000,
+                        help="Number of different words of each language")
+    parser.add_argument("--stopwords", type=int, default=20,
+                        help="Number of words in the stopwords list (a quarter of them in stopwords_small)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of the random number generator")
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    generate = subparsers.add_parser("generate", help="Write a synthetic corpus")
+    generate.add_argument("data_dir", type=str,
+                          help="Directory where the corpus is written")
+    generate.add_argument("--sentences", type=int, default=DEFAULT_SIZES[0],
+                          help="Number of sentences")
+    add_generator_arguments(generate)
+
+    run = subparsers.add_parser("run", help="Time every stage of both scripts on synthetic corpora")
+    run.add_argument("--sizes", type=int, nargs='+', default=DEFAULT_SIZES,
+                     help="Number of sentences of each corpus")
+    run.add_argument("--data-dir", dest="data_dir", type=str, default=DEFAULT_DATA_DIR,
+                     help="Directory with the corpora (generated if missing)")
+    run.add_argument("--benchmarks", nargs='+', choices=BENCHMARKS, default=BENCHMARKS,
+                     help="Benchmarks to run")
+    run.add_argument("-n", type=int, nargs='+', default=[2],
+                     help="Values of n-grams used by the REP-score benchmark")
+    run.add_argument("--repeat", type=int, default=1,
+                     help="Number of runs of each benchmark (the fastest one is kept)")
+    run.add_argument("--output", type=str,
+                     help="Path of the json file with the results")
+    run.add_argument("--baseline", type=str,
+                     help="Path of the json file with the results to compare with")
+    run.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                     help="Relative slowdown of a stage reported as a regression")
+    run.add_argument("--memory-tolerance", dest="memory_tolerance", type=float, default=DEFAULT_TOLERANCE,
+                     help="Relative growth of the peak memory of a stage reported as a regression")
+    run.add_argument("--min-seconds", dest="min_seconds", type=float, default=DEFAULT_MIN_SECONDS,
+                     help="Slowdowns smaller than this number of seconds are not regressions")
+    add_generator_arguments(run)
+
+    # Used by run, to measure each benchmark in a new process
+    measure_parser = subparsers.add_parser("measure")
+    measure_parser.add_argument("benchmark", choices=BENCHMARKS)
+    measure_parser.add_argument("data_dir", type=str)
+    measure_parser.add_argument("-n", type=int, nargs='+', default=[2])
+
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        generate_corpus(args.data_dir, generator_parameters(args))
+
+    elif args.command == "measure":
+        if args.benchmark == "rep":
+            stages = benchmark_rep(args.data_dir, list(dict.fromkeys(args.n)))
+        else:
+            stages = benchmark_drop(args.data_dir)
+        print(json.dumps(stages))
+
+    else:
+        assert all(n_grams >= 1 for n_grams in args.n), "n must be strictly positive"
+        n_grams_list = list(dict.fromkeys(args.n))
+
+        results = {"version": RESULTS_VERSION, "python": platform.python_version(), "numpy": np.__version__,
+                   "machine": platform.machine(), "n": n_grams_list, "results": dict()}
+
+        for size in args.sizes:
+            args.sentences = size
+            parameters = generator_parameters(args)
+            data_dir = os.path.join(args.data_dir, "n{}".format(size))
+
+            if not corpus_exists(data_dir, parameters):
+                generate_corpus(data_dir, parameters)
+
+            results["results"][str(size)] = dict((benchmark, measure(benchmark, data_dir, n_grams_list, args.repeat))
+                                                 for benchmark in args.benchmarks)
+
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+
+        if args.baseline:
+            baseline = json.load(open(args.baseline, 'r'))
+            rows, nr_regressions = compare_results(results, baseline, args.tolerance, args.memory_tolerance,
+                                                   args.min_seconds)
+            print(format_comparison(rows))
+
+            if nr_regressions > 0:
+                print("{} regressions".format(nr_regressions))
+                exit(1)
+        else:
+            print(format_results(results))
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,170 @@
+import numpy as np
+
+################################################################################################
+###                                 AUXILIARY FUNCTIONS                                      ###
+################################################################################################
+
+DEFAULT_CONFIDENCE = 0.95
+DEFAULT_SEED = 12345
+
+# Maximum number of elements of the matrix of resampled sentences built at once
+MAX_BLOCK_SIZE = 1 << 24
+
+
+def resample_sums(values, nr_samples, seed=DEFAULT_SEED):
+    """
+    Returns a (nr_samples, nr_columns) array with the sums of the columns of
+    values over each bootstrap resample of the sentences.
+
+    The resampled sentence indeces are drawn as a (nr_samples, nr_sentences)
+    matrix, in blocks of rows to bound the memory, and turned into a matrix
+    with the number of times each sentence is drawn in each resample, so that
+    the sums are a single matrix product.
+
+    Inputs:
+    - values     : (nr_sentences, nr_columns) array with the per-sentence
+                   statistics
+    - nr_samples : number of bootstrap resamples
+    - seed       : seed of the random number generator
+    """
+
+    rng = np.random.default_rng(seed)
+    nr_sentences = values.shape[0]
+    sums = np.zeros((nr_samples, values.shape[1]))
+
+    if nr_sentences == 0:
+        return sums
+
+    block_size = max(1, MAX_BLOCK_SIZE // nr_sentences)
+
+    for first in range(0, nr_samples, block_size):
+        last = min(first + block_size, nr_samples)
+
+        ixs = rng.integers(0, nr_sentences, size=(last-first, nr_sentences))
+        ixs += np.arange(last-first)[:, None] * nr_sentences
+        counts = np.bincount(ixs.ravel(), minlength=(last-first)*nr_sentences).reshape(last-first, nr_sentences)
+
+        sums[first:last] = counts.astype(np.float64) @ values
+
+    return sums
+
+
+def closest_reference_lengths(ref_lengths, pred_lengths):
+    """ Returns, for each resample, the number of words of the reference chosen by
+        rep_score.closest_reference_length, given the (nr_samples, nr_references) numbers of
+        words of the references and the nr_samples numbers of words of the prediction """
+
+    choice = np.argmin(ref_lengths - pred_lengths[:, None], axis=1)
+
+    return ref_lengths[np.arange(len(choice)), choice]
+
+
+def brevity_penalties(ref_lengths, pred_lengths):
+    """ Returns rep_score.brevity_penalty for each resample """
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(pred_lengths < ref_lengths, 1/np.exp(1-(ref_lengths/pred_lengths)), 1.0)
+
+
+def length_penalties(ref_lengths, cnd_lengths):
+    """ Returns drop_score.length_penalty for each resample """
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(cnd_lengths > ref_lengths, 1/np.exp(1-(cnd_lengths/ref_lengths)), 1.0)
+
+
+def bootstrap_scores(ref_sentence_lengths, all_statistics, n_grams_list, nr_samples, seed=DEFAULT_SEED):
+    """
+    Returns, for each system, a dictionary with the scores of every resample
+    for each metric (("NORMALIZED_REP_SCORE", n) and "DSW"). Every system is
+    scored on the same resamples, so the scores are paired.
+
+    Inputs:
+    - ref_sentence_lengths : list with the number of words of each sentence of
+                             each reference
+    - all_statistics       : list with the per-sentence statistics of each
+                             system (see batch_score.ReferenceSet.sentence_statistics)
+    - n_grams_list         : list with the values of n of the REP-score
+    - nr_samples           : number of bootstrap resamples
+    - seed                 : seed of the random number generator
+    """
+
+    nr_sentences = len(ref_sentence_lengths[0])
+
+    # One column for each per-sentence statistic of the references and of every system
+    columns = [np.asarray(lengths, dtype=np.float64) for lengths in ref_sentence_lengths]
+    positions = list()
+
+    for statistics in all_statistics:
+        position = dict()
+        for name, values in statistics.items():
+            # The alignments can have less sentences than the prediction
+            position[name] = len(columns)
+            columns.append(np.pad(np.asarray(values, dtype=np.float64), (0, nr_sentences - len(values))))
+        positions.append(position)
+
+    sums = resample_sums(np.stack(columns, axis=1), nr_samples, seed)
+    ref_lengths = sums[:, :len(ref_sentence_lengths)]
+
+    all_samples = list()
+
+    for position in positions:
+        samples = dict()
+        nw_can = sums[:, position["nw_can"]]
+        ref_length = closest_reference_lengths(ref_lengths, nw_can)
+
+        bp = brevity_penalties(ref_length, nw_can)
+        for n_grams in n_grams_list:
+            total_value = sums[:, position[("REP_SCORE", n_grams)]]
+            samples[("NORMALIZED_REP_SCORE", n_grams)] = bp*100*total_value/ref_length
+
+        if "nr_skipped" in position:
+            lp = length_penalties(ref_length, nw_can)
+            samples["DSW"] = lp*100*sums[:, position["nr_skipped"]]/sums[:, position["nr_aligned"]]
+
+        all_samples.append(samples)
+
+    return all_samples
+
+
+def confidence_interval(samples, confidence=DEFAULT_CONFIDENCE):
+    """ Returns the (low, high) percentile interval of the scores of the resamples """
+
+    alpha = 100*(1-confidence)/2
+
+    return tuple(np.nanpercentile(samples, [alpha, 100-alpha]).tolist())
+
+
+def paired_p_value(samples, baseline_samples, observed_delta):
+    """ Returns the fraction of resamples where the difference between a system and the baseline
+        does not have the same sign as the observed difference (paired bootstrap resampling) """
+
+    # Systems with the same score are never significantly different
+    if observed_delta == 0:
+        return 1.0
+
+    deltas = samples - baseline_samples
+
+    return float(np.mean(np.sign(deltas) != np.sign(observed_delta)))
+
+
+def format_bootstrap_table(names, results, all_samples, confidence=DEFAULT_CONFIDENCE):
+    """ Returns a tab separated table with the score, the confidence interval and the p-value of
+        the difference with the first system (the baseline) for each system and metric """
+
+    lines = ["\t".join(["SYSTEM", "METRIC", "SCORE", "CI_LOW", "CI_HIGH", "P_VALUE"])]
+
+    for ix, (name, result, samples) in enumerate(zip(names, results, all_samples)):
+        for metric in samples:
+            header = metric if isinstance(metric, str) else "{}_{}".format(*metric)
+            low, high = confidence_interval(samples[metric], confidence)
+
+            p_value = "-"
+            if ix > 0:
+                observed_delta = result[metric] - results[0][metric]
+                p_value = "{:.4f}".format(paired_p_value(samples[metric], all_samples[0][metric], observed_delta))
+
+            lines.append("{}\t{}\t{:.2f}\t{:.2f}\t{:.2f}\t{}".format(name, header, result[metric], low, high,
+                                                                    p_value))
+
+    return "\n".join(lines)
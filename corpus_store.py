@@ -0,0 +1,121 @@
+import array
+import argparse
+import numpy as np
+
+import input_files
+import reference_cache
+
+################################################################################################
+###                                 AUXILIARY FUNCTIONS                                      ###
+################################################################################################
+
+def encode_lines(lines, separator=None):
+    """
+    Returns the words of a text file interned in a vocabulary.
+
+    Inputs:
+    - lines     : iterable with the lines of the file
+    - separator : None to split the lines as line.split() (rep_score.py), or
+                  " " to split them as line.strip("\\n").split(" "), which
+                  keeps the positions used by the alignments (drop_score.py)
+
+    Outputs:
+    - vocab   : list with the distinct words
+    - tokens  : int32 array with the index in vocab of each word
+    - offsets : int64 array with the position of the first word of each
+                sentence in tokens, followed by the number of words
+    """
+
+    vocab = dict()
+    tokens = array.array('i')
+    offsets = array.array('q', [0])
+
+    for line in lines:
+        words = line.split() if separator is None else line.strip("\n").split(separator)
+        tokens.extend([vocab.setdefault(word, len(vocab)) for word in words])
+        offsets.append(len(tokens))
+
+    return list(vocab), np.frombuffer(tokens, dtype=np.int32), np.frombuffer(offsets, dtype=np.int64)
+
+
+class TokenCorpus(object):
+    """ Tokenized text file stored as a flat int32 array with the index of each word in the
+        vocabulary and an int64 array with the offset of each sentence (see encode_lines).
+        The arrays are memory-mapped when the corpus is read from the store """
+
+    __slots__ = ("vocab", "tokens", "offsets")
+
+    def __init__(self, vocab, tokens, offsets):
+        self.vocab = vocab
+        self.tokens = tokens
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def sentence(self, ix):
+        """ Returns the list with the words of a sentence """
+        return [self.vocab[token] for token in self.tokens[self.offsets[ix]:self.offsets[ix+1]]]
+
+    def lengths(self):
+        """ Returns an int64 array with the number of words of each sentence """
+        return np.diff(self.offsets)
+
+
+def load_corpus(path, cache=None, separator=None):
+    """ Returns the TokenCorpus of a text file, reading it from the store (the reference
+        cache) when possible, so that each file is tokenized only once """
+
+    if cache is None:
+        return TokenCorpus(*encode_lines(input_files.open_input(path), separator))
+
+    def build():
+        vocab, tokens, offsets = encode_lines(input_files.open_input(path), separator)
+        return {"vocab": reference_cache.encode_strings(vocab), "tokens": tokens, "offsets": offsets}
+
+    arrays = cache.get("corpus", [path], {"separator": separator}, build)
+
+    return TokenCorpus(reference_cache.decode_strings(arrays["vocab"]), arrays["tokens"], arrays["offsets"])
+
+
+def shared_vocabulary(corpora):
+    """ Returns the size of the union of the vocabularies of several corpora and, for each
+        corpus, an int32 array that maps its token indexes to the indexes in the union """
+
+    vocab = dict()
+    mappings = [np.array([vocab.setdefault(word, len(vocab)) for word in corpus.vocab], dtype=np.int32)
+                for corpus in corpora]
+
+    return len(vocab), mappings
+
+################################################################################################
+###                                     MAIN FUNCTION                                        ###
+################################################################################################
+
+def main():
+
+    parser = argparse.ArgumentParser()
+
+    # Optional arguments
+    parser.add_argument("--source", action="store_true",
+                        help="Split the lines on single spaces, as the source file of drop_score.py")
+    reference_cache.add_cache_arguments(parser)
+
+    # Required arguments
+    required = parser.add_argument_group("required arguments")
+    required.add_argument("paths", nargs='+',
+                          help="Paths to the text files added to the store")
+
+    args = parser.parse_args()
+
+    cache = reference_cache.cache_from_arguments(args)
+    assert cache is not None, "The corpus store is kept in the cache directory"
+
+    for path in args.paths:
+        corpus = load_corpus(path, cache, " " if args.source else None)
+        print("{}\t{} sentences\t{} words\t{} distinct words".format(path, len(corpus), len(corpus.tokens),
+                                                                     len(corpus.vocab)))
+
+if __name__ == "__main__":
+
+    main()
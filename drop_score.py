@@ -1,12 +1,26 @@
+import sys
 import math
 import operator
 import argparse
-from itertools import chain
+
+import numpy as np
+
+import sharding
+import profiling
+import input_files
+import corpus_store
+import result_store
+import alignment_store
+import reference_cache
 
 ##########################################################################################
 ###                                AUXILIARY FUNCTIONS                                ####
 ##########################################################################################
 
+# Names of the arrays of each side of the alignments in the binary alignment files
+ALIGNMENT_SIDES = ("src", "tgt")
+
+
 def list_of_indeces(path, index):
 
     """
@@ -26,7 +40,7 @@ def list_of_indeces(path, index):
     assert index in [0,1], "Index has to be 0 or 1"
     assert isinstance(list_, list)
     
-    for line in open(path, "r"):
+    for line in input_files.open_input(path):
         
         # Skip the headers lines
         if line[0] == "<":
@@ -47,106 +61,835 @@ def list_of_indeces(path, index):
     return list_
 
 
-def calculate_score(src_ref_ixs, src_mt_ixs, lp, src_words, stopwords, filter_stopwords):
+def parse_integers(buffer):
+
     """
-    Prints the final score of dropped words according to alignments.
-    
+    Returns the non-negative integers written in decimal in a text, in order.
+    Any character other than a digit separates two integers.
+
     Inputs:
-    - src_ref_ixs      : list of lists with the index of source words that
-                         aligned with reference words
-    - src_mt_ixs       : list of lists with the index of source words that
-                         aligned with mt predicted words
-    - lp               : float with the length penalty value
-    - src_words        : list of lists with the source words
-    - stopwords        : list with the stop words for the source language
-    - filter_stopwords : boolean that indicates whether stopwords are dropped or not
+    - buffer : uint8 array with the bytes of the text
 
     Outputs:
-    - individual_scores: list with the individual scores
+    - values : int64 array with the integers
     """
 
-    tot = 0
-    nr_src_ref_aligned_words = 0
-    individual_scores = list()   
- 
-    for (src_ref, src_mt, words) in zip(src_ref_ixs, src_mt_ixs, src_words):
-        
-        # Create list with the src words ixs that aligned with something
-        # of the reference but not with anything from the mt    
-        skipped_ixs = set(src_ref) - set(src_mt)
+    positions = np.flatnonzero((buffer >= ord("0")) & (buffer <= ord("9")))
+    digits = (buffer[positions] - ord("0")).astype(np.int64)
 
-        if filter_stopwords:
+    # An integer starts at each digit that does not follow another digit
+    starts = np.flatnonzero(np.diff(positions, prepend=-2) != 1)
+    lengths = np.diff(np.append(starts, len(positions)))
 
-            for value in skipped_ixs:
-                if words[int(value)] not in stopwords:
-                    tot += 1
-        
-            for value in src_ref:
-                if words[int(value)] not in stopwords:
-                    nr_src_ref_aligned_words +=1
+    # Add one digit at a time to the integers that are long enough (indeces have few digits)
+    values = digits[starts]
+    for k in range(1, lengths.max(initial=1)):
+        longer = lengths > k
+        values[longer] = 10*values[longer] + digits[starts[longer] + k]
 
-        else:
+    return values
 
-            tot += len(skipped_ixs)
-            nr_src_ref_aligned_words += len(src_ref)
-    
-        individual_scores.append(float(len(skipped_ixs))/len(src_ref))
 
-    print("LP: {:.2f} DSW: {:.2f}".format(lp,
-                                          lp*100*float(tot)/nr_src_ref_aligned_words))
+def parse_alignments(data, index, profiler=profiling.NULL_PROFILER):
+
+    """
+    Returns the indeces that were aligned for each sentence, according to
+    its index, in CSR layout. The number of alignment pairs parsed is added
+    to the alignment_pairs counter of the profiler.
+
+    Inputs:
+    - data     : bytes with the content of an .align file
+    - index    : 0 (source language) / 1 (target language)
+    - profiler : profiling.Profiler that counts the alignment pairs
+
+    Outputs:
+    - ixs     : int32 array with the distinct aligned indeces of every
+                sentence, sorted within each sentence
+    - offsets : int64 array with the offset of each sentence in ixs
+    """
+
+    assert index in [0,1], "Index has to be 0 or 1"
+
+    # Skip the headers lines
+    if data.startswith(b"<") or b"\n<" in data:
+        data = b"\n".join([line for line in data.split(b"\n") if not line.startswith(b"<")])
+
+    buffer = np.frombuffer(data, dtype=np.uint8)
+
+    # Find where each line starts (a final newline does not start a new line)
+    starts = np.flatnonzero(buffer == ord("\n")) + 1
+    starts = np.concatenate([np.zeros(1, dtype=np.int64), starts[starts < len(buffer)]])
+    nr_sentences = len(starts) if len(buffer) else 0
+
+    # Each alignment pair has one dash, which gives the number of pairs of each line
+    dashes = np.flatnonzero(buffer == ord("-"))
+    pair_sentences = np.searchsorted(starts, dashes, side='right') - 1
+
+    # Without any pair (e.g. only empty lines) there is nothing to parse
+    pairs = np.zeros(0, dtype=np.int64)
+    if len(dashes):
+        pairs = parse_integers(buffer)
+    assert len(pairs) == 2*len(dashes), "Alignments should be pairs of indeces separated by '-'"
+    profiler.count("alignment_pairs", len(dashes))
+
+    return sentence_unique(pair_sentences, pairs[index::2], nr_sentences)
+
+
+def load_alignments(path, index, profiler=profiling.NULL_PROFILER):
+
+    """
+    Returns the output of parse_alignments for an .align file.
+
+    Inputs:
+    - path     : path to an .align file, or to a binary alignment file
+                 converted from a single .align file (whose pairs are not
+                 parsed, so they are not counted)
+    - index    : 0 (source language) / 1 (target language)
+    - profiler : profiling.Profiler that counts the alignment pairs
+    """
+
+    if alignment_store.is_alignment_store(path):
+        store = alignment_store.load_alignment_store(path)
+        assert len(store) == 1, "{} has the alignments of several files, give it alone as --src_ref_align".format(path)
+        return store.csr(ALIGNMENT_SIDES[index] + "0")
+
+    return parse_alignments(input_files.read_input(path), index, profiler)
+
+
+def load_reference_alignments(src_ref_align):
+    """
+    Returns the union of the source indeces aligned with every reference,
+    in CSR layout (see union_alignments).
+
+    Inputs:
+    - src_ref_align : list with the paths to the source/reference alignments,
+                      or with a single binary alignment file, whose union is
+                      precomputed
+    """
+
+    if len(src_ref_align) == 1 and alignment_store.is_alignment_store(src_ref_align[0]):
+        return alignment_store.load_alignment_store(src_ref_align[0]).csr("union")
+
+    return union_alignments([load_alignments(path, 0) for path in src_ref_align])
+
+
+def sentence_unique(sentence_ids, values, nr_sentences):
+    """
+    Returns the distinct values of each sentence in CSR layout (see parse_alignments).
+
+    Inputs:
+    - sentence_ids : int array with the sentence of each value
+    - values       : int array with the values
+    - nr_sentences : number of sentences
+    """
+
+    width = int(values.max()) + 1 if len(values) else 1
+
+    # Sort the (sentence, value) codes and keep the first of each run of equal codes
+    codes = np.sort(sentence_ids.astype(np.int64) * width + values)
+    codes = codes[np.concatenate([[True], codes[1:] != codes[:-1]])] if len(codes) else codes
+
+    offsets = np.zeros(nr_sentences+1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(codes // width, minlength=nr_sentences))
+
+    return (codes % width).astype(np.int32), offsets
+
+
+def sentence_ids(offsets):
+    """ Returns an int64 array with the sentence of each value of a CSR layout """
+
+    return np.repeat(np.arange(len(offsets)-1), np.diff(offsets))
+
+
+def truncate_alignments(alignments, nr_sentences):
+    """ Returns the first nr_sentences sentences of alignments in CSR layout """
+
+    ixs, offsets = alignments
+
+    return ixs[:offsets[nr_sentences]], offsets[:nr_sentences+1]
+
+
+def slice_alignments(alignments, first, last):
+    """ Returns the sentences first to last-1 of alignments in CSR layout, clipped to the
+        number of sentences of the alignments """
+
+    ixs, offsets = alignments
+    first, last = min(first, len(offsets)-1), min(last, len(offsets)-1)
+
+    return ixs[offsets[first]:offsets[last]], offsets[first:last+1] - offsets[first]
+
+
+def union_alignments(all_alignments):
+    """
+    Returns the sentence by sentence union of the aligned indeces of several
+    references, in CSR layout.
+
+    Inputs:
+    - all_alignments : list with the output of load_alignments for each reference
+    """
+
+    # As with zip, only the sentences present in every reference are kept
+    nr_sentences = min(len(offsets)-1 for _, offsets in all_alignments)
+    all_alignments = [truncate_alignments(x, nr_sentences) for x in all_alignments]
+
+    if len(all_alignments) == 1:
+        return all_alignments[0]
+
+    return sentence_unique(np.concatenate([sentence_ids(offsets) for _, offsets in all_alignments]),
+                           np.concatenate([ixs for ixs, _ in all_alignments]), nr_sentences)
+
+
+def encode_source(lines):
+    """
+    Returns the words of the source file interned in a vocabulary, so that
+    each distinct word is compared with the stopwords only once.
+
+    Inputs:
+    - lines : iterable with the lines of the source file
+
+    Outputs:
+    - vocab   : list with the distinct source words
+    - tokens  : int32 array with the index in vocab of each source word
+    - offsets : int64 array with the position of the first word of each
+                sentence in tokens, followed by the number of words
+    """
+
+    # Split on single spaces, so that the positions are the ones of the alignments
+    return corpus_store.encode_lines(lines, " ")
+
+
+def load_source_words(src_path, cache=None):
+    """ Returns the output of encode_source for the source file, reading it from the corpus
+        store when possible """
+
+    corpus = corpus_store.load_corpus(src_path, cache, " ")
+
+    return corpus.vocab, corpus.tokens, corpus.offsets
+
 
-    return individual_scores
+def load_stopwords(stopwords_path):
+    """ Returns the set of stop words of a stopwords file (one stopword per line) """
+
+    return frozenset(line.strip("\n") for line in input_files.open_input(stopwords_path))
+
+
+def aligned_source_words(src_ref_ixs, source_words):
+    """
+    Returns an int array with the index in the source vocabulary of each
+    aligned source word.
+
+    Inputs:
+    - src_ref_ixs  : indeces of source words that aligned with reference
+                     words, in CSR layout
+    - source_words : output of encode_source
+    """
+
+    ixs, offsets = src_ref_ixs
+    _, tokens, src_offsets = source_words
+
+    assert len(src_offsets) >= len(offsets), "The source file should have a line for each aligned sentence"
+
+    sentences = sentence_ids(offsets)
+    assert np.all(ixs < np.diff(src_offsets)[sentences]), "Alignment index out of the source sentence"
+
+    return tokens[src_offsets[sentences] + ixs]
+
+
+def content_masks(src_ref_ixs, source_words, stopword_lists):
+    """
+    Returns, for each collection of stop words, a boolean array that tells
+    for each aligned source index whether its word is not a stopword. The
+    aligned words are looked up once and every list only tests the vocabulary.
+
+    Inputs:
+    - src_ref_ixs    : indeces of source words that aligned with reference
+                       words, in CSR layout
+    - source_words   : output of encode_source
+    - stopword_lists : list with the collections of stop words
+    """
+
+    aligned = aligned_source_words(src_ref_ixs, source_words)
+    vocab = source_words[0]
+
+    return [np.array([word not in stopwords for word in vocab], dtype=bool)[aligned]
+            for stopwords in stopword_lists]
+
+
+def count_dropped_words(src_ref_ixs, src_mt_ixs, src_ref_content=None):
+    """
+    Returns the counts needed to compute the score of dropped words.
+
+    Inputs:
+    - src_ref_ixs     : indeces of source words that aligned with reference
+                        words, in CSR layout
+    - src_mt_ixs      : indeces of source words that aligned with mt predicted
+                        words, in CSR layout
+    - src_ref_content : element of the output of content_masks, if stopwords
+                        are filtered
+
+    Outputs:
+    - tot                      : number of skipped source words
+    - nr_src_ref_aligned_words : number of source words aligned with the reference
+    - individual_scores        : list with the individual scores
+    """
+
+    src_ref_contents = [] if src_ref_content is None else [src_ref_content]
+    counts, individual_scores = count_dropped_words_masks(src_ref_ixs, src_mt_ixs, src_ref_contents)
+
+    return counts[-1][0], counts[-1][1], individual_scores
+
+
+def count_dropped_words_masks(src_ref_ixs, src_mt_ixs, src_ref_contents):
+    """
+    Returns the counts needed to compute the score of dropped words without
+    filtering and for each content mask, comparing the alignments only once.
+
+    Inputs:
+    - src_ref_ixs      : indeces of source words that aligned with reference
+                         words, in CSR layout
+    - src_mt_ixs       : indeces of source words that aligned with mt predicted
+                         words, in CSR layout
+    - src_ref_contents : list with outputs of content_masks
+
+    Outputs:
+    - counts            : list with the (tot, nr_src_ref_aligned_words) pairs,
+                          first without filtering and then for each mask
+    - individual_scores : list with the individual scores
+    """
+
+    nr_skipped, nr_aligned = sentence_dropped_words(src_ref_ixs, src_mt_ixs, src_ref_contents)
+
+    counts = [(int(skipped.sum()), int(aligned.sum())) for skipped, aligned in zip(nr_skipped, nr_aligned)]
+    individual_scores = np.divide(nr_skipped[0], nr_aligned[0], out=np.zeros(nr_skipped.shape[1]),
+                                  where=nr_aligned[0] > 0)
+
+    return counts, individual_scores.tolist()
+
+
+def sentence_dropped_words(src_ref_ixs, src_mt_ixs, src_ref_contents):
+    """
+    Returns the number of skipped source words and of source words aligned
+    with the references in each sentence, without filtering and for each
+    content mask.
+
+    Inputs:
+    - src_ref_ixs      : indeces of source words that aligned with reference
+                         words, in CSR layout
+    - src_mt_ixs       : indeces of source words that aligned with mt predicted
+                         words, in CSR layout
+    - src_ref_contents : list with outputs of content_masks
+
+    Outputs:
+    - nr_skipped : int64 array with one row without filtering and one row for
+                   each mask, and one column for each sentence
+    - nr_aligned : int64 array with the same shape, with the aligned words
+    """
+
+    nr_sentences = min(len(src_ref_ixs[1]), len(src_mt_ixs[1])) - 1
+    ref_ixs, ref_offsets = truncate_alignments(src_ref_ixs, nr_sentences)
+    mt_ixs, mt_offsets = truncate_alignments(src_mt_ixs, nr_sentences)
+
+    # Encode each (sentence, index) pair as a single sorted code
+    width = int(max(ref_ixs.max(initial=0), mt_ixs.max(initial=0))) + 1
+    ref_sentences = sentence_ids(ref_offsets)
+    ref_codes = ref_sentences * width + ref_ixs
+    mt_codes = sentence_ids(mt_offsets) * width + mt_ixs
+
+    # Source words ixs that aligned with something of the reference but not with anything from the mt
+    position = np.minimum(np.searchsorted(mt_codes, ref_codes), max(len(mt_codes)-1, 0))
+    skipped = np.ones(len(ref_codes), dtype=bool)
+    if len(mt_codes):
+        skipped = mt_codes[position] != ref_codes
+
+    nr_skipped = [np.bincount(ref_sentences[skipped], minlength=nr_sentences)]
+    nr_aligned = [np.diff(ref_offsets)]
+
+    for src_ref_content in src_ref_contents:
+        content = src_ref_content[:len(ref_codes)]
+        nr_skipped.append(np.bincount(ref_sentences[skipped & content], minlength=nr_sentences))
+        nr_aligned.append(np.bincount(ref_sentences[content], minlength=nr_sentences))
+
+    return np.array(nr_skipped, dtype=np.int64), np.array(nr_aligned, dtype=np.int64)
+
+
+def drop_score_value(tot, nr_src_ref_aligned_words, lp):
+    """ Returns the score of dropped words given the counts from count_dropped_words """
+
+    return lp*100*float(tot)/nr_src_ref_aligned_words
+
+
+def length_penalty(ref_length, cnd_length):
+    """ Returns the length penalty for a candidate longer than the reference """
+
+    if cnd_length > ref_length:
+        return 1/(math.exp(1-(cnd_length/ref_length)))
+
+    return 1
 
 def calculate_number_words(references, candidate):
     """ Returns the number of words from the reference closest to the length of the prediction """
     # Calculate the number of words for each reference file
     nw_ref = list()
     for ref in references:
-        nw_ref.append(sum([len(line.strip('\n').split()) for line in open(ref, 'r').readlines()]))
+        nw_ref.append(sum([len(line.strip('\n').split()) for line in input_files.open_input(ref)]))
     # Calculate the number of words in the candidate translation
-    nw_can = sum([len(line.strip('\n').split()) for line in open(candidate, 'r').readlines()])
-    # Return the reference length closest to the candidate
+    nw_can = sum([len(line.strip('\n').split()) for line in input_files.open_input(candidate)])
+    return closest_reference_length(nw_ref, nw_can)
+
+def closest_reference_length(nw_ref, nw_can):
+    """ Returns the number of words from the reference closest to the length of the prediction,
+        given the number of words of each reference and of the candidate """
     diff_list = [x-nw_can for x in nw_ref]
     min_ix, min_v = min(enumerate(diff_list), key=operator.itemgetter(1))
     return nw_ref[min_ix]
 
+def format_drop_scores(counts, nw_ref, cnd_length, stopwords_paths):
+    """
+    Returns the text with the length penalty and the score of dropped words.
+
+    Inputs:
+    - counts          : output of count_dropped_words_masks
+    - nw_ref          : list with the number of words of each reference
+    - cnd_length      : number of words of the candidate
+    - stopwords_paths : list with the paths to the stopwords files (None
+                        if stopwords are not filtered)
+    """
+
+    # Choose the reference with the largest number of words
+    #ref_length = max(nw_ref)
+    
+    # Choose the reference with the number of words closest to the value of the candidate
+    ref_length = closest_reference_length(nw_ref, cnd_length)
+
+    # Calculate the length penalty
+    lp = length_penalty(ref_length, cnd_length)
+
+    # Get the final score
+    if not stopwords_paths or len(stopwords_paths) == 1:
+        tot, nr_src_ref_aligned_words = counts[-1]
+        return "LP: {:.2f} DSW: {:.2f}".format(lp, drop_score_value(tot, nr_src_ref_aligned_words, lp))
+
+    # One row without filtering and one row for each stopwords file
+    lines = ["STOPWORDS\tLP\tDSW"]
+    for name, (tot, nr_src_ref_aligned_words) in zip(["-"] + stopwords_paths, counts):
+        lines.append("{}\t{:.2f}\t{:.2f}".format(name, lp, drop_score_value(tot, nr_src_ref_aligned_words, lp)))
+
+    return "\n".join(lines)
+
+
+def reference_statistics(src_ref_align, ref_path, profiler=profiling.NULL_PROFILER):
+    """
+    Returns the reference-side structures of the score.
+
+    Inputs:
+    - src_ref_align  : list with the paths to the source/reference alignments
+    - ref_path       : list with the paths to the reference translations
+    - profiler       : profiling.Profiler that times each stage
+
+    Outputs:
+    - src_ref_ixs     : union of the aligned source indeces of every reference
+    - nw_ref          : list with the number of words of each reference
+    """
+
+    if len(src_ref_align) == 1 and alignment_store.is_alignment_store(src_ref_align[0]):
+        # The union is precomputed in the binary alignment file
+        with profiler.stage("load_alignment_store"):
+            src_ref_ixs = load_reference_alignments(src_ref_align)
+    else:
+        with profiler.stage("parse_alignments"):
+            all_src_ref_ixs = [load_alignments(path, 0, profiler) for path in src_ref_align]
+
+        # To deal with multiple references, make sentence by sentence union of
+        # the indexes of source words that have aligned with something.
+        with profiler.stage("union_alignments"):
+            src_ref_ixs = union_alignments(all_src_ref_ixs)
+
+    with profiler.stage("number_words"):
+        nw_ref = [sum([len(line.split()) for line in input_files.open_input(ref)]) for ref in ref_path]
+
+    return src_ref_ixs, nw_ref
+
+
+def statistics_to_arrays(src_ref_ixs, nw_ref):
+    """ Returns the arrays stored in the cache for the output of reference_statistics """
+
+    return {"ixs": src_ref_ixs[0], "offsets": src_ref_ixs[1], "nw_ref": np.array(nw_ref, dtype=np.int64)}
+
+
+def statistics_from_arrays(arrays):
+    """ Returns the output of reference_statistics from the arrays stored in the cache """
+
+    return (arrays["ixs"], arrays["offsets"]), arrays["nw_ref"].tolist()
+
+
+def load_reference_statistics(src_ref_align, ref_path, cache=None, profiler=profiling.NULL_PROFILER):
+    """ Returns the output of reference_statistics, reading it from the cache when possible """
+
+    if cache is None:
+        return reference_statistics(src_ref_align, ref_path, profiler)
+
+    build = lambda: statistics_to_arrays(*reference_statistics(src_ref_align, ref_path))
+    with profiler.stage("reference_cache"):
+        arrays = cache.get("drop_score", list(src_ref_align) + list(ref_path), {"nr_align": len(src_ref_align)},
+                           build)
+
+    return statistics_from_arrays(arrays)
+
+
+def load_content_masks(src_ref_ixs, src_path, stopwords_paths, cache=None):
+    """
+    Returns the output of content_masks for each stopwords file. The source
+    words are read (or taken from the cache) only once for every list.
+
+    Inputs:
+    - src_ref_ixs     : indeces of source words that aligned with reference
+                        words, in CSR layout
+    - src_path        : path to the source file
+    - stopwords_paths : list with the paths to the stopwords files
+    """
+
+    source_words = load_source_words(src_path, cache)
+
+    return content_masks(src_ref_ixs, source_words, [load_stopwords(path) for path in stopwords_paths])
+
+
+def count_drop_events(profiler, src_ref_ixs, src_mt_ixs, src_ref_contents, stopwords_paths, counts):
+    """ Adds to the profiler the number of aligned source words, of skipped source words and of
+        aligned words filtered by each stopwords file. They are counted on the parsed alignments,
+        so the .align files (or the standard input) are not read again. The alignment pairs are
+        counted by parse_alignments while the files are parsed """
+
+    profiler.count("sentences", len(src_ref_ixs[1]) - 1)
+    profiler.count("reference_aligned_words", len(src_ref_ixs[0]))
+    profiler.count("prediction_aligned_words", len(src_mt_ixs[0]))
+    profiler.count("skipped_words", counts[0][0])
+
+    for path, src_ref_content, (_, nr_aligned) in zip(stopwords_paths or [], src_ref_contents, counts[1:]):
+        name = "stopwords_filtered" if len(stopwords_paths) == 1 else "stopwords_filtered:{}".format(path)
+        profiler.count(name, counts[0][1] - nr_aligned)
+
+
+def drop_counts_data(src_mt_ixs, src_ref_ixs, ref_lines, cnd_lines, src_lines, stopword_lists):
+    """
+    Returns the counts of dropped words, the individual scores and the number
+    of words of each reference and of the candidate for a part of the corpus.
+
+    Inputs:
+    - src_mt_ixs     : source indeces aligned with the prediction, in CSR layout
+    - src_ref_ixs    : union of the source indeces aligned with the references
+    - ref_lines      : list with the lines of each reference
+    - cnd_lines      : lines of the candidate
+    - src_lines      : lines of the source (None if stopwords are not filtered)
+    - stopword_lists : list of stopword sets
+    """
+
+    src_ref_contents = list()
+    if src_lines is not None:
+        src_ref_contents = content_masks(src_ref_ixs, encode_source(src_lines), stopword_lists)
+
+    counts, individual_scores = count_dropped_words_masks(src_ref_ixs, src_mt_ixs, src_ref_contents)
+
+    nw_ref = [sum([len(line.split()) for line in lines]) for lines in ref_lines]
+    nw_can = sum([len(line.split()) for line in cnd_lines])
+
+    return counts, individual_scores, nw_ref, nw_can
+
+
+def drop_counts_chunk(task):
+    """
+    Returns the output of drop_counts_data for a chunk of lines. Each worker
+    reads its own byte ranges, so the text of the corpus is never pickled.
+
+    Inputs:
+    - task : tuple with the paths of the source/prediction alignments, the
+             source/reference alignments, the references, the candidate and
+             the source (None if stopwords are not filtered), the list of
+             stopword sets and the byte ranges of each file, in that order
+    """
+
+    src_mt_align, src_ref_align, ref_path, cnd_path, src_path, stopword_lists, ranges = task
+
+    first_ref = 1 + len(src_ref_align)
+    src_mt_ixs = parse_alignments(sharding.read_bytes(src_mt_align, *ranges[0]), 0)
+    src_ref_ixs = union_alignments([parse_alignments(sharding.read_bytes(path, *byte_range), 0)
+                                    for path, byte_range in zip(src_ref_align, ranges[1:])])
+    ref_lines = [sharding.read_lines(path, *byte_range) for path, byte_range in zip(ref_path, ranges[first_ref:])]
+    cnd_lines = sharding.read_lines(cnd_path, *ranges[first_ref+len(ref_path)])
+    src_lines = sharding.read_lines(src_path, *ranges[-1]) if src_path else None
+
+    return drop_counts_data(src_mt_ixs, src_ref_ixs, ref_lines, cnd_lines, src_lines, stopword_lists)
+
+
+def parallel_drop_counts(src_ref_align, src_mt_align, ref_path, cnd_path, src_path, stopwords_paths, workers):
+    """
+    Returns the counts of dropped words (see count_dropped_words_masks), the
+    individual scores and the number of words of each reference and of the
+    candidate, scoring chunks of lines in a pool of worker processes.
+    """
+
+    paths = [src_mt_align] + list(src_ref_align) + list(ref_path) + [cnd_path]
+    skip_headers = [True for _ in range(1 + len(src_ref_align))] + [False for _ in range(len(ref_path) + 1)]
+
+    stopword_lists = list()
+    if stopwords_paths:
+        stopword_lists = [load_stopwords(path) for path in stopwords_paths]
+        paths.append(src_path)
+        skip_headers.append(False)
+    else:
+        src_path = None
+
+    # Use a few chunks per worker to balance the load
+    tasks = [(src_mt_align, src_ref_align, ref_path, cnd_path, src_path, stopword_lists, ranges)
+             for ranges in sharding.byte_ranges(paths, 4*workers, skip_headers)]
+
+    counts = [(0, 0) for _ in range(1 + len(stopword_lists))]
+    individual_scores = list()
+    nw_ref = [0 for _ in ref_path]
+    nw_can = 0
+
+    # The chunks are merged in order, so the result is the same as the serial one
+    for chunk in sharding.run_chunks(drop_counts_chunk, tasks, workers):
+        counts = [(x[0]+y[0], x[1]+y[1]) for x, y in zip(counts, chunk[0])]
+        individual_scores.extend(chunk[1])
+        nw_ref = [x+y for x, y in zip(nw_ref, chunk[2])]
+        nw_can += chunk[3]
+
+    return counts, individual_scores, nw_ref, nw_can
+
 ##########################################################################################
-###                                AUXILIARY FUNCTIONS                                ####
+###                                 BINARY ALIGNMENTS                                 ####
 ##########################################################################################
 
-def main():
+def convert_alignments(paths, output):
+    """
+    Writes a binary alignment file (see alignment_store.py) with the source
+    and target indeces aligned in each sentence of one or more .align files,
+    in CSR layout, and the union of the source indeces of all of them, so
+    that the alignments of the references are parsed only once.
+
+    Inputs:
+    - paths  : list with the paths to the .align files (e.g. src_ref.align
+               of each reference)
+    - output : path to the binary alignment file
+    """
+
+    arrays = dict()
+    all_src_ixs = list()
+
+    for ix, path in enumerate(paths):
+        data = input_files.read_input(path)
+        for index, side in enumerate(ALIGNMENT_SIDES):
+            ixs, offsets = parse_alignments(data, index)
+            arrays["{}{}_ixs".format(side, ix)] = ixs
+            arrays["{}{}_offsets".format(side, ix)] = offsets
+        all_src_ixs.append((arrays["src{}_ixs".format(ix)], arrays["src{}_offsets".format(ix)]))
+
+    arrays["union_ixs"], arrays["union_offsets"] = union_alignments(all_src_ixs)
+
+    alignment_store.write_alignment_store(output, paths, arrays)
+
+
+def convert_main(argv):
+
+    parser = argparse.ArgumentParser(prog="drop_score.py convert",
+                                     description="Convert .align files to a binary alignment file, which can be "
+                                                 "given to --src_ref_align or --src_mt_align instead of them")
 
-    parser = argparse.ArgumentParser()
+    required = parser.add_argument_group("required arguments")
+    required.add_argument("-o", "--output", type=str, required=True,
+                          help="Path to the binary alignment file (ending in {})".format(alignment_store.EXTENSION))
+    required.add_argument("paths", nargs='+',
+                          help="Paths to the .align files (e.g. the source/reference alignments of each reference)")
+
+    args = parser.parse_args(argv)
+
+    assert alignment_store.is_alignment_store(args.output), \
+                "The binary alignment files end in {}".format(alignment_store.EXTENSION)
+
+    convert_alignments(args.paths, args.output)
+
+    union_ixs, union_offsets = alignment_store.load_alignment_store(args.output).csr("union")
+    print("{}\t{} files\t{} sentences\t{} aligned source words".format(args.output, len(args.paths),
+                                                                       len(union_offsets) - 1, len(union_ixs)))
+
+##########################################################################################
+###                                  MAP-REDUCE MODE                                  ####
+##########################################################################################
+
+def map_statistics(src_ref_align, src_mt_align, ref_path, cnd_path, src_path, stopwords_paths, lines=None):
+    """
+    Returns the partial statistics of a shard: the integer counts of dropped
+    and aligned words (see count_dropped_words_masks) and the number of words
+    of each file, which can be summed over the shards in any order.
+
+    Inputs:
+    - src_ref_align, src_mt_align, ref_path, cnd_path, src_path,
+      stopwords_paths : the arguments of the script (src_path is only read
+                        if stopwords_paths is given)
+    - lines           : (first, last) range of lines of the shard, or None
+                        to score the whole files
+    """
+
+    src_lines = None
+    stopword_lists = list()
+    if stopwords_paths:
+        src_lines = sharding.read_shard_lines(src_path, lines)
+        stopword_lists = [load_stopwords(path) for path in stopwords_paths]
+
+    ref_lines = [sharding.read_shard_lines(path, lines) for path in ref_path]
+    cnd_lines = sharding.read_shard_lines(cnd_path, lines)
+
+    counts, _, nw_ref, nw_can = drop_counts_data(read_shard_alignments([src_mt_align], lines),
+                                                 read_shard_alignments(src_ref_align, lines),
+                                                 ref_lines, cnd_lines, src_lines, stopword_lists)
+
+    inputs = list(src_ref_align) + list(ref_path) + [src_mt_align, cnd_path]
+    if stopwords_paths:
+        inputs.append(src_path)
+
+    return {"inputs": inputs, "lines": lines, "nr_sentences": len(cnd_lines),
+            "stopwords": stopwords_paths or None, "nr_references": len(ref_path),
+            "counts": counts, "nw_ref": nw_ref, "nw_can": nw_can}
+
+
+def read_shard_alignments(paths, lines=None):
+    """ Returns the union of the source indeces aligned in several .align files (see
+        load_reference_alignments), or only in the lines [first, last) if lines is given """
+
+    if any(alignment_store.is_alignment_store(path) for path in paths):
+        alignments = load_reference_alignments(paths)
+        return alignments if lines is None else slice_alignments(alignments, *lines)
+
+    return union_alignments([parse_alignments(sharding.read_shard_bytes(path, lines, True), 0) for path in paths])
+
+
+def reduce_statistics(partials):
+    """ Returns the counts of dropped words, the number of words of each reference and the number
+        of words of the candidate of several shards """
+
+    counts = [(sum([x[0] for x in shard_counts]), sum([x[1] for x in shard_counts]))
+              for shard_counts in zip(*[partial["counts"] for partial in partials])]
+    nw_ref = [sum(x) for x in zip(*[partial["nw_ref"] for partial in partials])]
+    nw_can = sum([partial["nw_can"] for partial in partials])
+
+    return counts, nw_ref, nw_can
+
+
+def map_main(argv):
+
+    parser = argparse.ArgumentParser(prog="drop_score.py map",
+                                     description="Write the partial statistics of the score of dropped words "
+                                                 "of a shard")
 
     # Optional arguments
+    add_stopwords_arguments(parser)
+
+    # Required arguments
+    required = sharding.add_map_arguments(parser)
+    add_input_arguments(required)
+
+    args = parser.parse_args(argv)
+
+    check_stopwords_arguments(args)
+
+    sharding.write_partial(args.output, "drop", map_statistics(args.src_ref_align, args.src_mt_align, args.ref_path,
+                                                               args.cnd_path, args.src_path, args.stopwords_path,
+                                                               args.lines))
+
+
+def reduce_main(argv):
+
+    parser = argparse.ArgumentParser(prog="drop_score.py reduce",
+                                     description="Print the score of dropped words of the corpus from the partial "
+                                                 "statistics of its shards")
+
+    sharding.add_reduce_arguments(parser)
+
+    args = parser.parse_args(argv)
+
+    partials = sharding.read_partials(args.partials, "drop", ["stopwords", "nr_references"])
+    counts, nw_ref, cnd_length = reduce_statistics(partials)
+
+    print(format_drop_scores(counts, nw_ref, cnd_length, partials[0]["stopwords"]))
+
+##########################################################################################
+###                                AUXILIARY FUNCTIONS                                ####
+##########################################################################################
+
+def add_stopwords_arguments(parser, several=True, src_path=True):
+    """ Adds the options to filter the stopwords to an argument parser. With several=False a
+        single stopwords file is accepted, and with src_path=False the script adds its own
+        (required) --src_path option """
+
     parser.add_argument("--filter_stopwords", action="store_true",
                         help="If provided, excludes alignments relative to stopwords")
-    parser.add_argument("--stopwords_path", type=str,
-                        help="Path to the stopwords file")
-    parser.add_argument("--src_path", type=str,
-                        help="Path to the test source language file")
+    if several:
+        parser.add_argument("--stopwords_path", nargs='+',
+                            help="Path to the stopwords file (several files can be given to score with each of them)")
+    else:
+        parser.add_argument("--stopwords_path", type=str,
+                            help="Path to the stopwords file")
+    if src_path:
+        parser.add_argument("--src_path", type=str,
+                            help="Path to the test source language file")
+
+
+def check_stopwords_arguments(args, src_path=True):
+    """ Exits if only some of the options to filter the stopwords are given (the source is
+        not checked with src_path=False, see add_stopwords_arguments) """
+
+    options = [args.filter_stopwords, args.stopwords_path] + ([args.src_path] if src_path else [])
+
+    if any(options) and not all(options):
+        print("The three optional arguments are dependent of each other")
+        print("Make sure you provide all of them when calling the script")
+        exit()
+
+
+def add_input_arguments(parser):
+    """ Adds the paths to the alignments and to the translations to an argument parser """
+
+    parser.add_argument("--src_ref_align", nargs='+', required=True,
+                        help="Path to the source/reference alignments")
+    parser.add_argument("--src_mt_align", type=str, required=True,
+                        help="Path to the source/prediction alignments")
+    parser.add_argument("--ref_path", nargs='+', required=True,
+                        help="Path to the reference translation")
+    parser.add_argument("--cnd_path", type=str, required=True,
+                        help="Path to the candidate translation")
+
+
+def main():
+
+    # The map and reduce subcommands score the corpus in shards
+    if sys.argv[1:2] == ["map"]:
+        return map_main(sys.argv[2:])
+    if sys.argv[1:2] == ["reduce"]:
+        return reduce_main(sys.argv[2:])
+
+    # The convert subcommand writes the binary alignment files
+    if sys.argv[1:2] == ["convert"]:
+        return convert_main(sys.argv[2:])
+
+    parser = argparse.ArgumentParser(epilog="Subcommands: map (partial statistics of a shard), reduce (score of "
+                                            "the corpus from the partial statistics), convert (binary "
+                                            "alignment file). See drop_score.py map -h")
+
+    # Optional arguments
+    add_stopwords_arguments(parser)
     parser.add_argument("--debug", action="store_true",
                         help="Created a pdb trace at the end of the script")
+    reference_cache.add_cache_arguments(parser)
+    result_store.add_result_arguments(parser)
+    sharding.add_workers_argument(parser)
+    profiling.add_profile_arguments(parser)
 
     # Required arguments
-    required = parser.add_argument_group("required arguments")
-    required.add_argument("--src_ref_align", nargs='+', required=True,
-                          help="Path to the source/reference alignments")
-    required.add_argument("--src_mt_align", type=str, required=True,
-                          help="Path to the source/prediction alignments")
-    required.add_argument("--ref_path", nargs='+', required=True,
-                          help="Path to the reference translation")
-    required.add_argument("--cnd_path", type=str, required=True,
-                          help="Path to the candidate translation")
-    
+    add_input_arguments(parser.add_argument_group("required arguments"))
 
     args = parser.parse_args()
 
-    if (args.filter_stopwords or args.stopwords_path or args.src_path):
-        if not (args.filter_stopwords and args.stopwords_path and args.src_path):
-            print("The three optional arguments are dependent of each other")
-            print("Make sure you provide all of them when calling the script")
-            exit()
+    check_stopwords_arguments(args)
 
     SRC_REF_PATH = args.src_ref_align
     SRC_MT_PATH = args.src_mt_align
@@ -155,50 +898,67 @@ def main():
     REF_PATH = args.ref_path
     CND_PATH = args.cnd_path
 
-    # Source words that were aligned with some reference word (all_src_ref_ixs_aligned)
-    asria = [list_of_indeces(ref, 0) for ref in SRC_REF_PATH]
-    
-    # To deal with multiple references, make sentence by sentence union of
-    # the indexes of source words that have aligned with something.
-    src_ref_ixs_aligned = [sorted(list(set(chain.from_iterable(x))), key=lambda y: int(y)) for x in zip(*asria)]
+    profiler = profiling.profiler_from_arguments(args)
 
-    # Source words that were aligned with some MT predicted word
-    src_mt_ixs_aligned = list_of_indeces(SRC_MT_PATH, 0)
+    paths = SRC_REF_PATH + REF_PATH + [SRC_MT_PATH, CND_PATH] + ([SOURCE_PATH] if STOPWORDS_PATH else [])
 
-    # Calculate the length penalty
-    ref_sentence_list = [ [line.split() for line in open(ref, 'r')] for ref in REF_PATH]
-    cnd_sentence_list = [line.split() for line in open(CND_PATH, 'r')] 
+    def build():
+        if args.workers > 1 and all(input_files.is_plain(path) and not alignment_store.is_alignment_store(path)
+                                    for path in paths):
 
-    # Choose the reference with the largest number of words
-    #ref_length = max([sum([len(x) for x in ref]) for ref in ref_sentence_list])
-    
-    # Choose the reference with the number of words closest to the value of the candidate
-    ref_length = calculate_number_words(REF_PATH, CND_PATH)    
-    cnd_length = sum([len(x) for x in cnd_sentence_list]) 
+            # Score chunks of lines in parallel, each worker reading its own part of the files
+            # (compressed files, binary alignment files and the standard input are read by a single process)
+            with profiler.stage("parallel_counts"):
+                counts, ind_score, nw_ref, cnd_length = parallel_drop_counts(
+                    SRC_REF_PATH, SRC_MT_PATH, REF_PATH, CND_PATH, SOURCE_PATH, STOPWORDS_PATH, args.workers)
 
-    if cnd_length > ref_length:
-        lp = 1/(math.exp(1-(cnd_length/ref_length)))
-    else:
-        lp = 1
+        else:
 
-    # Print the final score    
-    if args.filter_stopwords:
-        
-        # Create list of source words
-        src_words = [line.strip("\n").split(" ") for line in open(SOURCE_PATH, 'r')]
+            cache = reference_cache.cache_from_arguments(args)
+
+            # Source words that were aligned with some reference word (union over the references)
+            # and the number of words of each reference
+            src_ref_ixs_aligned, nw_ref = load_reference_statistics(SRC_REF_PATH, REF_PATH, cache, profiler)
+
+            # Aligned source words that are not stopwords, for each stopwords file
+            src_ref_contents = list()
+            if STOPWORDS_PATH:
+                with profiler.stage("content_masks"):
+                    src_ref_contents = load_content_masks(src_ref_ixs_aligned, SOURCE_PATH, STOPWORDS_PATH, cache)
 
-        # Create the list with the desired stopwords
-        stopwords = [line.strip("\n") for line in open(STOPWORDS_PATH, 'r')]
+            # Source words that were aligned with some MT predicted word
+            with profiler.stage("parse_alignments"):
+                src_mt_ixs_aligned = load_alignments(SRC_MT_PATH, 0, profiler)
 
-        # Calculate the final score
-        ind_score = calculate_score(src_ref_ixs_aligned, src_mt_ixs_aligned, lp,
-                                    src_words, stopwords, args.filter_stopwords) 
+            # Calculate the number of words of the candidate
+            with profiler.stage("number_words"):
+                cnd_length = sum([len(line.split()) for line in input_files.open_input(CND_PATH)])
 
+            with profiler.stage("dropped_words"):
+                counts, ind_score = count_dropped_words_masks(src_ref_ixs_aligned, src_mt_ixs_aligned, src_ref_contents)
+
+            # Only computed when profiling, in its own stage
+            if profiler.enabled:
+                with profiler.stage("counters"):
+                    count_drop_events(profiler, src_ref_ixs_aligned, src_mt_ixs_aligned, src_ref_contents,
+                                      STOPWORDS_PATH, counts)
+
+        output = format_drop_scores(counts, nw_ref, cnd_length, STOPWORDS_PATH)
+        return {"output": result_store.encode_output(output), "counts": np.array(counts, dtype=np.int64),
+                "individual_scores": np.array(ind_score)}
+
+    # Print the stored result if none of the files changed since it was scored
+    results = result_store.store_from_arguments(args)
+    if results is None:
+        arrays = build()
     else:
-        # Calculate the final score
-        empty_src_words = [list() for entry in src_ref_ixs_aligned]
-        ind_score = calculate_score(src_ref_ixs_aligned, src_mt_ixs_aligned, lp,
-                                    empty_src_words, list(), args.filter_stopwords)
+        arrays = results.get("drop_score", paths + (STOPWORDS_PATH or []),
+                             {"nr_align": len(SRC_REF_PATH), "nr_stopwords": len(STOPWORDS_PATH or [])}, build)
+
+    print(result_store.decode_output(arrays))
+
+    if args.profile:
+        profiler.write(args.profile, script="drop_score")
 
     if args.debug:
         import pdb; pdb.set_trace()
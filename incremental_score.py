@@ -0,0 +1,395 @@
+import os
+import json
+import hashlib
+import argparse
+import numpy as np
+
+import sharding
+import rep_score
+import drop_score
+import adequacy_score
+
+################################################################################################
+###                                 AUXILIARY FUNCTIONS                                      ###
+################################################################################################
+
+STORE_VERSION = 1
+
+
+def line_hashes(path, skip_headers=False):
+    """ Returns the byte offsets of the lines of a file (see sharding.line_offsets) and a
+        uint64 array with the 8-byte blake2b digest of each line """
+
+    offsets = sharding.line_offsets(path, skip_headers)
+    bounds = offsets.tolist()
+
+    with open(path, 'rb') as f:
+        data = memoryview(f.read())
+
+    digests = b"".join([hashlib.blake2b(data[start:end], digest_size=8).digest()
+                        for start, end in zip(bounds[:-1], bounds[1:])])
+
+    return offsets, np.frombuffer(digests, dtype=np.uint64).copy()
+
+
+def fingerprint(path):
+    """ Returns the size and modification time of a file, used to detect changes in the inputs
+        that are not hashed line by line """
+
+    stat = os.stat(path)
+
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def read_selected_lines(path, offsets, indeces):
+    """ Returns the lines of a file with the given indeces, given the byte offsets of its lines """
+
+    if len(indeces) == 0:
+        return list()
+
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+
+    return [bytes(data[offsets[ix]:offsets[ix+1]]).decode("utf-8") for ix in indeces]
+
+
+def sentence_statistics(ref_sentence_list, pred_sentence_list, n_grams_list, src_ref_ixs=None,
+                        src_mt_ixs=None, src_ref_content=None):
+    """
+    Returns a dictionary with the per-sentence sufficient statistics of both
+    metrics, whose sums give the corpus scores.
+
+    Inputs:
+    - ref_sentence_list  : list with the tokenized sentences of each reference
+    - pred_sentence_list : list with the tokenized sentences of the prediction
+    - n_grams_list       : list with the values of n of the REP-score
+    - src_ref_ixs        : union of the aligned source indeces of the
+                           references, in CSR layout (None to skip DROP)
+    - src_mt_ixs         : aligned source indeces of the prediction
+    - src_ref_content    : mask of drop_score.content_masks, if stopwords
+                           are filtered
+
+    Outputs (int64 arrays with one value per sentence):
+    - nw_can      : number of words of the prediction
+    - rep_<n>     : n-gram score for each value of n
+    - consec      : consecutive words score
+    - nr_skipped  : skipped source words (one row without filtering, and a
+                    second one if stopwords are filtered)
+    - nr_aligned  : source words aligned with the references (same rows)
+    """
+
+    stats = dict()
+    stats["nw_can"] = np.array([len(x) for x in pred_sentence_list], dtype=np.int64)
+
+    ref_profiles = rep_score.build_reference_profile_lists(ref_sentence_list, n_grams_list)
+    all_n_gram_scores, consec_scores = rep_score.profile_multi_rep_scores(ref_profiles, pred_sentence_list,
+                                                                          n_grams_list)
+    for n_grams in n_grams_list:
+        stats["rep_{}".format(n_grams)] = np.array(all_n_gram_scores[n_grams], dtype=np.int64)
+    stats["consec"] = np.array(consec_scores, dtype=np.int64)
+
+    if src_ref_ixs is not None:
+        src_ref_contents = [] if src_ref_content is None else [src_ref_content]
+        stats["nr_skipped"], stats["nr_aligned"] = drop_score.sentence_dropped_words(src_ref_ixs, src_mt_ixs,
+                                                                                     src_ref_contents)
+        assert stats["nr_skipped"].shape[1] == len(pred_sentence_list), \
+                    "The alignments should have a line for each predicted sentence"
+
+    return stats
+
+
+class StatisticsStore(object):
+    """
+    Per-sentence sufficient statistics of a scored system, saved in a directory
+    next to it (<candidate>.stats by default). It holds a meta.json file with
+    the inputs and the parameters, one .npy file per array of statistics (see
+    sentence_statistics), the hashes of the lines of the prediction and of the
+    source/prediction alignments, and the line offsets of the other inputs, so
+    that changed lines can be read and re-scored without reading whole files.
+    """
+
+    def __init__(self, path):
+
+        self.path = path
+        self.meta = None
+        self.arrays = dict()
+
+    def exists(self):
+        return os.path.isfile(os.path.join(self.path, "meta.json"))
+
+    def load(self):
+        """ Reads the meta data and memory-maps the arrays, so that they can be updated in place """
+
+        with open(os.path.join(self.path, "meta.json"), 'r') as f:
+            self.meta = json.load(f)
+
+        self.arrays = dict((name[:-4], np.load(os.path.join(self.path, name), mmap_mode='r+'))
+                           for name in os.listdir(self.path) if name.endswith(".npy"))
+
+    def save(self, meta, arrays):
+        """ Writes a new store, replacing the previous one """
+
+        os.makedirs(self.path, exist_ok=True)
+
+        meta_path = os.path.join(self.path, "meta.json")
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+
+        for name in os.listdir(self.path):
+            if name.endswith(".npy"):
+                os.remove(os.path.join(self.path, name))
+
+        for name, array in arrays.items():
+            np.save(os.path.join(self.path, name + ".npy"), array)
+
+        # Written last, so an interrupted run leaves no readable store
+        self.save_meta(meta)
+
+        self.load()
+
+    def save_meta(self, meta):
+        """ Replaces the meta data at once, so it is never read half written """
+
+        tmp_path = os.path.join(self.path, "meta.json.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(self.path, "meta.json"))
+
+        self.meta = meta
+
+    def inputs_changed(self):
+        """ Returns whether an input other than the prediction and its alignments has changed """
+
+        return any(fingerprint(path) != value for path, value in self.meta["fingerprints"].items())
+
+
+def build_store(store, references, candidate, n_grams_list, src_ref_align=None, src_mt_align=None,
+                src_path=None, stopwords_path=None):
+    """ Scores every line of a system and saves its sufficient statistics in the store """
+
+    ref_sentence_list = [ [line.split() for line in open(path, 'r')] for path in references]
+    pred_sentence_list = [line.split() for line in open(candidate, 'r')]
+
+    assert all(len(ref) == len(pred_sentence_list) for ref in ref_sentence_list), \
+                "Reference and predicted text files should have the same length"
+
+    arrays = dict()
+    inputs = list(references)
+
+    src_ref_ixs = src_mt_ixs = src_ref_content = None
+    if src_ref_align:
+        src_ref_ixs = drop_score.union_alignments([drop_score.load_alignments(path, 0) for path in src_ref_align])
+        src_mt_ixs = drop_score.load_alignments(src_mt_align, 0)
+        inputs += list(src_ref_align)
+
+        for ix, path in enumerate(src_ref_align):
+            arrays["src_ref_offsets_{}".format(ix)] = sharding.line_offsets(path, skip_headers=True)
+        arrays["align_offsets"], arrays["align_hash"] = line_hashes(src_mt_align, skip_headers=True)
+
+        if stopwords_path:
+            src_ref_content, = drop_score.content_masks(src_ref_ixs, drop_score.encode_source(open(src_path, 'r')),
+                                                        [drop_score.load_stopwords(stopwords_path)])
+            inputs += [src_path, stopwords_path]
+            arrays["src_offsets"] = sharding.line_offsets(src_path)
+
+    arrays.update(sentence_statistics(ref_sentence_list, pred_sentence_list, n_grams_list, src_ref_ixs,
+                                      src_mt_ixs, src_ref_content))
+
+    for ix, path in enumerate(references):
+        arrays["ref_offsets_{}".format(ix)] = sharding.line_offsets(path)
+    arrays["cand_offsets"], arrays["cand_hash"] = line_hashes(candidate)
+
+    meta = {"version": STORE_VERSION,
+            "references": [os.path.abspath(path) for path in references],
+            "candidate": os.path.abspath(candidate),
+            "src_ref_align": [os.path.abspath(path) for path in src_ref_align or []],
+            "src_mt_align": os.path.abspath(src_mt_align) if src_mt_align else None,
+            "src_path": os.path.abspath(src_path) if stopwords_path else None,
+            "stopwords_path": os.path.abspath(stopwords_path) if stopwords_path else None,
+            "n": list(n_grams_list),
+            "nw_ref": [sum([len(x) for x in ref]) for ref in ref_sentence_list],
+            "fingerprints": dict((os.path.abspath(path), fingerprint(path)) for path in inputs)}
+
+    store.save(meta, arrays)
+
+
+def update_store(store, candidate, src_mt_align=None):
+    """
+    Re-scores the lines of the prediction (or of its alignments) that changed
+    since the store was saved, and updates their statistics in place. Returns
+    the number of re-scored lines.
+
+    The path of the alignments is saved in the meta data, so that the next
+    update compares the lines with the same file unless another one is given.
+    The statistics always match the stored line hashes, so an interrupted
+    update is redone by the next one whichever file it reads.
+    """
+
+    meta = store.meta
+    arrays = store.arrays
+
+    cand_offsets, cand_hash = line_hashes(candidate)
+    assert len(cand_hash) == len(arrays["cand_hash"]), \
+                "Reference and predicted text files should have the same length"
+
+    changed = cand_hash != arrays["cand_hash"]
+    changed |= np.diff(cand_offsets) != np.diff(arrays["cand_offsets"])
+
+    if meta["src_ref_align"]:
+        align_offsets, align_hash = line_hashes(src_mt_align, skip_headers=True)
+        assert len(align_hash) == len(arrays["align_hash"]), \
+                    "The alignments should have a line for each predicted sentence"
+        changed |= align_hash != arrays["align_hash"]
+        changed |= np.diff(align_offsets) != np.diff(arrays["align_offsets"])
+
+        if os.path.abspath(src_mt_align) != meta["src_mt_align"]:
+            store.save_meta(dict(meta, src_mt_align=os.path.abspath(src_mt_align)))
+
+    indeces = np.flatnonzero(changed)
+
+    if len(indeces) == 0:
+        return 0
+
+    # Read only the changed lines of every input
+    ref_sentence_list = [ [line.split() for line in read_selected_lines(path, arrays["ref_offsets_{}".format(ix)],
+                                                                        indeces)]
+                          for ix, path in enumerate(meta["references"])]
+    pred_sentence_list = [line.split() for line in read_selected_lines(candidate, cand_offsets, indeces)]
+
+    src_ref_ixs = src_mt_ixs = src_ref_content = None
+    if meta["src_ref_align"]:
+        src_ref_ixs = drop_score.union_alignments(
+            [drop_score.parse_alignments("".join(read_selected_lines(path, arrays["src_ref_offsets_{}".format(ix)],
+                                                                     indeces)).encode("utf-8"), 0)
+             for ix, path in enumerate(meta["src_ref_align"])])
+        src_mt_ixs = drop_score.parse_alignments(
+            "".join(read_selected_lines(src_mt_align, align_offsets, indeces)).encode("utf-8"), 0)
+
+        if meta["stopwords_path"]:
+            source_words = drop_score.encode_source(read_selected_lines(meta["src_path"], arrays["src_offsets"],
+                                                                        indeces))
+            src_ref_content, = drop_score.content_masks(src_ref_ixs, source_words,
+                                                        [drop_score.load_stopwords(meta["stopwords_path"])])
+
+    stats = sentence_statistics(ref_sentence_list, pred_sentence_list, meta["n"], src_ref_ixs, src_mt_ixs,
+                                src_ref_content)
+
+    # Statistics first and hashes last, so that an interrupted update is redone by the next one
+    for name, values in stats.items():
+        arrays[name][..., indeces] = values
+        arrays[name].flush()
+
+    if meta["src_ref_align"]:
+        save_offsets(store, "align", align_offsets, align_hash)
+    save_offsets(store, "cand", cand_offsets, cand_hash)
+
+    return len(indeces)
+
+
+def save_offsets(store, name, offsets, hashes):
+    """ Replaces in place the line offsets and hashes of the prediction ("cand") or of its
+        alignments ("align"), which have the same number of lines as the stored ones """
+
+    for suffix, values in (("_offsets", offsets), ("_hash", hashes)):
+        store.arrays[name + suffix][:] = values
+        store.arrays[name + suffix].flush()
+
+
+def store_result(store, w1, w2):
+    """ Returns the AdequacyResult of the corpus from the sums of the statistics in the store """
+
+    meta = store.meta
+    arrays = store.arrays
+
+    nw_ref = meta["nw_ref"]
+    nw_can = int(arrays["nw_can"].sum())
+
+    ref_length = rep_score.closest_reference_length(nw_ref, nw_can)
+    assert ref_length > 0, "No valid reference file."
+
+    bp = rep_score.brevity_penalty(ref_length, nw_can)
+    consec_total = int(arrays["consec"].sum())
+    rep_scores = dict((n_grams, w1*int(arrays["rep_{}".format(n_grams)].sum()) + w2*consec_total)
+                      for n_grams in meta["n"])
+    normalized_rep_scores = dict((n_grams, bp*100*float(rep_scores[n_grams])/ref_length) for n_grams in meta["n"])
+
+    result = adequacy_score.AdequacyResult(rep_scores, normalized_rep_scores, bp, dict(),
+                                           nw_ref=nw_ref, nw_can=nw_can)
+
+    if meta["src_ref_align"]:
+        # The last row is the filtered one if stopwords are filtered
+        tot = int(arrays["nr_skipped"][-1].sum())
+        nr_src_ref_aligned_words = int(arrays["nr_aligned"][-1].sum())
+        result.lp = drop_score.length_penalty(drop_score.closest_reference_length(nw_ref, nw_can), nw_can)
+        result.drop_score = drop_score.drop_score_value(tot, nr_src_ref_aligned_words, result.lp)
+
+    return result
+
+################################################################################################
+###                                     MAIN FUNCTION                                        ###
+################################################################################################
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    # Score every line and save the statistics
+    score_parser = subparsers.add_parser("score", help="Score a system and save its sufficient statistics")
+    rep_score.add_n_grams_argument(score_parser)
+    score_parser.add_argument("--src_ref_align", nargs='+',
+                              help="Path to the source/reference alignments")
+    score_parser.add_argument("--src_mt_align", type=str,
+                              help="Path to the source/prediction alignments")
+    drop_score.add_stopwords_arguments(score_parser, several=False)
+    score_parser.add_argument("-r", "--reference", nargs='+', required=True,
+                              help="Provide a list with the paths to the tokenized reference files")
+
+    # Re-score only the changed lines
+    update_parser = subparsers.add_parser("update", help="Re-score the lines of a system that changed")
+    update_parser.add_argument("--src_mt_align", type=str,
+                               help="Path to the source/prediction alignments (default: the last ones given)")
+
+    for subparser in (score_parser, update_parser):
+        subparser.add_argument("-p", "--predicted", type=str, required=True,
+                               help="Provide the path to the tokenized obtained translation")
+        subparser.add_argument("--store", type=str,
+                               help="Directory of the statistics (default: <predicted>.stats)")
+        rep_score.add_weight_arguments(subparser, tandem=False)
+
+    args = parser.parse_args()
+
+    store = StatisticsStore(args.store or args.predicted + ".stats")
+
+    if args.command == "score":
+        n_grams_list = rep_score.n_grams_from_arguments(args)
+        drop_score.check_stopwords_arguments(args)
+
+        if bool(args.src_ref_align) != bool(args.src_mt_align):
+            print("Both --src_ref_align and --src_mt_align are needed to compute the DROP-score")
+            exit()
+
+        build_store(store, args.reference, args.predicted, n_grams_list, args.src_ref_align,
+                    args.src_mt_align, args.src_path, args.stopwords_path)
+
+    else:
+        assert store.exists(), "No statistics found in {}, run the score command first".format(store.path)
+        store.load()
+
+        meta = store.meta
+        src_mt_align = args.src_mt_align or meta["src_mt_align"]
+
+        if meta["version"] != STORE_VERSION or store.inputs_changed():
+            # The references changed, so every line has to be scored again
+            print("The inputs changed, scoring every line")
+            build_store(store, meta["references"], args.predicted, meta["n"], meta["src_ref_align"],
+                        src_mt_align, meta["src_path"], meta["stopwords_path"])
+        else:
+            nr_lines = update_store(store, args.predicted, src_mt_align)
+            print("Re-scored {} of {} lines".format(nr_lines, len(store.arrays["cand_hash"])))
+
+    print(store_result(store, args.w1, args.w2).format())
+
+if __name__ == "__main__":
+
+    main()
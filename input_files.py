@@ -0,0 +1,76 @@
+import io
+import sys
+import gzip
+import lzma
+
+# zstandard is only needed to read .zst files
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+################################################################################################
+###                                 AUXILIARY FUNCTIONS                                      ###
+################################################################################################
+
+# Size of the reads from the files and from the decoders
+BUFFER_SIZE = 1 << 20
+
+STDIN = "-"
+COMPRESSED_EXTENSIONS = (".gz", ".xz", ".lzma", ".zst")
+
+
+def is_stdin(path):
+    """ Returns True if the path stands for the standard input """
+
+    return path == STDIN
+
+
+def is_plain(path):
+    """ Returns True if the path is an uncompressed file, which can be memory-mapped and read
+        from any offset (e.g. by the workers of the parallel mode) """
+
+    return not is_stdin(path) and not path.endswith(COMPRESSED_EXTENSIONS)
+
+
+def open_binary(path):
+    """ Returns a buffered binary stream with the decompressed content of a file """
+
+    if is_stdin(path):
+        return io.BufferedReader(sys.stdin.buffer, BUFFER_SIZE)
+
+    if path.endswith(".gz"):
+        return io.BufferedReader(gzip.open(path, 'rb'), BUFFER_SIZE)
+
+    if path.endswith((".xz", ".lzma")):
+        return io.BufferedReader(lzma.open(path, 'rb'), BUFFER_SIZE)
+
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise ImportError("Reading {} requires the zstandard package (pip install zstandard)".format(path))
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_size=BUFFER_SIZE, closefd=True)
+        return io.BufferedReader(reader, BUFFER_SIZE)
+
+    return open(path, 'rb', buffering=BUFFER_SIZE)
+
+
+def open_input(path, mode='r'):
+    """ Opens an input file for reading, as open(path, mode) would, decompressing .gz, .xz
+        and .zst files on the fly. The path "-" reads the standard input """
+
+    assert mode in ['r', 'rb'], "Input files are opened with mode 'r' or 'rb'"
+
+    stream = open_binary(path)
+
+    if mode == 'rb':
+        return stream
+
+    return io.TextIOWrapper(stream)
+
+
+def read_input(path):
+    """ Returns the decompressed content of an input file as bytes """
+
+    with open_binary(path) as f:
+        return f.read()
+
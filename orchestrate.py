@@ -0,0 +1,313 @@
+import sys
+import time
+import shlex
+import asyncio
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import rep_score
+import drop_score
+import batch_score
+import input_files
+import result_store
+import align_pipeline
+import reference_cache
+
+################################################################################################
+###                                 AUXILIARY FUNCTIONS                                      ###
+################################################################################################
+
+DEFAULT_RETRIES = 2
+
+# Seconds waited before the first retry of a failed step, doubled for each new retry
+RETRY_DELAY = 1.0
+
+# Reference set of each worker process, set by init_worker
+WORKER_REFERENCE_SET = None
+
+
+def init_worker(reference_set):
+    """ Sets the reference set of a worker process. It is built once by the main process, and
+        the forked workers inherit it instead of building it again """
+
+    global WORKER_REFERENCE_SET
+
+    WORKER_REFERENCE_SET = reference_set
+
+
+def worker_rep_statistics(candidate, w1, w2):
+    """ Returns the per-sentence statistics of the REP-score of a system as arrays
+        (see batch_score.ReferenceSet.rep_statistics) """
+
+    pred_sentence_list = [line.split() for line in input_files.open_input(candidate)]
+
+    return batch_score.statistics_to_arrays(WORKER_REFERENCE_SET.rep_statistics(pred_sentence_list, w1, w2))
+
+
+def worker_drop_statistics(alignments):
+    """ Returns the per-sentence statistics of the DROP-score of a system as arrays, given the
+        content of its source/prediction alignments """
+
+    src_mt_ixs = drop_score.parse_alignments(alignments, 0)
+
+    return batch_score.statistics_to_arrays(WORKER_REFERENCE_SET.drop_statistics(src_mt_ixs))
+
+
+class AlignerQueue(object):
+    """
+    Persistent aligner processes (see align_pipeline.AlignerProcess) shared by
+    the tasks of every system. Each system is aligned by one idle aligner, so
+    up to workers systems are aligned at once. The processes are started when
+    they are first needed, and an aligner that fails is stopped and replaced.
+    """
+
+    def __init__(self, command, workers):
+
+        self.command = command
+        self.slots = asyncio.Semaphore(workers)
+        self.idle = list()
+
+    async def align(self, pairs):
+        """ Returns the list with the alignment lines of a list of "source ||| target" lines """
+
+        async with self.slots:
+            aligner = self.idle.pop() if self.idle else align_pipeline.AlignerProcess(self.command)
+
+            # The aligner blocks on its pipes, so it is run in a thread. It is stopped if it fails
+            # or if the task is cancelled, as its pipes may hold part of the batch
+            try:
+                alignments = await asyncio.get_running_loop().run_in_executor(None, aligner.align, pairs)
+            except BaseException:
+                aligner.process.kill()
+                aligner.close()
+                raise
+
+            self.idle.append(aligner)
+
+        return alignments
+
+    def close(self):
+        """ Stops every aligner process """
+
+        while self.idle:
+            self.idle.pop().close()
+
+
+class Progress(object):
+    """ Writes one line to a stream (stderr) for each step of a system that finishes, fails or is
+        retried, with the number of systems done and the elapsed time """
+
+    def __init__(self, total, stream=sys.stderr):
+
+        self.total = total
+        self.done = 0
+        self.stream = stream
+        self.start = time.perf_counter()
+
+    def write(self, candidate, message):
+
+        self.stream.write("[{}/{} {:.1f}s] {}: {}\n".format(self.done, self.total, time.perf_counter() - self.start,
+                                                           candidate, message))
+        self.stream.flush()
+
+    def step(self, candidate, step, seconds):
+        self.write(candidate, "{} done in {:.2f}s".format(step, seconds))
+
+    def retry(self, candidate, step, attempt, error):
+        self.write(candidate, "{} failed ({}: {}), retry {}".format(step, type(error).__name__, error, attempt))
+
+    def finish(self, candidate, error=None):
+        self.done += 1
+        self.write(candidate, "scored" if error is None else "FAILED ({}: {})".format(type(error).__name__, error))
+
+
+class Orchestrator(object):
+    """
+    Scores several systems with asyncio tasks. For each system, the REP-score
+    runs in a worker process while the system is aligned, and the DROP-score
+    runs in a worker process once the alignments are ready. The worker
+    processes, the aligners and the number of systems in flight are bounded,
+    so the CPU scores one system while the aligners work on the next ones.
+
+    Each step is retried up to retries times. The statistics of the systems
+    whose files did not change are read from the result store, as in
+    align_pipeline.py, and they are neither aligned nor scored.
+    """
+
+    def __init__(self, args, reference_set, executor, src_lines, store=None, retries=DEFAULT_RETRIES):
+
+        self.args = args
+        self.reference_set = reference_set
+        self.executor = executor
+        self.src_lines = src_lines
+        self.store = store
+        self.retries = retries
+
+    async def cpu(self, function, *args):
+        """ Returns the output of function, run in a worker process """
+
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def io(self, function, *args):
+        """ Returns the output of function, run in a thread (reading files and the result store) """
+
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    async def step(self, candidate, name, function):
+        """ Returns the output of the coroutine function(), retrying it if it fails """
+
+        for attempt in range(self.retries + 1):
+            start = time.perf_counter()
+            try:
+                output = await function()
+            except Exception as error:
+                if attempt == self.retries:
+                    raise
+                self.progress.retry(candidate, name, attempt + 1, error)
+                await asyncio.sleep(RETRY_DELAY * 2**attempt)
+            else:
+                self.progress.step(candidate, name, time.perf_counter() - start)
+                return output
+
+    async def align(self, candidate):
+        """ Returns the content of the source/prediction alignments of a system """
+
+        mt_lines = await self.io(lambda: list(input_files.open_input(candidate)))
+        alignments = await self.aligners.align(align_pipeline.aligner_input(self.src_lines, mt_lines))
+
+        return "".join(alignments).encode("utf-8")
+
+    async def score(self, candidate):
+        """ Returns the per-sentence statistics of a system as arrays """
+
+        rep = asyncio.ensure_future(self.step(candidate, "rep",
+                                              lambda: self.cpu(worker_rep_statistics, candidate,
+                                                               self.args.w1, self.args.w2)))
+        try:
+            alignments = await self.step(candidate, "align", lambda: self.align(candidate))
+            drop = await self.step(candidate, "drop", lambda: self.cpu(worker_drop_statistics, alignments))
+        except BaseException:
+            rep.cancel()
+            raise
+
+        return dict(await rep, **drop)
+
+    async def evaluate_system(self, candidate):
+        """ Returns the scores of a system (see batch_score.result_from_statistics) """
+
+        async with self.jobs:
+            arrays = key = None
+            if self.store is not None:
+                paths, params = align_pipeline.system_result_key(self.args, self.reference_set.n_grams_list,
+                                                                 candidate)
+                key = await self.io(self.store.key, "align_pipeline", paths, params)
+                arrays = await self.io(self.store.lookup, "align_pipeline", key)
+
+            if arrays is None:
+                arrays = await self.score(candidate)
+                if self.store is not None:
+                    await self.io(self.store.store, key, arrays)
+
+        return batch_score.result_from_statistics(self.reference_set, batch_score.statistics_from_arrays(arrays))
+
+    async def run_system(self, candidate):
+
+        try:
+            result = await self.evaluate_system(candidate)
+        except Exception as error:
+            self.progress.finish(candidate, error)
+            raise
+
+        self.progress.finish(candidate)
+
+        return result
+
+    async def run(self, candidates, jobs, aligner_workers):
+        """ Returns, in the order of the candidates, the scores of each system or the exception
+            that made it fail """
+
+        self.jobs = asyncio.Semaphore(jobs)
+        self.aligners = AlignerQueue(shlex.split(self.args.aligner), aligner_workers)
+        self.progress = Progress(len(candidates))
+
+        try:
+            return await asyncio.gather(*[self.run_system(candidate) for candidate in candidates],
+                                        return_exceptions=True)
+        finally:
+            self.aligners.close()
+
+################################################################################################
+###                                     MAIN FUNCTION                                        ###
+################################################################################################
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Score several systems at once, aligning the next systems "
+                                                 "while the current ones are scored")
+
+    # Optional arguments
+    rep_score.add_n_grams_argument(parser)
+    rep_score.add_weight_arguments(parser, tandem=False)
+    parser.add_argument("--workers", type=int, default=2,
+                        help="Number of processes that compute the scores")
+    parser.add_argument("--aligner-workers", dest="aligner_workers", type=int, default=1,
+                        help="Number of persistent aligner processes")
+    parser.add_argument("--jobs", type=int,
+                        help="Maximum number of systems in flight (default: workers + aligner workers)")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES,
+                        help="Number of times a failed step of a system is retried")
+    drop_score.add_stopwords_arguments(parser, several=False, src_path=False)
+    reference_cache.add_cache_arguments(parser)
+    result_store.add_result_arguments(parser)
+
+    # Required arguments
+    required = parser.add_argument_group("required arguments")
+    required.add_argument("--aligner", type=str, required=True,
+                          help="Command of the aligner (e.g. \"python3 stub_aligner.py\")")
+    required.add_argument("--src_path", type=str, required=True,
+                          help="Path to the test source language file")
+    required.add_argument("--src_ref_align", nargs='+', required=True,
+                          help="Path to the source/reference alignments")
+    required.add_argument("-r", "--reference", nargs='+', required=True,
+                          help="Provide a list with the paths to the tokenized reference files")
+    required.add_argument("-p", "--predicted", nargs='+', required=True,
+                          help="Provide a list with the paths to the tokenized translations of each system")
+
+    args = parser.parse_args()
+
+    n_grams_list = rep_score.n_grams_from_arguments(args)
+    drop_score.check_stopwords_arguments(args, src_path=False)
+
+    reference_set = batch_score.ReferenceSet(args.reference, n_grams_list, args.src_ref_align, args.src_path,
+                                             args.stopwords_path, reference_cache.cache_from_arguments(args))
+
+    if min(reference_set.nw_ref) == 0:
+        print("No valid reference file.")
+        exit(0)
+
+    src_lines = list(input_files.open_input(args.src_path))
+
+    executor = ProcessPoolExecutor(args.workers, initializer=init_worker, initargs=(reference_set,))
+    try:
+        orchestrator = Orchestrator(args, reference_set, executor, src_lines,
+                                    result_store.store_from_arguments(args), args.retries)
+        outcomes = asyncio.run(orchestrator.run(args.predicted, args.jobs or args.workers + args.aligner_workers,
+                                                args.aligner_workers))
+    finally:
+        executor.shutdown()
+
+    # The systems that failed have an empty row
+    results = [dict() if isinstance(outcome, BaseException) else outcome for outcome in outcomes]
+    print(batch_score.format_table(args.predicted, results, n_grams_list))
+
+    failed = [(candidate, outcome) for candidate, outcome in zip(args.predicted, outcomes)
+              if isinstance(outcome, BaseException)]
+    for candidate, error in failed:
+        sys.stderr.write("FAILED {}: {}: {}\n".format(candidate, type(error).__name__, error))
+
+    if failed:
+        exit(1)
+
+if __name__ == "__main__":
+
+    main()
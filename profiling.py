@@ -0,0 +1,140 @@
+import sys
+import json
+import time
+import cProfile
+import resource
+from contextlib import contextmanager, nullcontext
+
+################################################################################################
+###                                 AUXILIARY FUNCTIONS                                      ###
+################################################################################################
+
+def reset_peak_memory():
+    """ Resets the peak resident memory of the process, where the system allows it (Linux) """
+
+    try:
+        with open("/proc/self/clear_refs", 'w') as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_memory():
+    """ Returns the peak resident memory of the process in kB """
+
+    try:
+        with open("/proc/self/status", 'r') as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+
+    # ru_maxrss is in kB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+class Profiler(object):
+    """
+    Records the time and the peak memory of each stage of a run, and counters
+    of the events of the scores (n-grams generated, alignment pairs parsed, ...).
+    The peak memory of a stage is only its own if the system allows resetting
+    it, otherwise it is the peak of the process so far.
+
+    If cprofile_stage is given, that stage runs under cProfile and its
+    statistics are dumped to cprofile_path.
+    """
+
+    enabled = True
+
+    def __init__(self, cprofile_stage=None, cprofile_path=None):
+
+        self.stages = dict()
+        self.counters = dict()
+        self.cprofile_stage = cprofile_stage
+        self.cprofile_path = cprofile_path or "{}.prof".format(cprofile_stage)
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+
+        profile = cProfile.Profile() if name == self.cprofile_stage else None
+
+        reset_peak_memory()
+        start = time.perf_counter()
+        if profile is not None:
+            profile.enable()
+
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                profile.dump_stats(self.cprofile_path)
+
+            # A stage that runs more than once accumulates its time
+            stage = self.stages.setdefault(name, {"seconds": 0.0, "peak_memory_kb": 0})
+            stage["seconds"] += time.perf_counter() - start
+            stage["peak_memory_kb"] = max(stage["peak_memory_kb"], peak_memory())
+
+    def count(self, name, value=1):
+        """ Adds value to a counter """
+
+        self.counters[name] = self.counters.get(name, 0) + int(value)
+
+    def report(self):
+        """ Returns a dictionary with the stages, the counters, the total time and the peak memory """
+
+        return {"stages": self.stages, "counters": self.counters,
+                "total_seconds": time.perf_counter() - self.start,
+                "peak_memory_kb": max([stage["peak_memory_kb"] for stage in self.stages.values()] + [peak_memory()])}
+
+    def write(self, path, **fields):
+        """ Writes the report, with any additional fields, as json to a file ("-" for stderr) """
+
+        report = dict(fields, **self.report())
+
+        if path == "-":
+            sys.stderr.write(json.dumps(report, indent=2) + "\n")
+        else:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+
+
+class NullProfiler(object):
+    """ Profiler used when profiling is off: stages and counters do nothing. Counters that need
+        extra work should only be computed if enabled is set """
+
+    enabled = False
+
+    def stage(self, name):
+        return nullcontext()
+
+    def count(self, name, value=1):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+def add_profile_arguments(parser):
+    """ Adds the profiling options to an argument parser """
+
+    parser.add_argument("--profile", type=str,
+                        help="Write a json report with the time and peak memory of each stage and the counters "
+                             "of the score to this path (\"-\" for stderr)")
+    parser.add_argument("--cprofile", type=str,
+                        help="Name of a stage of the report to run under cProfile (requires --profile)")
+    parser.add_argument("--cprofile-path", dest="cprofile_path", type=str,
+                        help="Path of the cProfile statistics (default: <stage>.prof)")
+
+
+def profiler_from_arguments(args):
+    """ Returns the profiler for the parsed arguments (NULL_PROFILER if profiling is off) """
+
+    if not args.profile:
+        return NULL_PROFILER
+
+    return Profiler(args.cprofile, args.cprofile_path)
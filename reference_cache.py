@@ -0,0 +1,173 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+################################################################################################
+###                                 AUXILIARY FUNCTIONS                                      ###
+################################################################################################
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "mt_adequacy_metrics")
+DEFAULT_CACHE_SIZE = 1024
+
+# Bumped whenever the layout of the cached arrays changes, so old entries are not reused
+CACHE_VERSION = 2
+
+
+def file_hash(path, block_size=1 << 20):
+    """ Returns the sha1 hex digest of the content of a file """
+
+    digest = hashlib.sha1()
+
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def encode_strings(strings):
+    """ Returns a uint8 array with the utf-8 encoding of the newline-joined strings """
+
+    return np.frombuffer("\n".join(strings).encode("utf-8"), dtype=np.uint8)
+
+
+def decode_strings(array):
+    """ Returns the list of strings encoded with encode_strings """
+
+    if len(array) == 0:
+        return [""]
+
+    return bytes(array).decode("utf-8").split("\n")
+
+
+class ReferenceCache(object):
+    """
+    On-disk cache of the reference-side structures of the metrics.
+
+    Each entry is a directory with one .npy file per array, keyed by the content hash
+    of the input files and by the parameters used to build it, so that entries are
+    rebuilt automatically when an input changes. Arrays are memory-mapped when loaded.
+    Entries are evicted in least recently used order when the cache exceeds max_size
+    (in MB).
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size=DEFAULT_CACHE_SIZE):
+
+        self.cache_dir = cache_dir
+        self.max_size = max_size * 1024 * 1024
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, kind, paths, params):
+        """ Returns the key of an entry built from the given files and parameters """
+
+        description = {"version": CACHE_VERSION,
+                       "kind": kind,
+                       "files": [file_hash(path) for path in paths],
+                       "params": params}
+
+        return hashlib.sha1(json.dumps(description, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def load(self, key):
+        """ Returns a dictionary with the memory-mapped arrays of an entry (None if missing) """
+
+        entry = os.path.join(self.cache_dir, key)
+
+        if not os.path.isdir(entry):
+            return None
+
+        try:
+            arrays = dict((name[:-4], np.load(os.path.join(entry, name), mmap_mode='r'))
+                          for name in os.listdir(entry) if name.endswith(".npy"))
+            # Mark the entry as recently used
+            os.utime(entry)
+        except (OSError, ValueError):
+            return None
+
+        return arrays
+
+    def store(self, key, arrays):
+        """ Writes the arrays of an entry and evicts old entries if the cache is too large """
+
+        tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=self.cache_dir)
+
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, name + ".npy"), np.asarray(array))
+
+        # Make the entry visible at once, so concurrent runs never see partial entries
+        try:
+            os.rename(tmp_dir, os.path.join(self.cache_dir, key))
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        self.evict()
+
+    def get(self, kind, paths, params, build):
+        """ Returns the arrays of the entry for the given files and parameters,
+            calling build() and storing its output if the entry is missing """
+
+        # The standard input can only be read once, so it is never cached
+        if any(path == "-" for path in paths):
+            return build()
+
+        key = self.key(kind, paths, params)
+        arrays = self.load(key)
+
+        if arrays is None:
+            arrays = build()
+            self.store(key, arrays)
+
+        return arrays
+
+    def entries(self):
+        """ Returns a list with the (last use time, size in bytes, path) of each entry. The
+            entries that another process evicts while they are listed are skipped """
+
+        entries = list()
+        for name in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir, name)
+            if name.startswith("."):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+                entries.append((os.path.getmtime(entry), size, entry))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+
+        return entries
+
+    def evict(self, extra_size=0):
+        """ Removes the least recently used entries until the cache, together with extra_size
+            bytes of other files of the cache directory, fits in max_size """
+
+        entries = self.entries()
+        total = extra_size + sum(size for _, size, _ in entries)
+
+        for _, size, entry in sorted(entries):
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+
+def add_cache_arguments(parser):
+    """ Adds the cache options to an argument parser """
+
+    parser.add_argument("--cache-dir", dest="cache_dir", type=str, default=DEFAULT_CACHE_DIR,
+                        help="Directory where the reference-side structures are cached")
+    parser.add_argument("--cache-size", dest="cache_size", type=int, default=DEFAULT_CACHE_SIZE,
+                        help="Maximum size of the cache in MB")
+    parser.add_argument("--no-cache", dest="no_cache", action="store_true",
+                        help="Do not read or write the reference cache")
+
+
+def cache_from_arguments(args):
+    """ Returns the ReferenceCache described by the parsed arguments (None if disabled) """
+
+    if args.no_cache:
+        return None
+
+    return ReferenceCache(args.cache_dir, args.cache_size)
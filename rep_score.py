@@ -1,9 +1,20 @@
+import sys
 import math
 import argparse
 import operator
 import linecache
 import numpy as np
-from collections import Counter
+from bisect import bisect_right
+from functools import partial
+from itertools import chain, zip_longest
+from collections import Counter, OrderedDict
+
+import sharding
+import profiling
+import input_files
+import corpus_store
+import result_store
+import reference_cache
 
 ################################################################################################
 ###                                 AUXILIARY FUNCTIONS                                      ###
@@ -33,59 +44,121 @@ def count_repetitions(n_gram_sentence_list, threshold):
     return merged_repeated_list
 
 
-def n_gram_score(n_gram_reference_repeated_list, n_gram_output_repeated_list):
-    """ Returns a score accordingly to repetitions of n-grams that are not present on the target.
-        Only n-grams that appear in the output more than once are checked. """
+def n_gram_counts(sentence, n_grams):
+    """ Returns a Counter with the n-grams of a single tokenized sentence, in the order of
+        create_ngram_sentence_list """
+
+    return Counter(zip(*[sentence[ix:] for ix in range(n_grams)]))
+
+
+class ReferenceProfile(object):
+    """ Hash-indexed n-gram counts of a single reference sentence, so that each
+        candidate n-gram is matched with a single dictionary lookup """
+
+    __slots__ = ("counts",)
+
+    def __init__(self, n_gram_counts):
+        # The dictionary of counts is used as is, so a single reference is never copied
+        self.counts = n_gram_counts
+
+    def get(self, n_gram):
+        """ Returns the count of the n-gram in the reference (None if absent) """
+        return self.counts.get(n_gram)
+
+    def nr_n_grams(self):
+        """ Returns the number of n-grams of the reference """
+        return sum(self.counts.values())
+
+    def max_overlap(self, output_counts):
+        """ Returns the sum of min(count, reference count) over the (n-gram, count) tuples """
+
+        counts = self.counts
+
+        return sum([min(count, counts.get(n_gram, 0)) for n_gram, count in output_counts])
+
 
-    score = [0 for _ in range(len(n_gram_reference_repeated_list))]
+class MultiReferenceProfile(object):
+    """ Fused n-gram counts of all the references of a sentence, in a single flat table that
+        maps each n-gram to the tuple with its count in every reference (0 where absent), so
+        that each candidate n-gram is matched against every reference with a single lookup """
 
-    found = 0
+    __slots__ = ("counts", "nr_references")
 
-    for index, (list1, list2) in enumerate(zip(n_gram_output_repeated_list, n_gram_reference_repeated_list)):
+    def __init__(self, ref_counts):
+        # The first reference is fused with the rest of them (fused first when there are more
+        # than one), so two references, the usual case, take a single pass over each of them
+        first, rest = ref_counts[0], ref_counts[1:]
 
-        for item1 in list1:
+        if len(rest) == 1:
+            rest_counts = rest[0]
+            table = {n_gram: (count, rest_counts.get(n_gram, 0)) for n_gram, count in first.items()}
+            for n_gram, count in rest_counts.items():
+                if n_gram not in table:
+                    table[n_gram] = (0, count)
+        else:
+            rest_counts = MultiReferenceProfile(rest).counts
+            padding = (0,) * len(rest)
+            table = {n_gram: (count,) + rest_counts.get(n_gram, padding) for n_gram, count in first.items()}
+            for n_gram, row in rest_counts.items():
+                if n_gram not in table:
+                    table[n_gram] = (0,) + row
 
-            #If the predicted n-gram appears more than once
-            if item1[1] > 1:
+        self.counts = table
+        self.nr_references = len(ref_counts)
 
-                found = 0
+    def get(self, n_gram):
+        """ Returns the tuple with the count of the n-gram in each reference (None if absent) """
+        return self.counts.get(n_gram)
 
-                #If the n-gram appears in the list of output n-grams add the difference (if positive)
-                for item2 in list2:
-                    if item1[0] == item2[0]:
-                        score[index] += max(0, item1[1]-item2[1])
-                        found = 1
-                        break
+    def nr_n_grams(self):
+        """ Returns the number of n-grams of all the references """
+        return sum(map(sum, self.counts.values()))
 
-                #If the n-gram doesn't appear in the list of output n-grams add its count.
-                if not found:
-                    score[index] += item1[1]
+    def max_overlap(self, output_counts):
+        """ Returns the largest sum of min(count, reference count) over the (n-gram, count)
+            tuples with a single reference """
 
-    return score
+        counts = self.counts
+        overlap = [0] * self.nr_references
 
+        for n_gram, count in output_counts:
+            ref_counts = counts.get(n_gram)
 
-def consecutive_words_score(n_gram_reference_repeated_list, n_gram_output_repeated_list):
-    """ Returns a score for the bi-grams that are consecutive words """
+            if ref_counts is not None:
+                for ix, ref_count in enumerate(ref_counts):
+                    overlap[ix] += min(count, ref_count)
 
-    score = [0 for _ in range(len(n_gram_output_repeated_list))]
-    
-    found = 0
+        return max(overlap)
 
-    for index, (list1, list2) in enumerate(zip(n_gram_output_repeated_list, n_gram_reference_repeated_list)):
 
-        for item1 in list1:
-            if len(set(item1[0])) == 1:
-                found = 0
-                for item2 in list2:
-                    if len(set(item2[0])) == 1:
-                        if set(item1[0]) == set(item2[0]):
-                            score[index] += max(0, item1[1]-item2[1])
-                            found = 1
-                            break
-                if not found:
-                    score[index] += item1[1]
+def reference_profile(ref_counts):
+    """ Returns the profile of the references of a sentence given the dictionary with the n-gram
+        counts of each reference. A single reference is its own profile, and is not fused """
 
-    return score
+    if len(ref_counts) == 1:
+        return ReferenceProfile(ref_counts[0])
+
+    return MultiReferenceProfile(ref_counts)
+
+
+def sentence_min_n_gram_score(profile, output_counts):
+    """ Returns the minimum n-gram score over the references of a single sentence.
+        Since max(0, count-ref_count) = count - min(count, ref_count), this is the total
+        count of the repeated n-grams minus their largest overlap with a single reference """
+
+    #Only the predicted n-grams that appear more than once are checked
+    repeated = [(n_gram, count) for n_gram, count in output_counts if count > 1]
+
+    return sum([count for _, count in repeated]) - profile.max_overlap(repeated)
+
+
+def sentence_min_consecutive_score(profile, output_counts):
+    """ Returns the minimum consecutive words score over the references of a single sentence """
+
+    #Only n-grams made of a single repeated word are checked
+    consecutive = [(n_gram, count) for n_gram, count in output_counts if len(set(n_gram)) == 1]
+
+    return sum([count for _, count in consecutive]) - profile.max_overlap(consecutive)
 
 
 def calculate_final_scores(n_gram_scores, consecutive_scores, w1, w2):
@@ -94,6 +167,13 @@ def calculate_final_scores(n_gram_scores, consecutive_scores, w1, w2):
     return [w1*score1 + w2*score2 for (score1, score2) in zip(n_gram_scores, consecutive_scores)]
 
 
+def calculate_total_values(all_n_gram_scores, consecutive_scores, w1, w2):
+    """ Returns a dictionary with the total of the final scores for each value of n """
+
+    return dict((n_grams, sum(calculate_final_scores(n_gram_scores, consecutive_scores, w1, w2)))
+                for n_grams, n_gram_scores in all_n_gram_scores.items())
+
+
 def calculate_number_words(references, candidate):
     """ Returns the number of words from the reference closest to the length of the prediction 
         and the number of words in the candidate sentence """
@@ -101,100 +181,1136 @@ def calculate_number_words(references, candidate):
     # Calculate the number of words for each reference file
     nw_ref = list()
     for ref in references:
-        nw_ref.append(sum([len(line.strip('\n').split()) for line in open(ref, 'r').readlines()]))
+        nw_ref.append(sum([len(line.strip('\n').split()) for line in input_files.open_input(ref)]))
 
     # Calculate the number of words in the candidate translation
-    nw_can = sum([len(line.strip('\n').split()) for line in open(candidate, 'r').readlines()])
+    nw_can = sum([len(line.strip('\n').split()) for line in input_files.open_input(candidate)])
+
+    return closest_reference_length(nw_ref, nw_can), nw_can
+
+
+def closest_reference_length(nw_ref, nw_can):
+    """ Returns the number of words from the reference closest to the length of the prediction,
+        given the number of words of each reference and of the candidate """
 
-    # Return the reference length closest to the candidate
     diff_list = [x-nw_can for x in nw_ref]
     min_ix, min_v = min(enumerate(diff_list), key=operator.itemgetter(1))
 
-    return nw_ref[min_ix], nw_can
+    return nw_ref[min_ix]
+
+
+def brevity_penalty(ref_length, pred_length):
+    """ Returns the brevity penalty for a prediction shorter than the reference """
+
+    if pred_length < ref_length:
+        return 1/(math.exp(1-(ref_length/pred_length)))
+
+    return 1
+
+
+def format_rep_scores(total_values, n_grams_list, nw_ref, pred_length):
+    """ Returns the text with the total, the brevity penalty and the normalized score for each value
+        of n, given the number of words of each reference and of the prediction """
+
+    ref_length = closest_reference_length(nw_ref, pred_length)
+
+    # Calculate the brevity penalty
+    bp = brevity_penalty(ref_length, pred_length)
+
+    # Get the final score
+    normalize_constant = ref_length
+    if normalize_constant == 0:
+        return "No valid reference file."
+
+    if len(n_grams_list) == 1:
+        total_value = total_values[n_grams_list[0]]
+        normalized_value = bp*100*float(total_value)/normalize_constant
+        return "REP_SCORE: {}, BP: {:.2f}, NORMALIZED_REP_SCORE: {:.2f}".format(total_value, bp, normalized_value)
+
+    lines = ["N\tREP_SCORE\tBP\tNORMALIZED_REP_SCORE"]
+    for n_grams in n_grams_list:
+        total_value = total_values[n_grams]
+        normalized_value = bp*100*float(total_value)/normalize_constant
+        lines.append("{}\t{}\t{:.2f}\t{:.2f}".format(n_grams, total_value, bp, normalized_value))
+
+    return "\n".join(lines)
 
 ################################################################################################
-###                                     MAIN FUNCTION                                        ###
+###                                    TANDEM REPEATS                                        ###
 ################################################################################################
 
-def main():
+def tandem_repeats(sentence):
+    """
+    Returns the maximal tandem repeats (runs) of a sentence as a list of
+    (start, end, period) tuples: sentence[start:end] is made of at least two
+    consecutive copies of a primitive unit of length period, and can not be
+    extended to either side.
+
+    A run of period p has sentence[j] == sentence[j+p] for at least p
+    consecutive positions, so it is found by checking only the positions
+    that are multiples of p (O(n log n) checks over all the periods) and
+    extending the matches from there. The matches inside a run already found
+    with a period that divides p are skipped.
+    """
+
+    n = len(sentence)
+    runs = list()
+    seen = set()
+
+    # Starts and ends of the runs of each period, in increasing order
+    starts = dict()
+    ends = dict()
+
+    for period in range(1, n//2 + 1):
+        # The positions before the end of the matches of the last run of this period belong to it
+        skip_until = 0
+        divisors = [unit for unit in starts if period % unit == 0]
+
+        for check in range(0, n - period, period):
+            if check < skip_until or sentence[check] != sentence[check+period]:
+                continue
+
+            # The matches sentence[j] == sentence[j+period] are known for j in [first, last]
+            first, last = check, check
+            for unit in divisors:
+                ix = bisect_right(starts[unit], check) - 1
+                if ix >= 0 and check < ends[unit][ix] - period:
+                    first, last = starts[unit][ix], ends[unit][ix] - period - 1
+                    break
+
+            while first > 0 and sentence[first-1] == sentence[first-1+period]:
+                first -= 1
+            while last + period + 1 < n and sentence[last+1] == sentence[last+1+period]:
+                last += 1
+
+            skip_until = last + 1
+            start, end = first, last + period + 1
+
+            # A run with the same span as one of a smaller period is that run
+            if end - start >= 2*period and (start, end) not in seen:
+                seen.add((start, end))
+                runs.append((start, end, period))
+                starts.setdefault(period, []).append(start)
+                ends.setdefault(period, []).append(end)
+
+    return runs
+
+
+def canonical_unit(unit):
+    """ Returns the smallest rotation of the unit of a tandem repeat, so that the same loop
+        matches whatever the word where it starts """
+
+    return min(unit[ix:] + unit[:ix] for ix in range(len(unit)))
+
+
+def tandem_counts(sentence):
+    """ Returns a dictionary with the count of each unit of a sentence, the number of copies
+        of the unit that repeat a previous one in the runs of period 2 or more (runs of
+        single words are scored by the consecutive words score) """
+
+    # Only sentences with a repeated word can have a run
+    if len(set(sentence)) == len(sentence):
+        return dict()
+
+    counts = dict()
+    for start, end, period in tandem_repeats(sentence):
+        if period > 1:
+            unit = canonical_unit(tuple(sentence[start:start+period]))
+            counts[unit] = counts.get(unit, 0) + (end - start) // period - 1
+
+    return counts
+
+
+def sentence_min_tandem_score(profile, output_counts):
+    """ Returns the minimum tandem repeats score over the references of a single sentence: the
+        number of repeated copies of each unit that are not in the reference, given the profile
+        of the tandem_counts of the references """
+
+    return sum(output_counts.values()) - profile.max_overlap(output_counts.items())
+
+
+def build_tandem_profile_list(ref_sentence_list):
+    """ Returns a ReferenceProfileList with the profile of the tandem_counts of the references of
+        each sentence """
+
+    return ReferenceProfileList([SentenceCounts(ref, tandem_counts) for ref in ref_sentence_list])
+
+
+def profile_tandem_scores(tandem_profiles, pred_sentence_list):
+    """ Returns a list with the tandem repeats score of each sentence (minimum over the
+        references), given the tandem profiles of the references """
+
+    tandem_scores = list()
+
+    for ix, pred_sentence in enumerate(pred_sentence_list):
+        pred_counts = tandem_counts(pred_sentence)
+
+        # Without tandem repeats the score is 0, and the references are not profiled
+        tandem_scores.append(sentence_min_tandem_score(tandem_profiles[ix], pred_counts) if pred_counts else 0)
+
+    return tandem_scores
+
+
+def sentence_list_tandem_scores(ref_sentence_list, pred_sentence_list):
+    """ Returns a list with the tandem repeats score of each sentence (minimum over the references) """
+
+    return profile_tandem_scores(build_tandem_profile_list(ref_sentence_list), pred_sentence_list)
+
+
+def sentence_tandem_score(ref_sentences, pred_sentence):
+    """ Returns the tandem repeats score of a single prediction (minimum over the references) """
+
+    return sentence_list_tandem_scores([[ref] for ref in ref_sentences], [pred_sentence])[0]
+
+################################################################################################
+###                                     STREAMING MODE                                       ###
+################################################################################################
+
+def read_parallel_lines(paths):
+    """ Yields a tuple with the tokenized line of each file, reading all the files in lockstep """
+
+    files = [input_files.open_input(path) for path in paths]
+
+    try:
+        for lines in zip_longest(*files):
+            assert None not in lines, "Reference and predicted text files should have the same length"
+            yield tuple(line.split() for line in lines)
+    finally:
+        for f in files:
+            f.close()
+
+
+def sentence_counts(sentence, n_grams):
+    """ Returns the list of (n-gram, count) tuples of a single tokenized sentence """
+
+    return list(n_gram_counts(sentence, n_grams).items())
+
+
+def sentence_multi_rep_scores(ref_sentences, pred_sentence, n_grams_list):
+    """ Returns a dictionary with the n-gram score of a single prediction for each value of n
+        and its consecutive words score (minimum over the references) """
+
+    ref_profiles = build_reference_profile_lists([[ref] for ref in ref_sentences], n_grams_list)
+    n_gram_scores, consec_scores = profile_multi_rep_scores(ref_profiles, [pred_sentence], n_grams_list)
+
+    return dict((n_grams, scores[0]) for n_grams, scores in n_gram_scores.items()), consec_scores[0]
+
+
+def stream_rep_score(references, candidate, n_grams_list, w1, w2, w3=0.0):
+    """ Returns a dictionary with the total repetition score for each value of n, the number
+        of words of each reference and the number of words of the candidate, reading every
+        file once and one line at a time. The tandem repeats score is only computed if w3 is set """
+
+    total_values = dict((n_grams, 0) for n_grams in n_grams_list)
+    nw_ref = [0 for _ in references]
+    nw_can = 0
+
+    for lines in read_parallel_lines([candidate] + list(references)):
+        pred_sentence, ref_sentences = lines[0], lines[1:]
+
+        n_gram_values, consec_value = sentence_multi_rep_scores(ref_sentences, pred_sentence, n_grams_list)
+        tandem_value = sentence_tandem_score(ref_sentences, pred_sentence) if w3 else 0
+        for n_grams, n_gram_value in n_gram_values.items():
+            total_values[n_grams] += w1*n_gram_value + w2*consec_value + w3*tandem_value
+
+        nw_can += len(pred_sentence)
+        for ix, ref in enumerate(ref_sentences):
+            nw_ref[ix] += len(ref)
+
+    return total_values, nw_ref, nw_can
+
+################################################################################################
+###                                   REFERENCE PROFILES                                     ###
+################################################################################################
+
+class SentenceCounts(object):
+    """ Lazy list with the dictionary of n-gram counts of each sentence of a tokenized
+        reference, computed with the count function when the sentence is accessed """
+
+    __slots__ = ("sentence_list", "count")
+
+    def __init__(self, sentence_list, count):
+        self.sentence_list = sentence_list
+        self.count = count
+
+    def __len__(self):
+        return len(self.sentence_list)
+
+    def __getitem__(self, ix):
+        return self.count(self.sentence_list[ix])
+
+
+class CachedCounts(object):
+    """ Lazy list with the dictionary of n-gram counts of each sentence of a reference, decoded from
+        the arrays stored in the cache (see profiles_to_arrays and tandem_profiles_to_arrays)
+        when the sentence is accessed. The n-grams have n_grams tokens, and the tandem repeats
+        units are delimited by the unit_offsets array """
+
+    __slots__ = ("vocab", "ids", "unit_offsets", "n_grams", "counts", "offsets")
+
+    def __init__(self, arrays, n_grams=None):
+        # Plain views of the memory-mapped arrays, which are much faster to slice
+        arrays = dict((name, array.view(np.ndarray)) for name, array in arrays.items())
+
+        self.vocab = reference_cache.decode_strings(arrays["vocab"])
+        self.ids = arrays["n_grams"] if n_grams else arrays["units"]
+        self.unit_offsets = None if n_grams else arrays["unit_offsets"]
+        self.n_grams = n_grams
+        self.counts = arrays["counts"]
+        self.offsets = arrays["offsets"].tolist()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, ix):
+        start, end = self.offsets[ix], self.offsets[ix+1]
+        vocab = self.vocab
+
+        if self.unit_offsets is None:
+            tokens = iter([vocab[token] for token in self.ids[start*self.n_grams:end*self.n_grams].tolist()])
+            units = zip(*[tokens] * self.n_grams)
+        else:
+            bounds = self.unit_offsets[start:end+1].tolist()
+            tokens = [vocab[token] for token in self.ids[bounds[0]:bounds[-1]].tolist()]
+            units = [tuple(tokens[first-bounds[0]:last-bounds[0]]) for first, last in zip(bounds[:-1], bounds[1:])]
+
+        return dict(zip(units, self.counts[start:end].tolist()))
+
+
+class ReferenceProfileList(object):
+    """ Lazy list with the profile (see reference_profile) of the references of each sentence,
+        given a lazy list (SentenceCounts or CachedCounts) with the counts of each reference. A
+        profile is only built when it is accessed, so the sentences whose prediction has nothing
+        to look up in the references are never profiled """
+
+    __slots__ = ("ref_counts",)
+
+    def __init__(self, ref_counts):
+        self.ref_counts = ref_counts
+
+    def __len__(self):
+        return len(self.ref_counts[0])
+
+    def __getitem__(self, ix):
+        return reference_profile([counts[ix] for counts in self.ref_counts])
+
+
+def build_reference_profile_lists(ref_sentence_list, n_grams_list):
+    """ Returns a dictionary with, for each value of n (and n=2, needed by the consecutive words
+        score), the ReferenceProfileList of the sentences """
+
+    return dict((n_grams, ReferenceProfileList([SentenceCounts(ref, partial(n_gram_counts, n_grams=n_grams))
+                                                for ref in ref_sentence_list]))
+                for n_grams in set(n_grams_list) | {2})
+
+
+def profile_multi_rep_scores(ref_profiles, pred_sentence_list, n_grams_list):
+    """ Returns a dictionary with the per-sentence n-gram scores for each value of n and the
+        per-sentence consecutive words scores, given the reference profiles. The n-gram score
+        only looks up the repeated n-grams and the consecutive words score the bi-grams of a
+        single word, so without them the scores are 0 and the references are not profiled """
+
+    n_gram_scores = dict((n_grams, list()) for n_grams in n_grams_list)
+    consec_scores = list()
+
+    for ix, pred_sentence in enumerate(pred_sentence_list):
+
+        # The consecutive words score is always computed over bi-grams
+        for n_grams in sorted(set(n_grams_list) | {2}):
+            pred_counts = n_gram_counts(pred_sentence, n_grams)
+
+            repeated = n_grams in n_gram_scores and len(pred_counts) < len(pred_sentence) - n_grams + 1
+            consecutive = n_grams == 2 and any(map(operator.eq, pred_sentence, pred_sentence[1:]))
+            profile = ref_profiles[n_grams][ix] if repeated or consecutive else None
+
+            if n_grams in n_gram_scores:
+                n_gram_scores[n_grams].append(sentence_min_n_gram_score(profile, pred_counts.items())
+                                              if repeated else 0)
+
+            if n_grams == 2:
+                consec_scores.append(sentence_min_consecutive_score(profile, pred_counts.items())
+                                     if consecutive else 0)
+
+    return n_gram_scores, consec_scores
+
+
+def count_rep_events(profiler, ref_profiles, pred_sentence_list, n_grams_list):
+    """ Adds to the profiler the number of n-grams generated for the references and the
+        prediction, of repeated n-grams of the prediction, of lookups of the prediction n-grams
+        in the reference profiles and of the lookups that found the n-gram """
+
+    nr_ref_n_grams = 0
+    nr_pred_n_grams = 0
+    nr_repeated = 0
+    nr_lookups = 0
+    nr_matches = 0
+
+    for n_grams in sorted(set(n_grams_list) | {2}):
+        for ix, pred_sentence in enumerate(pred_sentence_list):
+            profile = ref_profiles[n_grams][ix]
+            pred_counts = sentence_counts(pred_sentence, n_grams)
+
+            nr_ref_n_grams += profile.nr_n_grams()
+            nr_pred_n_grams += max(0, len(pred_sentence)-n_grams+1)
+
+            # The same n-grams that are looked up by sentence_min_n_gram_score and sentence_min_consecutive_score
+            lookups = list()
+            if n_grams in n_grams_list:
+                repeated = [n_gram for n_gram, count in pred_counts if count > 1]
+                nr_repeated += len(repeated)
+                lookups.extend(repeated)
+            if n_grams == 2:
+                lookups.extend([n_gram for n_gram, _ in pred_counts if len(set(n_gram)) == 1])
+
+            nr_lookups += len(lookups)
+            nr_matches += sum([profile.get(n_gram) is not None for n_gram in lookups])
+
+    profiler.count("sentences", len(pred_sentence_list))
+    profiler.count("reference_ngrams", nr_ref_n_grams)
+    profiler.count("prediction_ngrams", nr_pred_n_grams)
+    profiler.count("repeated_ngrams", nr_repeated)
+    profiler.count("reference_lookups", nr_lookups)
+    profiler.count("reference_matches", nr_matches)
+
+
+def profiles_to_arrays(sentence_list, n_grams):
+    """ Returns the arrays with the n-gram counts of a tokenized reference, as stored in the cache """
+
+    vocab = dict()
+    n_gram_ids = list()
+    counts = list()
+    offsets = [0]
+
+    for sentence in sentence_list:
+        for n_gram, count in sentence_counts(sentence, n_grams):
+            n_gram_ids.extend([vocab.setdefault(token, len(vocab)) for token in n_gram])
+            counts.append(count)
+        offsets.append(len(counts))
+
+    return {"vocab": reference_cache.encode_strings(list(vocab)),
+            "n_grams": np.array(n_gram_ids, dtype=np.int32),
+            "counts": np.array(counts, dtype=np.int32),
+            "offsets": np.array(offsets, dtype=np.int64),
+            "lengths": np.array([len(sentence) for sentence in sentence_list], dtype=np.int64)}
+
+
+def tandem_profiles_to_arrays(sentence_list):
+    """ Returns the arrays with the tandem repeats counts of a tokenized reference, as stored in
+        the cache. The units have different lengths, so the offset of each unit is stored too """
+
+    vocab = dict()
+    unit_ids = list()
+    unit_offsets = [0]
+    counts = list()
+    offsets = [0]
+
+    for sentence in sentence_list:
+        for unit, count in tandem_counts(sentence).items():
+            unit_ids.extend([vocab.setdefault(token, len(vocab)) for token in unit])
+            unit_offsets.append(len(unit_ids))
+            counts.append(count)
+        offsets.append(len(counts))
+
+    return {"vocab": reference_cache.encode_strings(list(vocab)),
+            "units": np.array(unit_ids, dtype=np.int32),
+            "unit_offsets": np.array(unit_offsets, dtype=np.int64),
+            "counts": np.array(counts, dtype=np.int32),
+            "offsets": np.array(offsets, dtype=np.int64)}
+
+
+def load_reference_profiles(references, n_grams_list, cache=None, profiler=profiling.NULL_PROFILER, tandem=False):
+    """ Returns the reference profiles (see build_reference_profile_lists) and the number
+        of words of each reference, reading them from the cache when possible. If tandem is
+        set, the profiles also have the tandem repeats profiles of each sentence ("tandem") """
+
+    if cache is None:
+        with profiler.stage("read_references"):
+            ref_sentence_list = [ [line.split() for line in input_files.open_input(path)] for path in references]
+            nw_ref = [sum([len(x) for x in ref]) for ref in ref_sentence_list]
+
+        with profiler.stage("reference_profiles"):
+            profiles = build_reference_profile_lists(ref_sentence_list, n_grams_list)
+            if tandem:
+                profiles["tandem"] = build_tandem_profile_list(ref_sentence_list)
+
+        return profiles, nw_ref
+
+    ref_counts = dict((n_grams, list()) for n_grams in set(n_grams_list) | {2})
+    tandem_ref_counts = list()
+    nw_ref = list()
+
+    for path in references:
+        read = lambda: [line.split() for line in input_files.open_input(path)]
+
+        for n_grams in ref_counts:
+            build = lambda: profiles_to_arrays(read(), n_grams)
+            with profiler.stage("reference_cache"):
+                arrays = cache.get("rep_score", [path], {"n": n_grams}, build)
+
+            with profiler.stage("reference_profiles"):
+                ref_counts[n_grams].append(CachedCounts(arrays, n_grams))
+            nw = int(arrays["lengths"].sum())
+
+        if tandem:
+            with profiler.stage("reference_cache"):
+                arrays = cache.get("rep_score_tandem", [path], {}, lambda: tandem_profiles_to_arrays(read()))
+
+            with profiler.stage("reference_profiles"):
+                tandem_ref_counts.append(CachedCounts(arrays))
+
+        nw_ref.append(nw)
+
+    # The profiles of each sentence are built from the cached counts when they are needed
+    profiles = dict((n_grams, ReferenceProfileList(counts)) for n_grams, counts in ref_counts.items())
+    if tandem:
+        profiles["tandem"] = ReferenceProfileList(tandem_ref_counts)
+
+    return profiles, nw_ref
+
+################################################################################################
+###                                     SENTENCE API                                         ###
+################################################################################################
+
+DEFAULT_MAX_PROFILES = 4096
+
+
+class RepScorer(object):
+    """
+    Scores single hypotheses (or small batches, e.g. the candidates of a beam)
+    as they are generated, without rebuilding the reference structures.
+
+        scorer = RepScorer(references)
+        scorer.score(hypothesis_tokens, ix)
+
+    The n-gram counts of the references of a sentence are compiled into a
+    profile (see reference_profile) the first time the sentence is scored, and
+    kept in a cache of the last max_profiles sentences. Not thread safe.
+
+    Inputs:
+    - references   : list with, for each reference, the list of its sentences
+                     (lists of tokens, or strings split on whitespace)
+    - n_grams      : value of n of the n-gram score
+    - w1, w2, w3   : multipliers lambda 1, lambda 2 and lambda 3 (tandem
+                     repeats score, only computed if not 0)
+    - max_profiles : number of sentences whose profiles are kept in memory
+    """
+
+    def __init__(self, references, n_grams=2, w1=1.0, w2=2.0, max_profiles=DEFAULT_MAX_PROFILES, w3=0.0):
+
+        assert n_grams >= 1, "n must be strictly positive"
+        assert len(set(len(ref) for ref in references)) <= 1, "All the references should have the same length"
+
+        self.references = references
+        self.n_grams = n_grams
+        self.w1 = w1
+        self.w2 = w2
+        self.w3 = w3
+        self.max_profiles = max_profiles
+        self.profiles = OrderedDict()
+
+    def __len__(self):
+        return len(self.references[0]) if self.references else 0
+
+    def profile(self, ix):
+        """ Returns the (n-gram, bi-gram, tandem repeats) profiles of the references of a sentence
+            (see reference_profile) """
+
+        profiles = self.profiles.get(ix)
 
-    parser = argparse.ArgumentParser()
+        if profiles is not None:
+            self.profiles.move_to_end(ix)
+            return profiles
+
+        ref_sentences = [ref[ix].split() if isinstance(ref[ix], str) else ref[ix] for ref in self.references]
+        build = lambda n_grams: reference_profile([n_gram_counts(ref, n_grams) for ref in ref_sentences])
+
+        # The consecutive words score is always computed over bi-grams
+        n_gram_profile = build(self.n_grams)
+        profiles = (n_gram_profile, n_gram_profile if self.n_grams == 2 else build(2),
+                    reference_profile([tandem_counts(ref) for ref in ref_sentences]))
+
+        self.profiles[ix] = profiles
+        if len(self.profiles) > self.max_profiles:
+            self.profiles.popitem(last=False)
+
+        return profiles
+
+    def components(self, hypothesis, ix=0):
+        """ Returns the n-gram score and the consecutive words score of a hypothesis (list of tokens)
+            for sentence ix (minimum over the references) """
+
+        n_gram_profile, bi_gram_profile, _ = self.profile(ix)
+
+        pred_counts = n_gram_counts(hypothesis, self.n_grams).items()
+        bi_gram_counts = pred_counts if self.n_grams == 2 else n_gram_counts(hypothesis, 2).items()
+
+        return (sentence_min_n_gram_score(n_gram_profile, pred_counts),
+                sentence_min_consecutive_score(bi_gram_profile, bi_gram_counts))
+
+    def tandem_score(self, hypothesis, ix=0):
+        """ Returns the tandem repeats score of a hypothesis for sentence ix (minimum over the references) """
+
+        return sentence_min_tandem_score(self.profile(ix)[2], tandem_counts(hypothesis))
+
+    def score(self, hypothesis, ix=0):
+        """ Returns the final score (w1 * n-gram score + w2 * consecutive words score, plus
+            w3 * tandem repeats score if w3 is set) of a hypothesis """
+
+        n_gram_value, consec_value = self.components(hypothesis, ix)
+        score = self.w1*n_gram_value + self.w2*consec_value
+
+        if self.w3:
+            score += self.w3*self.tandem_score(hypothesis, ix)
+
+        return score
+
+    def score_batch(self, hypotheses, ix=0):
+        """ Returns the list with the final score of each hypothesis of sentence ix """
+
+        return [self.score(hypothesis, ix) for hypothesis in hypotheses]
+
+################################################################################################
+###                                      NUMPY ENGINE                                        ###
+################################################################################################
+
+# Number of sentences scored at once by corpus_rep_scores
+NUMPY_BLOCK_SIZE = 50000
+
+
+def encode_corpus(sentence_list, vocab):
+    """ Returns a flat int32 array with the token ids of every sentence and an array with the
+        offsets of each sentence. Unseen tokens are added to the vocab dictionary """
+
+    ids = list()
+    offsets = [0]
+
+    for sentence in sentence_list:
+        ids.extend([vocab.setdefault(token, len(vocab)) for token in sentence])
+        offsets.append(len(ids))
+
+    return np.array(ids, dtype=np.int32), np.array(offsets, dtype=np.int64)
+
+
+def numpy_n_gram_keys(tokens, starts, n_grams, vocab_size):
+    """ Returns an exact int64 key for each n-gram starting at the given positions and
+        the upper bound of the keys. The token ids are packed in base vocab_size, and
+        the keys are made dense whenever the next packing step could overflow """
+
+    keys = tokens[starts].astype(np.int64)
+    bound = vocab_size
+
+    for j in range(1, n_grams):
+        if bound * vocab_size >= 2**62:
+            uniques, keys = np.unique(keys, return_inverse=True)
+            bound = len(uniques)
+        keys = keys * vocab_size + tokens[starts + j]
+        bound *= vocab_size
+
+    return keys, bound
+
+
+def numpy_count_keys(sentence_ids, keys, key_range, nr_sentences):
+    """ Returns the sorted (sentence, key) combined codes, their counts and the key range.
+        A combined code is sentence * key_range + key, with the keys made dense first
+        if the combined codes could overflow """
+
+    if key_range * nr_sentences >= 2**62:
+        uniques, keys = np.unique(keys, return_inverse=True)
+        key_range = len(uniques)
+
+    key_range = max(key_range, 1)
+    codes, counts = np.unique(sentence_ids.astype(np.int64) * key_range + keys, return_counts=True)
+
+    return codes, counts, key_range
+
+
+def numpy_n_gram_counts(tokens, offsets, n_grams, vocab_size):
+    """ Returns the counts of the n-grams of each sentence (see numpy_count_keys) """
+
+    sentence_ids = np.repeat(np.arange(len(offsets)-1), np.diff(offsets))
+    positions = np.arange(len(tokens))
+
+    # An n-gram starts at every position that has n-1 more words in the same sentence
+    starts = positions[positions + n_grams <= offsets[1:][sentence_ids]]
+    keys, key_range = numpy_n_gram_keys(tokens, starts, n_grams, vocab_size)
+
+    return numpy_count_keys(sentence_ids[starts], keys, key_range, len(offsets)-1)
+
+
+def numpy_consecutive_counts(tokens, offsets, vocab_size):
+    """ Returns the counts of the bi-grams made of a repeated word in each sentence,
+        keyed by the repeated word (see numpy_count_keys) """
+
+    sentence_ids = np.repeat(np.arange(len(offsets)-1), np.diff(offsets))
+    positions = np.arange(len(tokens)-1)
+
+    starts = positions[(positions + 2 <= offsets[1:][sentence_ids[:-1]]) & (tokens[:-1] == tokens[1:])]
+
+    return numpy_count_keys(sentence_ids[starts], tokens[starts].astype(np.int64), vocab_size, len(offsets)-1)
+
+
+def numpy_min_reference_score(codes, counts, key_range, nr_sentences, nr_references, min_count):
+    """ Returns the per-sentence score of the candidate (the first nr_sentences sentences)
+        against each reference (the following blocks of nr_sentences sentences), keeping
+        the minimum over the references. Only candidate counts >= min_count are scored """
+
+    block = nr_sentences * key_range
+    bounds = np.searchsorted(codes, np.arange(nr_references+2) * block)
+
+    cand_codes = codes[bounds[0]:bounds[1]]
+    cand_counts = counts[bounds[0]:bounds[1]]
+
+    keep = cand_counts >= min_count
+    cand_codes = cand_codes[keep]
+    cand_counts = cand_counts[keep]
+    cand_sentences = cand_codes // key_range
+
+    scores = None
+
+    for r in range(1, nr_references+1):
+        ref_codes = codes[bounds[r]:bounds[r+1]] - r * block
+        ref_counts = counts[bounds[r]:bounds[r+1]]
+
+        # Look up every candidate n-gram in the reference (count 0 if absent)
+        ref_match = np.zeros(len(cand_codes), dtype=np.int64)
+        if len(ref_codes):
+            ix = np.minimum(np.searchsorted(ref_codes, cand_codes), len(ref_codes)-1)
+            found = ref_codes[ix] == cand_codes
+            ref_match[found] = ref_counts[ix[found]]
+
+        excess = np.maximum(cand_counts - ref_match, 0)
+        ref_scores = np.bincount(cand_sentences, weights=excess, minlength=nr_sentences).astype(np.int64)
+
+        scores = ref_scores if scores is None else np.minimum(scores, ref_scores)
+
+    return scores.tolist()
+
+
+def numpy_multi_rep_scores(ref_sentence_list, pred_sentence_list, n_grams_list):
+    """ Returns a dictionary with the per-sentence n-gram scores for each value of n and the
+        per-sentence consecutive words scores, encoding the corpus only once """
+
+    nr_sentences = len(pred_sentence_list)
+
+    assert all(len(ref) == nr_sentences for ref in ref_sentence_list), \
+                "Reference and predicted text files should have the same length"
+
+    # Encode the candidate followed by every reference as a single flat array
+    vocab = dict()
+    tokens, offsets = encode_corpus(chain(pred_sentence_list, *ref_sentence_list), vocab)
+
+    return numpy_encoded_rep_scores(tokens, offsets, len(vocab), nr_sentences, len(ref_sentence_list), n_grams_list)
+
+
+def numpy_encoded_rep_scores(tokens, offsets, vocab_size, nr_sentences, nr_references, n_grams_list):
+    """ Returns the output of numpy_multi_rep_scores given the encoded sentences of the
+        candidate followed by the encoded sentences of every reference """
+
+    n_gram_scores = dict()
+    for n_grams in n_grams_list:
+        n_gram_scores[n_grams] = numpy_min_reference_score(*numpy_n_gram_counts(tokens, offsets, n_grams, vocab_size),
+                                                           nr_sentences, nr_references, 2)
+
+    consec_scores = numpy_min_reference_score(*numpy_consecutive_counts(tokens, offsets, vocab_size),
+                                              nr_sentences, nr_references, 1)
+
+    return n_gram_scores, consec_scores
+
+
+def corpus_rep_scores(ref_corpora, pred_corpus, n_grams_list, block_size=NUMPY_BLOCK_SIZE):
+    """ Returns the output of numpy_multi_rep_scores given the corpus_store.TokenCorpus of each
+        reference and of the prediction. The sentences are scored in blocks, so that only the
+        arrays of one block are in memory besides the (memory-mapped) token arrays """
+
+    nr_sentences = len(pred_corpus)
+
+    assert all(len(ref) == nr_sentences for ref in ref_corpora), \
+                "Reference and predicted text files should have the same length"
+
+    corpora = [pred_corpus] + list(ref_corpora)
+    vocab_size, mappings = corpus_store.shared_vocabulary(corpora)
+
+    n_gram_scores = dict((n_grams, list()) for n_grams in n_grams_list)
+    consec_scores = list()
+
+    for first in range(0, nr_sentences, block_size):
+        last = min(first + block_size, nr_sentences)
+
+        # The candidate followed by every reference, with the indexes of the shared vocabulary
+        tokens = [mapping[corpus.tokens[corpus.offsets[first]:corpus.offsets[last]]]
+                  for corpus, mapping in zip(corpora, mappings)]
+        offsets = [np.zeros(1, dtype=np.int64)]
+        for corpus in corpora:
+            offsets.append(corpus.offsets[first+1:last+1] - corpus.offsets[first] + offsets[-1][-1])
+
+        block_n_gram_scores, block_consec_scores = numpy_encoded_rep_scores(
+            np.concatenate(tokens), np.concatenate(offsets), vocab_size, last-first, len(ref_corpora), n_grams_list)
+
+        for n_grams in n_grams_list:
+            n_gram_scores[n_grams].extend(block_n_gram_scores[n_grams])
+        consec_scores.extend(block_consec_scores)
+
+    return n_gram_scores, consec_scores
+
+################################################################################################
+###                                     PARALLEL MODE                                        ###
+################################################################################################
+
+def rep_scores_chunk(task):
+    """ Returns the output of sentence_list_rep_scores for a chunk of lines. Each worker reads
+        its own byte ranges, so the text of the corpus is never pickled """
+
+    references, candidate, ranges, n_grams_list, engine, tandem = task
+
+    pred_sentence_list = [line.split() for line in sharding.read_lines(candidate, *ranges[0])]
+    ref_sentence_list = [ [line.split() for line in sharding.read_lines(path, *byte_range)]
+                          for path, byte_range in zip(references, ranges[1:])]
+
+    return sentence_list_rep_scores(ref_sentence_list, pred_sentence_list, n_grams_list, engine, tandem)
+
+
+def sentence_list_rep_scores(ref_sentence_list, pred_sentence_list, n_grams_list, engine, tandem=False):
+    """ Returns the per-sentence scores of each value of n, the per-sentence consecutive words
+        scores, the number of words of each reference and of the candidate, and the per-sentence
+        tandem repeats scores (None unless tandem is set) """
+
+    if engine == "numpy":
+        n_gram_scores, consec_scores = numpy_multi_rep_scores(ref_sentence_list, pred_sentence_list, n_grams_list)
+    else:
+        ref_profiles = build_reference_profile_lists(ref_sentence_list, n_grams_list)
+        n_gram_scores, consec_scores = profile_multi_rep_scores(ref_profiles, pred_sentence_list, n_grams_list)
+
+    nw_ref = [sum([len(x) for x in ref]) for ref in ref_sentence_list]
+    nw_can = sum([len(x) for x in pred_sentence_list])
+
+    tandem_scores = None
+    if tandem:
+        tandem_scores = sentence_list_tandem_scores(ref_sentence_list, pred_sentence_list)
+
+    return n_gram_scores, consec_scores, nw_ref, nw_can, tandem_scores
+
+
+def parallel_rep_scores(references, candidate, n_grams_list, engine, workers, tandem=False):
+    """ Returns the per-sentence n-gram scores for each value of n, the per-sentence consecutive
+        words scores, the number of words of each reference and of the candidate, and the
+        per-sentence tandem repeats scores (None unless tandem is set), scoring chunks of lines
+        in a pool of worker processes """
+
+    # Use a few chunks per worker to balance the load
+    tasks = [(references, candidate, ranges, n_grams_list, engine, tandem)
+             for ranges in sharding.byte_ranges([candidate] + list(references), 4*workers)]
+
+    n_gram_scores = dict((n_grams, list()) for n_grams in n_grams_list)
+    consec_scores = list()
+    nw_ref = [0 for _ in references]
+    nw_can = 0
+    tandem_scores = list() if tandem else None
+
+    # The chunks are merged in order, so the result is the same as the serial one
+    for chunk_n_gram_scores, chunk_consec_scores, chunk_nw_ref, chunk_nw_can, chunk_tandem_scores in \
+            sharding.run_chunks(rep_scores_chunk, tasks, workers):
+        for n_grams in n_grams_list:
+            n_gram_scores[n_grams].extend(chunk_n_gram_scores[n_grams])
+        consec_scores.extend(chunk_consec_scores)
+        nw_ref = [x+y for x, y in zip(nw_ref, chunk_nw_ref)]
+        nw_can += chunk_nw_can
+        if tandem:
+            tandem_scores.extend(chunk_tandem_scores)
+
+    return n_gram_scores, consec_scores, nw_ref, nw_can, tandem_scores
+
+################################################################################################
+###                                    MAP-REDUCE MODE                                       ###
+################################################################################################
+
+def map_statistics(references, candidate, n_grams_list, engine, lines=None, tandem=False):
+    """ Returns the partial statistics of a shard (the whole files, or the lines [first, last)
+        if lines is given). The scores are kept as integer totals without weights, so that the
+        shards can be merged in any order and reduced with any weights. The total of the tandem
+        repeats scores is only computed if tandem is set """
+
+    pred_sentence_list = [line.split() for line in sharding.read_shard_lines(candidate, lines)]
+    ref_sentence_list = [ [line.split() for line in sharding.read_shard_lines(path, lines)] for path in references]
+
+    assert all(len(ref) == len(pred_sentence_list) for ref in ref_sentence_list), \
+                "Reference and predicted text files should have the same length"
+
+    n_gram_scores, consec_scores, nw_ref, nw_can, tandem_scores = sentence_list_rep_scores(
+        ref_sentence_list, pred_sentence_list, n_grams_list, engine, tandem)
+
+    tandem_total = None if tandem_scores is None else sum(tandem_scores)
+
+    return {"inputs": list(references) + [candidate], "lines": lines, "nr_sentences": len(pred_sentence_list),
+            "n": n_grams_list, "nr_references": len(references),
+            "n_gram_totals": dict((str(n_grams), int(sum(n_gram_scores[n_grams]))) for n_grams in n_grams_list),
+            "consecutive_total": int(sum(consec_scores)), "tandem_total": tandem_total,
+            "nw_ref": nw_ref, "nw_can": nw_can}
+
+
+def reduce_statistics(partials, w1, w2, w3):
+    """ Returns a dictionary with the total repetition score for each value of n, the number of
+        words of each reference and the number of words of the candidate of several shards """
+
+    n_gram_totals = dict((n_grams, sum([partial["n_gram_totals"][str(n_grams)] for partial in partials]))
+                         for n_grams in partials[0]["n"])
+    consec_total = sum([partial["consecutive_total"] for partial in partials])
+
+    total_values = dict((n_grams, w1*n_gram_total + w2*consec_total) for n_grams, n_gram_total in n_gram_totals.items())
+
+    # Add the tandem repeats score, which is only computed if it has a weight
+    if w3:
+        assert all(partial["tandem_total"] is not None for partial in partials), \
+                    "-w3 requires the shards to be mapped with --tandem"
+        tandem_total = sum([partial["tandem_total"] for partial in partials])
+        total_values = dict((n_grams, total_value + w3*tandem_total) for n_grams, total_value in total_values.items())
+    nw_ref = [sum(x) for x in zip(*[partial["nw_ref"] for partial in partials])]
+    nw_can = sum([partial["nw_can"] for partial in partials])
+
+    return total_values, nw_ref, nw_can
+
+
+def map_main(argv):
+
+    parser = argparse.ArgumentParser(prog="rep_score.py map",
+                                     description="Write the partial statistics of the REP-score of a shard")
 
     # Optional arguments
-    parser.add_argument("-n", type=int, default=2,
-                        help="Provide the value of n-grams to be used")
+    add_n_grams_argument(parser)
+    parser.add_argument("--engine", choices=["python", "numpy"], default="python",
+                        help="Provide the engine used to compute the scores")
+    parser.add_argument("--tandem", action='store_true',
+                        help="Also store the total of the tandem repeats scores (needed to reduce with -w3)")
+
+    # Required arguments
+    required = sharding.add_map_arguments(parser)
+    add_input_arguments(required)
+
+    args = parser.parse_args(argv)
+    n_grams_list = n_grams_from_arguments(args)
+
+    sharding.write_partial(args.output, "rep", map_statistics(args.reference, args.predicted, n_grams_list,
+                                                              args.engine, args.lines, args.tandem))
+
+
+def reduce_main(argv):
+
+    parser = argparse.ArgumentParser(prog="rep_score.py reduce",
+                                     description="Print the REP-score of the corpus from the partial statistics "
+                                                 "of its shards")
+
+    add_weight_arguments(parser)
+    sharding.add_reduce_arguments(parser)
+
+    args = parser.parse_args(argv)
+
+    partials = sharding.read_partials(args.partials, "rep", ["n", "nr_references"])
+    total_values, nw_ref, pred_length = reduce_statistics(partials, args.w1, args.w2, args.w3)
+
+    print(format_rep_scores(total_values, partials[0]["n"], nw_ref, pred_length))
+
+################################################################################################
+###                                     MAIN FUNCTION                                        ###
+################################################################################################
+
+def add_n_grams_argument(parser):
+    """ Adds the -n option to an argument parser """
+
+    parser.add_argument("-n", type=int, nargs='+', default=[2],
+                        help="Provide the values of n-grams to be used (several values are scored in one pass)")
+
+
+def n_grams_from_arguments(args):
+    """ Returns the list of values of n, without repeated values and in the order they were given """
+
+    assert all(n_grams >= 1 for n_grams in args.n), "n must be strictly positive"
+
+    return list(dict.fromkeys(args.n))
+
+
+def add_weight_arguments(parser, tandem=True):
+    """ Adds the -w1, -w2 and (if tandem) -w3 options to an argument parser """
+
     parser.add_argument("-w1", type=float, default=1.0,
                         help="Provide the value of lambda 1")
     parser.add_argument("-w2", type=float, default=2.0,
                         help="Provide the value of lambda 2")
-    parser.add_argument("--debug", action='store_true',
-                        help="After running the script creates a pdb.set_trace()")
+    if tandem:
+        parser.add_argument("-w3", type=float, default=0.0,
+                            help="Provide the value of lambda 3, the multiplier of the tandem repeats score")
 
-    # Required arguments
-    required = parser.add_argument_group("required arguments")
-    required.add_argument("-r", "--reference", nargs='+', required=True,
-                          help="Provide a list with the paths to the tokenized reference files")
-    required.add_argument("-p", "--predicted", type=str, required=True,
-                          help="Provide the path to the tokenized obtained translation")
 
-    args = parser.parse_args()
+def add_input_arguments(parser):
+    """ Adds the paths to the references and to the prediction to an argument parser """
 
-    assert args.n >= 1, "n must be strictly positive"
+    parser.add_argument("-r", "--reference", nargs='+', required=True,
+                        help="Provide a list with the paths to the tokenized reference files")
+    parser.add_argument("-p", "--predicted", type=str, required=True,
+                        help="Provide the path to the tokenized obtained translation")
 
-    # Create a list with all sentences for reference and prediction
-    ref_sentence_list = [ [line.split() for line in open(path, 'r')] for path in args.reference]
-    pred_sentence_list = [line.split() for line in open(args.predicted, 'r')]
 
-    assert len(ref_sentence_list[0]) == len(pred_sentence_list), \
-                "Reference and predicted text files should have the same length"
+def score_files(args, n_grams_list, profiler):
+    """ Returns the total repetition score for each value of n, the number of words of each
+        reference and of the prediction, and a dictionary with the per-sentence scores of the
+        files given in the parsed arguments """
 
-    # Create list of n-grams
-    n_gram_ref_sentence_list = [create_ngram_sentence_list(ref, args.n) for ref in ref_sentence_list]
-    n_gram_pred_sentence_list = create_ngram_sentence_list(pred_sentence_list, args.n)
+    if args.stream:
+        # Keep only the running totals while reading the files line by line
+        with profiler.stage("stream_scores"):
+            total_values, nw_ref, pred_length = stream_rep_score(args.reference, args.predicted,
+                                                                 n_grams_list, args.w1, args.w2, args.w3)
 
-    # Create lists with the counts of repetitions of the n-grams
-    n_gram_count_ref_sentence_list = [count_repetitions(ref, 0) for ref in n_gram_ref_sentence_list]
-    n_gram_count_pred_sentence_list = count_repetitions(n_gram_pred_sentence_list, 0)
+    elif args.workers > 1 and all(input_files.is_plain(path) for path in args.reference + [args.predicted]):
+        # Score chunks of lines in parallel, each worker reading its own part of the files
+        # (compressed files and the standard input are read by a single process)
+        with profiler.stage("parallel_scores"):
+            all_n_gram_scores, consec_scores, nw_ref, pred_length, tandem_scores = parallel_rep_scores(
+                args.reference, args.predicted, n_grams_list, args.engine, args.workers, bool(args.w3))
 
-    # Obtain the score for n-gram counts
-    all_n_gram_scores = [n_gram_score(r, n_gram_count_pred_sentence_list) for r in n_gram_count_ref_sentence_list]    
-    n_gram_scores = [min(x) for x in zip(*all_n_gram_scores)]
+        with profiler.stage("total_values"):
+            total_values = calculate_total_values(all_n_gram_scores, consec_scores, args.w1, args.w2)
 
-    # Obtain repetition score for consecutive words
-    if args.n == 2:
-        all_consec_scores = [consecutive_words_score(r, n_gram_count_pred_sentence_list) for r in n_gram_count_ref_sentence_list]
-        consec_scores = [min(x) for x in zip(*all_consec_scores)]
-    # If n is not the default, then it is necessary to repeat the previous steps with n=2
-    else:
-        aux_n_gram_ref_sentence_list = [create_ngram_sentence_list(ref, 2) for ref in ref_sentence_list]
-        aux_n_gram_pred_sentence_list = create_ngram_sentence_list(pred_sentence_list, 2)
-        aux_n_gram_count_ref_sentence_list = [count_repetitions(ref, 0) for ref in aux_n_gram_ref_sentence_list]
-        aux_n_gram_count_pred_sentence_list = count_repetitions(aux_n_gram_pred_sentence_list, 0)
-        consec_scores = consecutive_words_score(aux_n_gram_count_ref_sentence_list, aux_n_gram_count_pred_sentence_list)
+    elif args.engine == "python":
+        # Build (or load from the cache) the reference profiles of every value of n
+        ref_profiles, nw_ref = load_reference_profiles(args.reference, n_grams_list,
+                                                       reference_cache.cache_from_arguments(args), profiler,
+                                                       bool(args.w3))
 
-    # Calculate list with the final scores
-    repetition_scores = calculate_final_scores(n_gram_scores, consec_scores, args.w1, args.w2)
+        with profiler.stage("read_prediction"):
+            pred_sentence_list = [line.split() for line in input_files.open_input(args.predicted)]
 
-    # Print the value according to the flags provided
-    total_value = sum(repetition_scores)
+        assert len(ref_profiles[2]) == len(pred_sentence_list), \
+                    "Reference and predicted text files should have the same length"
+
+        with profiler.stage("prediction_scores"):
+            all_n_gram_scores, consec_scores = profile_multi_rep_scores(ref_profiles, pred_sentence_list,
+                                                                        n_grams_list)
+
+        # Calculate the total of the final scores for each value of n
+        with profiler.stage("total_values"):
+            total_values = calculate_total_values(all_n_gram_scores, consec_scores, args.w1, args.w2)
+
+        if args.w3:
+            with profiler.stage("tandem_scores"):
+                tandem_scores = profile_tandem_scores(ref_profiles["tandem"], pred_sentence_list)
+
+        # Calculate the number of words used by the brevity penalty
+        pred_length = sum([len(x) for x in pred_sentence_list])
+
+        # Only computed when profiling, in its own stage
+        if profiler.enabled:
+            with profiler.stage("counters"):
+                count_rep_events(profiler, ref_profiles, pred_sentence_list, n_grams_list)
 
-    # Calculate the brevity penalty
-    ref_length, pred_length = calculate_number_words(args.reference, args.predicted)
-    pred_length_2 = sum([len(x) for x in pred_sentence_list])
-    
-    if pred_length < ref_length:
-        bp = 1/(math.exp(1-(ref_length/pred_length)))
     else:
-        bp = 1
+        # Read the token arrays of the references and of the prediction (memory-mapped from the corpus
+        # store when the cache is enabled) instead of lists of words. Each prediction is usually
+        # scored once, so it is only kept in the store with --cache-prediction
+        with profiler.stage("read"):
+            cache = reference_cache.cache_from_arguments(args)
+            ref_corpora = [corpus_store.load_corpus(path, cache) for path in args.reference]
+            pred_corpus = corpus_store.load_corpus(args.predicted, cache if args.cache_prediction else None)
 
-    # Get the final score
-    normalize_constant = ref_length
-    if normalize_constant != 0:
-        normalized_value = bp*100*float(total_value)/normalize_constant
-        print("REP_SCORE: {}, BP: {:.2f}, NORMALIZED_REP_SCORE: {:.2f}".format(total_value, bp, normalized_value))
+        assert len(ref_corpora[0]) == len(pred_corpus), \
+                    "Reference and predicted text files should have the same length"
+
+        # Obtain the n-gram and consecutive words scores with the numpy engine
+        with profiler.stage("numpy_scores"):
+            all_n_gram_scores, consec_scores = corpus_rep_scores(ref_corpora, pred_corpus, n_grams_list)
+
+        # Calculate the total of the final scores for each value of n
+        with profiler.stage("total_values"):
+            total_values = calculate_total_values(all_n_gram_scores, consec_scores, args.w1, args.w2)
+
+        # The tandem repeats are found on the sentences of the corpora already read
+        if args.w3:
+            with profiler.stage("tandem_scores"):
+                tandem_scores = sentence_list_tandem_scores(
+                    [ [corpus.sentence(ix) for ix in range(len(corpus))] for corpus in ref_corpora],
+                    [pred_corpus.sentence(ix) for ix in range(len(pred_corpus))])
+
+        # Calculate the number of words used by the brevity penalty
+        nw_ref = [len(corpus.tokens) for corpus in ref_corpora]
+        pred_length = len(pred_corpus.tokens)
+
+        if profiler.enabled:
+            with profiler.stage("counters"):
+                ref_sentence_list = [ [corpus.sentence(ix) for ix in range(len(corpus))] for corpus in ref_corpora]
+                pred_sentence_list = [pred_corpus.sentence(ix) for ix in range(len(pred_corpus))]
+                count_rep_events(profiler, build_reference_profile_lists(ref_sentence_list, n_grams_list),
+                                 pred_sentence_list, n_grams_list)
+
+    # The per-sentence scores are not kept in streaming mode
+    sentence_scores = dict()
+    if not args.stream:
+        sentence_scores["consecutive_scores"] = consec_scores
+        for n_grams in n_grams_list:
+            sentence_scores["n_gram_scores_{}".format(n_grams)] = all_n_gram_scores[n_grams]
+
+    # Add the tandem repeats score, which is only computed if it has a weight
+    # (the streaming mode already adds it to its running totals)
+    if args.w3 and not args.stream:
+        sentence_scores["tandem_scores"] = tandem_scores
+        tandem_total = sum(tandem_scores)
+        total_values = dict((n_grams, total_value + args.w3*tandem_total)
+                            for n_grams, total_value in total_values.items())
+
+    return total_values, nw_ref, pred_length, sentence_scores
+
+
+def main():
+
+    # The map and reduce subcommands score the corpus in shards
+    if sys.argv[1:2] == ["map"]:
+        return map_main(sys.argv[2:])
+    if sys.argv[1:2] == ["reduce"]:
+        return reduce_main(sys.argv[2:])
+
+    parser = argparse.ArgumentParser(epilog="Subcommands: map (partial statistics of a shard), reduce (score of "
+                                            "the corpus from the partial statistics). See rep_score.py map -h")
+
+    # Optional arguments
+    add_n_grams_argument(parser)
+    add_weight_arguments(parser)
+    parser.add_argument("--engine", choices=["python", "numpy"], default="python",
+                        help="Provide the engine used to compute the scores")
+    parser.add_argument("--cache-prediction", dest="cache_prediction", action='store_true',
+                        help="Also keep the token arrays of the prediction in the corpus store (--engine numpy)")
+    parser.add_argument("--stream", action='store_true',
+                        help="Read the files line by line, keeping only running totals in memory")
+    parser.add_argument("--debug", action='store_true',
+                        help="After running the script creates a pdb.set_trace()")
+    reference_cache.add_cache_arguments(parser)
+    result_store.add_result_arguments(parser)
+    sharding.add_workers_argument(parser)
+    profiling.add_profile_arguments(parser)
+
+    # Required arguments
+    add_input_arguments(parser.add_argument_group("required arguments"))
+
+    args = parser.parse_args()
+
+    # Remove repeated values of n, keeping the order in which they were given
+    n_grams_list = n_grams_from_arguments(args)
+
+    profiler = profiling.profiler_from_arguments(args)
+
+    def build():
+        total_values, nw_ref, pred_length, sentence_scores = score_files(args, n_grams_list, profiler)
+        output = format_rep_scores(total_values, n_grams_list, nw_ref, pred_length)
+        return dict(sentence_scores, output=result_store.encode_output(output))
+
+    # Print the stored result if none of the files changed since it was scored
+    results = result_store.store_from_arguments(args)
+    if results is None:
+        arrays = build()
     else:
-        print("No valid reference file.")
-        exit(0)
+        arrays = results.get("rep_score", args.reference + [args.predicted],
+                             {"n": n_grams_list, "w1": args.w1, "w2": args.w2, "w3": args.w3}, build)
+
+    print(result_store.decode_output(arrays))
+
+    if args.profile:
+        profiler.write(args.profile, script="rep_score", engine=args.engine, n=n_grams_list)
 
     if args.debug:
         import pdb; pdb.set_trace()
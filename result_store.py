@@ -0,0 +1,198 @@
+import os
+import argparse
+import tempfile
+
+import input_files
+import reference_cache
+
+################################################################################################
+###                                 AUXILIARY FUNCTIONS                                      ###
+################################################################################################
+
+DEFAULT_RESULTS_DIR = os.path.join(os.path.expanduser("~"), ".cache", "mt_adequacy_results")
+DEFAULT_RESULTS_SIZE = 256
+
+# Bumped whenever the scores or the stored arrays change, so old results are not reused
+RESULTS_VERSION = 1
+
+# File of the results directory with one "kind<TAB>hit|miss" line for each lookup, or with
+# "kind<TAB>hit|miss<TAB>count" lines once it is compacted
+LOG_NAME = "lookups.log"
+
+# The log is compacted into one line for each kind and outcome when it grows past this size (in bytes)
+MAX_LOG_SIZE = 1024 * 1024
+
+
+class ResultStore(reference_cache.ReferenceCache):
+    """
+    On-disk store of the results of the metrics (the printed scores and the
+    per-sentence vectors), keyed by the content hash of every input file and
+    by the parameters of the score, so that a system whose files did not
+    change is not scored again.
+
+    Entries are stored, evicted and read concurrently as in ReferenceCache.
+    Every lookup is appended to a log with a single write, which is atomic
+    for parallel jobs, so that the hits and misses can be reported. The log
+    is compacted when it grows past MAX_LOG_SIZE, and its size counts
+    against max_size.
+    """
+
+    def __init__(self, results_dir=DEFAULT_RESULTS_DIR, max_size=DEFAULT_RESULTS_SIZE):
+
+        super(ResultStore, self).__init__(results_dir, max_size)
+
+        self.log_path = os.path.join(results_dir, LOG_NAME)
+
+    def key(self, kind, paths, params):
+        """ Returns the key of the result for the given files and parameters """
+
+        return super(ResultStore, self).key(kind, paths, dict(params, results_version=RESULTS_VERSION))
+
+    def lookup(self, kind, key):
+        """ Returns the arrays of a result (None if missing), recording the hit or the miss """
+
+        arrays = self.load(key)
+
+        with open(self.log_path, 'a') as f:
+            f.write("{}\t{}\n".format(kind, "miss" if arrays is None else "hit"))
+            log_size = f.tell()
+
+        if log_size > MAX_LOG_SIZE:
+            self.compact_log()
+
+        return arrays
+
+    def read_log(self):
+        """ Returns a dictionary with the (hits, misses) of each kind of result in the log """
+
+        lookups = dict()
+        try:
+            with open(self.log_path, 'r') as f:
+                for line in f:
+                    fields = line.rstrip("\n").split("\t")
+                    kind, outcome = fields[:2]
+                    count = int(fields[2]) if len(fields) > 2 else 1
+                    hits, misses = lookups.get(kind, (0, 0))
+                    lookups[kind] = (hits + count*(outcome == "hit"), misses + count*(outcome == "miss"))
+        except FileNotFoundError:
+            pass
+
+        return lookups
+
+    def compact_log(self):
+        """ Replaces the log with one line for the total of each kind and outcome. The new log
+            is renamed over the old one at once, so the lookups that other runs append while
+            it is written are lost, but the log is never seen half written """
+
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=self.cache_dir)
+
+        with os.fdopen(fd, 'w') as f:
+            for kind, (hits, misses) in sorted(self.read_log().items()):
+                f.write("{0}\thit\t{1}\n{0}\tmiss\t{2}\n".format(kind, hits, misses))
+
+        os.replace(tmp_path, self.log_path)
+
+    def evict(self):
+        """ Removes the least recently used results until they fit in max_size together
+            with the log of lookups """
+
+        try:
+            log_size = os.path.getsize(self.log_path)
+        except FileNotFoundError:
+            log_size = 0
+
+        super(ResultStore, self).evict(log_size)
+
+    def get(self, kind, paths, params, build):
+        """ Returns the arrays of the result for the given files and parameters,
+            calling build() and storing its output if the result is missing """
+
+        # The standard input can only be read once, so its results are never stored
+        if any(input_files.is_stdin(path) for path in paths):
+            return build()
+
+        key = self.key(kind, paths, params)
+        arrays = self.lookup(kind, key)
+
+        if arrays is None:
+            arrays = build()
+            self.store(key, arrays)
+
+        return arrays
+
+    def report(self):
+        """ Returns a dictionary with the (hits, misses) of each kind of result, the number of
+            results and their size in bytes """
+
+        entries = self.entries()
+
+        return {"lookups": self.read_log(), "entries": len(entries), "size": sum(size for _, size, _ in entries)}
+
+    def reset_report(self):
+        """ Forgets the hits and misses recorded so far """
+
+        if os.path.exists(self.log_path):
+            os.remove(self.log_path)
+
+
+def encode_output(output):
+    """ Returns the printed output of a script as an array that can be stored """
+
+    return reference_cache.encode_strings(output.split("\n"))
+
+
+def decode_output(arrays):
+    """ Returns the printed output stored with encode_output """
+
+    return "\n".join(reference_cache.decode_strings(arrays["output"]))
+
+
+def add_result_arguments(parser):
+    """ Adds the options of the result store to an argument parser """
+
+    parser.add_argument("--results-dir", dest="results_dir", type=str, default=DEFAULT_RESULTS_DIR,
+                        help="Directory where the results of previous runs are stored")
+    parser.add_argument("--results-size", dest="results_size", type=int, default=DEFAULT_RESULTS_SIZE,
+                        help="Maximum size of the stored results in MB")
+    parser.add_argument("--no-results", dest="no_results", action="store_true",
+                        help="Do not read or write the stored results (always score the files)")
+
+
+def store_from_arguments(args):
+    """ Returns the ResultStore described by the parsed arguments (None if disabled) """
+
+    if args.no_results:
+        return None
+
+    return ResultStore(args.results_dir, args.results_size)
+
+################################################################################################
+###                                     MAIN FUNCTION                                        ###
+################################################################################################
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Report the hits and misses of the result store")
+
+    parser.add_argument("--results-dir", dest="results_dir", type=str, default=DEFAULT_RESULTS_DIR,
+                        help="Directory where the results of previous runs are stored")
+    parser.add_argument("--reset", action="store_true",
+                        help="Forget the hits and misses after reporting them")
+
+    args = parser.parse_args()
+
+    store = ResultStore(args.results_dir)
+    report = store.report()
+
+    print("KIND\tHITS\tMISSES\tHIT_RATE")
+    for kind, (hits, misses) in sorted(report["lookups"].items()):
+        print("{}\t{}\t{}\t{:.2f}".format(kind, hits, misses, 100*hits/(hits + misses)))
+
+    print("{} results, {:.2f} MB".format(report["entries"], report["size"] / (1024*1024)))
+
+    if args.reset:
+        store.reset_report()
+
+if __name__ == "__main__":
+
+    main()
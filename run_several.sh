@@ -18,34 +18,11 @@ then
     exit
 fi
 
-for file in ${MT_DATA}/*
-do
-   
-    echo $(basename $file)
-
-    python3 rep_score.py \
-            -r ${TEST_TGT} \
-            -p ${file} 
-
-    paste -d '\t' \
-          ${TEST_SRC} \
-          ${file} \
-          > ${ALIGNER_DATA}/src_mt.${LP}
-
-    sed -i 's/\t/ ||| /g' ${ALIGNER_DATA}/src_mt.${LP}
-
-    python ${ALIGNER}/force_align.py \
-           ${ALIGNER_DATA}/a.s2t.params ${ALIGNER_DATA}/a.s2t.err \
-           ${ALIGNER_DATA}/a.t2s.params ${ALIGNER_DATA}/a.t2s.err \
-           < ${ALIGNER_DATA}/src_mt.${LP} \
-           > ${ALIGNER_DATA}/src_mt.align
-
-    python3 drop_score.py \
-            --src_ref_align ${ALIGNER_DATA}/src_ref.align \
-            --src_mt_align ${ALIGNER_DATA}/src_mt.align \
-            --ref_path ${TEST_TGT} \
-            --cnd_path ${file}
-                       
-    echo
- 
-done
+# Align each system with a pool of persistent aligners, keeping the alignments in memory,
+# and score every system at once, so that the reference statistics are only computed once
+python3 align_pipeline.py \
+        --aligner "python ${ALIGNER}/force_align.py ${ALIGNER_DATA}/a.s2t.params ${ALIGNER_DATA}/a.s2t.err ${ALIGNER_DATA}/a.t2s.params ${ALIGNER_DATA}/a.t2s.err" \
+        --src_path ${TEST_SRC} \
+        -r ${TEST_TGT} \
+        -p ${MT_DATA}/* \
+        --src_ref_align ${ALIGNER_DATA}/src_ref.align
@@ -16,13 +16,9 @@ fi
  
 echo $(basename $PRED)
 
-python3 rep_score.py \
+# Compute both metrics in a single process, reading each file only once
+python3 adequacy_score.py \
         -r ${REF} \
-        -p ${PRED}
-
-python3 drop_score.py \
+        -p ${PRED} \
         --src_ref_align ${SRC_REF_ALIGN} \
-        --src_mt_align ${SRC_MT_ALIGN} \
-        --ref_path ${REF} \
-        --cnd_path ${PRED}
-
+        --src_mt_align ${SRC_MT_ALIGN}
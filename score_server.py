@@ -0,0 +1,373 @@
+import os
+import sys
+import json
+import math
+import time
+import hashlib
+import argparse
+import threading
+import socketserver
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import rep_score
+import drop_score
+import input_files
+import adequacy_score
+
+################################################################################################
+###                                 AUXILIARY FUNCTIONS                                      ###
+################################################################################################
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_PROFILES = 32
+
+# Number of requests read ahead of the replies, per worker
+PENDING_PER_WORKER = 2
+
+
+class ProfileLRU(object):
+    """ In-memory cache of the reference-side structures (reference profiles, number of words,
+        aligned source indeces), evicted in least recently used order """
+
+    def __init__(self, max_entries=DEFAULT_MAX_PROFILES):
+
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build):
+        """ Returns the entry for key, calling build() and storing its output if it is missing """
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+
+        # Built outside the lock, so a slow entry does not block the requests that hit the cache
+        value = build()
+
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+        return value
+
+
+class LatencyStats(object):
+    """ Latencies of the last requests handled by the server """
+
+    def __init__(self, window=100000):
+
+        self.latencies = deque(maxlen=window)
+        self.lock = threading.Lock()
+        self.nr_requests = 0
+        self.nr_errors = 0
+
+    def add(self, seconds, error=False):
+        """ Records the latency of a request """
+
+        with self.lock:
+            self.latencies.append(seconds)
+            self.nr_requests += 1
+            self.nr_errors += int(error)
+
+    def report(self, percentiles=(50, 90, 99)):
+        """ Returns a dictionary with the number of requests and the latency percentiles in ms """
+
+        with self.lock:
+            latencies = sorted(self.latencies)
+            report = {"requests": self.nr_requests, "errors": self.nr_errors}
+
+        for percentile in percentiles:
+            value = None
+            if latencies:
+                # Nearest-rank percentile
+                value = 1000*latencies[max(0, int(math.ceil(percentile/100.0*len(latencies))) - 1)]
+            report["p{}_ms".format(percentile)] = value
+
+        return report
+
+
+def input_key(request, path_field, inline_field):
+    """ Returns a hashable key that identifies the content of an input given either as a path
+        (name, modification time and size) or inline (hash of the lines) """
+
+    if request.get(path_field) is not None:
+        # The standard input can only be read once, so its key never matches a cached entry
+        if input_files.is_stdin(request[path_field]):
+            return ("stdin", object())
+        stat = os.stat(request[path_field])
+        return ("path", os.path.abspath(request[path_field]), stat.st_mtime_ns, stat.st_size)
+
+    lines = request[inline_field]
+    return ("inline", hashlib.sha1(json.dumps(lines).encode("utf-8")).hexdigest())
+
+
+def input_lines(request, path_field, inline_field):
+    """ Returns the lines of an input given either as a path (which may be compressed or "-")
+        or inline """
+
+    if request.get(path_field) is not None:
+        return list(input_files.open_input(request[path_field]))
+
+    return list(request[inline_field])
+
+
+def sub_requests(request, path_field, inline_field):
+    """ Returns a list with one request for each of the inputs of a field that takes a list
+        (e.g. the references), so that each one can be read with input_lines """
+
+    if request.get(path_field) is not None:
+        return [{path_field: path} for path in request[path_field]]
+
+    return [{inline_field: lines} for lines in request[inline_field]]
+
+
+def alignments(lines):
+    """ Returns the aligned source indeces of the lines of a .align file in CSR layout """
+
+    return drop_score.parse_alignments("".join(line if line.endswith("\n") else line + "\n"
+                                               for line in lines).encode("utf-8"), 0)
+
+
+class ScoreServer(object):
+    """
+    Scores the requests of the JSONL protocol, keeping the reference-side
+    structures of the last requests in memory.
+
+    Each request is a json object with the fields:
+    - id                  : returned unchanged in the reply
+    - references          : list with the paths to the reference files, or
+      reference_sentences : list with the lines of each reference
+    - candidate           : path to the prediction, or
+      candidate_sentences : list with the lines of the prediction
+    - metrics             : list with "rep" and/or "drop" (default: both if
+                            the alignments are given, otherwise "rep")
+    - n, w1, w2           : as in rep_score.py (default: [2], 1.0, 2.0)
+    - src_ref_align       : list with the paths to the source/reference
+      src_ref_alignments  : alignments, or list with the lines of each
+    - src_mt_align        : path to the source/prediction alignments, or
+      src_mt_alignments   : list with their lines
+    - src_path / source_sentences and stopwords_path / stopwords : optional,
+                            to filter stopwords in the DROP-score
+    - sentence_scores     : if true, the per-sentence scores are returned
+
+    The request {"command": "stats"} returns the number of requests, the
+    latency percentiles and the hits and misses of the reference cache.
+    """
+
+    def __init__(self, max_profiles=DEFAULT_MAX_PROFILES, workers=DEFAULT_WORKERS):
+
+        self.profiles = ProfileLRU(max_profiles)
+        self.stats = LatencyStats()
+        self.executor = ThreadPoolExecutor(workers)
+        self.max_pending = PENDING_PER_WORKER*workers
+
+    def reference_profiles(self, request, n_grams_list):
+        """ Returns the reference profiles of every value of n and the number of words of each reference """
+
+        references = sub_requests(request, "references", "reference_sentences")
+        n_grams_key = tuple(sorted(set(n_grams_list) | {2}))
+        key = ("rep",) + tuple(input_key(x, "references", "reference_sentences") for x in references) + n_grams_key
+
+        def build():
+            ref_sentence_list = [ [line.split() for line in input_lines(x, "references", "reference_sentences")]
+                                  for x in references]
+            nw_ref = [sum([len(x) for x in ref]) for ref in ref_sentence_list]
+            return rep_score.build_reference_profile_lists(ref_sentence_list, n_grams_key), nw_ref
+
+        return self.profiles.get(key, build)
+
+    def reference_alignments(self, request):
+        """ Returns the union of the aligned source indeces of the references and, if stopwords
+            are filtered, the mask of drop_score.content_masks """
+
+        aligns = sub_requests(request, "src_ref_align", "src_ref_alignments")
+        key = ("drop",) + tuple(input_key(x, "src_ref_align", "src_ref_alignments") for x in aligns)
+
+        filter_stopwords = request.get("stopwords_path") is not None or request.get("stopwords") is not None
+        if filter_stopwords:
+            key += (input_key(request, "src_path", "source_sentences"),
+                    input_key(request, "stopwords_path", "stopwords"))
+
+        def build():
+            src_ref_ixs = drop_score.union_alignments(
+                [alignments(input_lines(x, "src_ref_align", "src_ref_alignments")) for x in aligns])
+
+            src_ref_content = None
+            if filter_stopwords:
+                source_words = drop_score.encode_source(input_lines(request, "src_path", "source_sentences"))
+                stopwords = frozenset(line.strip("\n") for line in input_lines(request, "stopwords_path",
+                                                                               "stopwords"))
+                src_ref_content, = drop_score.content_masks(src_ref_ixs, source_words, [stopwords])
+
+            return src_ref_ixs, src_ref_content
+
+        return self.profiles.get(key, build)
+
+    def score(self, request):
+        """ Returns the reply (without id and latency) to a scoring request """
+
+        n_grams_list = list(dict.fromkeys(request.get("n", [2])))
+        assert all(n_grams >= 1 for n_grams in n_grams_list), "n must be strictly positive"
+        w1 = request.get("w1", 1.0)
+        w2 = request.get("w2", 2.0)
+
+        has_alignments = any(request.get(field) is not None for field in ("src_ref_align", "src_ref_alignments"))
+        metrics = request.get("metrics", ["rep", "drop"] if has_alignments else ["rep"])
+
+        ref_profiles, nw_ref = self.reference_profiles(request, n_grams_list)
+        pred_sentence_list = [line.split() for line in input_lines(request, "candidate", "candidate_sentences")]
+        nw_can = sum([len(x) for x in pred_sentence_list])
+
+        assert len(ref_profiles[2]) == len(pred_sentence_list), \
+                    "Reference and predicted text files should have the same length"
+
+        if "rep" in metrics:
+            all_n_gram_scores, consec_scores = rep_score.profile_multi_rep_scores(ref_profiles, pred_sentence_list,
+                                                                                  n_grams_list)
+            result = adequacy_score.rep_result(all_n_gram_scores, consec_scores, nw_ref, nw_can, n_grams_list,
+                                               w1, w2)
+        else:
+            result = adequacy_score.AdequacyResult(dict(), dict(), None, dict(), nw_ref=nw_ref, nw_can=nw_can)
+
+        if "drop" in metrics:
+            src_ref_ixs, src_ref_content = self.reference_alignments(request)
+            src_mt_ixs = alignments(input_lines(request, "src_mt_align", "src_mt_alignments"))
+            adequacy_score.add_drop_score(result, src_ref_ixs, src_mt_ixs, src_ref_content)
+
+        reply = result.as_dict()
+        if not request.get("sentence_scores"):
+            del reply["rep_sentence_scores"]
+            del reply["drop_sentence_scores"]
+        if "rep" not in metrics:
+            for field in ("rep_score", "normalized_rep_score", "bp"):
+                del reply[field]
+        if "drop" not in metrics:
+            for field in ("drop_score", "lp"):
+                del reply[field]
+
+        return reply
+
+    def handle(self, line):
+        """ Returns the json reply to a line of the protocol """
+
+        start = time.perf_counter()
+        request_id = None
+
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+
+            if request.get("command") == "stats":
+                reply = self.stats.report()
+                reply["cache_hits"] = self.profiles.hits
+                reply["cache_misses"] = self.profiles.misses
+                return json.dumps(dict(reply, id=request_id))
+
+            reply = self.score(request)
+            error = False
+
+        except Exception as e:
+            reply = {"error": "{}: {}".format(type(e).__name__, e)}
+            error = True
+
+        latency = time.perf_counter() - start
+        self.stats.add(latency, error)
+
+        reply["id"] = request_id
+        reply["latency_ms"] = 1000*latency
+
+        return json.dumps(reply)
+
+    def serve_lines(self, lines, write):
+        """ Handles the requests of an iterable of lines concurrently, writing each reply with
+            write as soon as it is ready. Replies may be written out of order, so requests
+            should carry an id. At most max_pending requests are read ahead of the replies """
+
+        lock = threading.Lock()
+
+        def reply(line):
+            output = self.handle(line)
+            with lock:
+                write(output + "\n")
+
+        pending = set()
+
+        for line in lines:
+            if not line.strip():
+                continue
+            if len(pending) >= self.max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+            pending.add(self.executor.submit(reply, line))
+
+        for future in pending:
+            future.result()
+
+
+class ScoreRequestHandler(socketserver.StreamRequestHandler):
+    """ Serves the JSONL protocol over a connection to the Unix socket """
+
+    def handle(self):
+
+        def write(output):
+            self.wfile.write(output.encode("utf-8"))
+            self.wfile.flush()
+
+        self.server.score_server.serve_lines((line.decode("utf-8") for line in self.rfile), write)
+
+################################################################################################
+###                                     MAIN FUNCTION                                        ###
+################################################################################################
+
+def main():
+
+    parser = argparse.ArgumentParser()
+
+    # Optional arguments
+    parser.add_argument("--socket", type=str,
+                        help="Path of the Unix socket to listen on (default: read requests from stdin)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="Number of requests handled concurrently")
+    parser.add_argument("--max-profiles", dest="max_profiles", type=int, default=DEFAULT_MAX_PROFILES,
+                        help="Number of reference-side structures kept in memory")
+
+    args = parser.parse_args()
+
+    score_server = ScoreServer(args.max_profiles, args.workers)
+
+    def write(output):
+        sys.stdout.write(output)
+        sys.stdout.flush()
+
+    try:
+        if args.socket:
+            if os.path.exists(args.socket):
+                os.remove(args.socket)
+
+            with socketserver.ThreadingUnixStreamServer(args.socket, ScoreRequestHandler) as server:
+                server.daemon_threads = True
+                server.score_server = score_server
+                server.serve_forever()
+        else:
+            score_server.serve_lines(sys.stdin, write)
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        # Report the latency percentiles when the server stops
+        sys.stderr.write(json.dumps(score_server.stats.report()) + "\n")
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,194 @@
+import io
+import json
+import multiprocessing
+import numpy as np
+
+import input_files
+
+################################################################################################
+###                                 AUXILIARY FUNCTIONS                                      ###
+################################################################################################
+
+def line_offsets(path, skip_headers=False, block_size=1 << 26):
+    """ Returns an int64 array with the byte offset where each line of a file starts,
+        followed by the size of the file. If skip_headers is set, lines starting with
+        '<' (the headers of the .align files) are not counted as lines """
+
+    starts = [np.zeros(1, dtype=np.int64)]
+    size = 0
+
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord("\n"))
+            starts.append(newlines.astype(np.int64) + size + 1)
+            size += len(block)
+
+    starts = np.concatenate(starts)
+    starts = starts[starts < size]
+
+    if skip_headers and size > 0:
+        first_bytes = np.memmap(path, dtype=np.uint8, mode='r')[starts]
+        starts = starts[first_bytes != ord("<")]
+
+    return np.append(starts, size)
+
+
+def line_ranges(nr_lines, nr_chunks):
+    """ Returns a list with the (first, last) line indexes of each chunk """
+
+    bounds = np.linspace(0, nr_lines, max(1, min(nr_chunks, nr_lines)) + 1).astype(np.int64).tolist()
+
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def byte_ranges(paths, nr_chunks, skip_headers=None):
+    """ Returns, for each chunk of lines, a list with the (start, end) byte range of every file.
+        All the files must have the same number of lines """
+
+    if skip_headers is None:
+        skip_headers = [False for _ in paths]
+
+    offsets = [line_offsets(path, skip) for path, skip in zip(paths, skip_headers)]
+    nr_lines = len(offsets[0]) - 1
+
+    assert all(len(x) - 1 == nr_lines for x in offsets), "All the files should have the same number of lines"
+
+    return [[(int(x[first]), int(x[last])) for x in offsets] for first, last in line_ranges(nr_lines, nr_chunks)]
+
+
+def read_bytes(path, start, end):
+    """ Returns the content of a file between two byte offsets """
+
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start)
+
+
+def read_lines(path, start, end):
+    """ Returns the lines of a file between two byte offsets, decoded as open(path, 'r') would """
+
+    return list(io.TextIOWrapper(io.BytesIO(read_bytes(path, start, end))))
+
+
+def line_range_bytes(path, first, last, skip_headers=False):
+    """ Returns the (start, end) byte range of the lines [first, last) of a file. The .align
+        files (skip_headers) can have less sentences than the text, so their range is clipped """
+
+    offsets = line_offsets(path, skip_headers)
+
+    if skip_headers:
+        first, last = min(first, len(offsets) - 1), min(last, len(offsets) - 1)
+
+    assert 0 <= first <= last < len(offsets), "The line range {}-{} is out of {}".format(first, last, path)
+
+    return int(offsets[first]), int(offsets[last])
+
+
+def read_shard_bytes(path, lines=None, skip_headers=False):
+    """ Returns the content of a file, or only of the lines [first, last) if lines is given """
+
+    if lines is None:
+        return input_files.read_input(path)
+
+    assert input_files.is_plain(path), "Line ranges can only be read from uncompressed files"
+
+    return read_bytes(path, *line_range_bytes(path, lines[0], lines[1], skip_headers))
+
+
+def read_shard_lines(path, lines=None):
+    """ Returns the lines of a file, or only the lines [first, last) if lines is given """
+
+    if lines is None:
+        with input_files.open_input(path) as f:
+            return list(f)
+
+    assert input_files.is_plain(path), "Line ranges can only be read from uncompressed files"
+
+    return read_lines(path, *line_range_bytes(path, lines[0], lines[1]))
+
+
+def run_chunks(function, tasks, workers):
+    """ Returns the output of function for each task, computed by a pool of worker processes.
+        The outputs are returned in the order of the tasks, so merging them is deterministic """
+
+    if workers <= 1:
+        return [function(task) for task in tasks]
+
+    with multiprocessing.Pool(workers) as pool:
+        return pool.map(function, tasks, chunksize=1)
+
+
+def add_workers_argument(parser):
+    """ Adds the --workers option to an argument parser """
+
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes used to score chunks of lines in parallel")
+
+################################################################################################
+###                                    MAP-REDUCE MODE                                       ###
+################################################################################################
+
+def write_partial(path, metric, statistics):
+    """ Writes the partial statistics of a shard as a single line of json """
+
+    with open(path, 'w') as f:
+        json.dump(dict(statistics, metric=metric), f, separators=(",", ":"))
+        f.write("\n")
+
+
+def read_partials(paths, metric, shared_keys):
+    """
+    Returns the list with the partial statistics of several shards (see
+    write_partial), checking that they can be merged.
+
+    Inputs:
+    - paths       : list with the paths to the partial statistics files
+    - metric      : name of the metric that wrote them ("rep" / "drop")
+    - shared_keys : keys whose values must be the same in every shard
+                    (e.g. the values of n or the stopwords files)
+    """
+
+    partials = list()
+    for path in paths:
+        with open(path, 'r') as f:
+            partials.append(json.load(f))
+
+    for path, partial in zip(paths, partials):
+        assert partial["metric"] == metric, \
+                    "{} has the statistics of {}, not {}".format(path, partial["metric"], metric)
+        for key in shared_keys:
+            assert partial[key] == partials[0][key], "{} was mapped with a different {}".format(path, key)
+
+    # The same shard counted twice would silently change the score
+    shards = [(tuple(partial["inputs"]), tuple(partial["lines"] or ())) for partial in partials]
+    assert len(set(shards)) == len(shards), "The same shard is given more than once"
+
+    # If every shard is a line range of the same files, they must cover the lines from 0 without gaps
+    if all(partial["lines"] is not None for partial in partials) and len(set(x[0] for x in shards)) == 1:
+        last = 0
+        for first, end in sorted(partial["lines"] for partial in partials):
+            assert first == last, "The line ranges do not cover the lines {}-{}".format(min(first, last),
+                                                                                       max(first, last))
+            last = end
+
+    return partials
+
+
+def add_map_arguments(parser):
+    """ Adds the options of the map subcommand to an argument parser """
+
+    parser.add_argument("--lines", type=int, nargs=2, metavar=("FIRST", "LAST"),
+                        help="Score only the lines FIRST to LAST-1 of the files (uncompressed files only)")
+
+    required = parser.add_argument_group("required arguments")
+    required.add_argument("-o", "--output", type=str, required=True,
+                          help="Path to the partial statistics file")
+
+    return required
+
+
+def add_reduce_arguments(parser):
+    """ Adds the options of the reduce subcommand to an argument parser """
+
+    parser.add_argument("partials", nargs='+',
+                        help="Paths to the partial statistics files written by the map subcommand")
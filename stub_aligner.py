@@ -0,0 +1,34 @@
+import sys
+
+################################################################################################
+###                                 AUXILIARY FUNCTIONS                                      ###
+################################################################################################
+
+def stub_alignment(line):
+    """ Returns a monotone alignment, in fast_align format, for a "source ||| target" line:
+        each source word is aligned with the target word at the same relative position """
+
+    src, _, tgt = line.rstrip("\n").partition(" ||| ")
+    src_words = src.split()
+    tgt_words = tgt.split()
+
+    if not src_words or not tgt_words:
+        return ""
+
+    return " ".join("{}-{}".format(i, i*len(tgt_words)//len(src_words)) for i in range(len(src_words)))
+
+################################################################################################
+###                                     MAIN FUNCTION                                        ###
+################################################################################################
+
+def main():
+
+    # Reads "source ||| target" lines from stdin and writes one alignment per line, flushing each
+    # one, so it can be used as a persistent aligner by align_pipeline.py
+    for line in sys.stdin:
+        sys.stdout.write(stub_alignment(line) + "\n")
+        sys.stdout.flush()
+
+if __name__ == "__main__":
+
+    main()
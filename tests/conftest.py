@@ -0,0 +1,90 @@
+import os
+import sys
+import random
+import subprocess
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+NR_SENTENCES = 200
+
+WORDS = ["the", "a", "of", "in", "city", "house", "river", "old", "new", "man", "woman", "dog", "cat", "runs",
+         "sees", "big", "small", "red", "blue", "green"]
+STOPWORDS = ["the", "a", "of", "in"]
+
+
+def random_sentence(rng):
+    """ Returns a tokenized sentence with repeated words, repeated n-grams and loops """
+
+    sentence = [rng.choice(WORDS) for _ in range(rng.randint(0, 20))]
+
+    if sentence and rng.random() < 0.3:
+        ix = rng.randrange(len(sentence))
+        sentence[ix:ix] = [sentence[ix]] * rng.randint(1, 3)
+    if rng.random() < 0.3:
+        unit = [rng.choice(WORDS) for _ in range(rng.randint(2, 3))]
+        ix = rng.randint(0, len(sentence))
+        sentence[ix:ix] = unit * rng.randint(2, 4)
+
+    return sentence
+
+
+def random_alignment(rng, src_sentence, tgt_sentence):
+    """ Returns a line of fast_align pairs between two sentences """
+
+    if not src_sentence or not tgt_sentence:
+        return ""
+
+    pairs = set((rng.randrange(len(src_sentence)), rng.randrange(len(tgt_sentence)))
+                for _ in range(rng.randint(0, len(src_sentence))))
+
+    return " ".join("{}-{}".format(i, j) for i, j in sorted(pairs))
+
+
+def write_lines(path, lines):
+    with open(path, 'w') as f:
+        f.write("".join(line + "\n" for line in lines))
+
+
+@pytest.fixture(scope="session")
+def corpus(tmp_path_factory):
+    """ Writes a small corpus with a source, two references, a prediction, their alignments
+        with the source and two stopwords files, and returns the directory """
+
+    rng = random.Random(13)
+    data = tmp_path_factory.mktemp("corpus")
+
+    texts = dict((name, [random_sentence(rng) for _ in range(NR_SENTENCES)]) for name in ["src", "ref0", "ref1", "mt"])
+    for name, sentences in texts.items():
+        write_lines(str(data / name), [" ".join(sentence) for sentence in sentences])
+
+    for name in ["ref0", "ref1", "mt"]:
+        write_lines(str(data / "src_{}.align".format(name)),
+                    [random_alignment(rng, src, tgt) for src, tgt in zip(texts["src"], texts[name])])
+
+    write_lines(str(data / "stop"), STOPWORDS)
+    write_lines(str(data / "stop2"), STOPWORDS[:2])
+
+    return data
+
+
+@pytest.fixture(scope="session")
+def sentences(corpus):
+    """ Returns a dictionary with the tokenized sentences of each text of the corpus """
+
+    return dict((name, [line.split() for line in open(str(corpus / name), 'r')]) for name in ["src", "ref0", "ref1", "mt"])
+
+
+@pytest.fixture(scope="session")
+def run_script(corpus):
+    """ Returns a function that runs one of the scripts in the corpus directory, without the
+        cache and the result store, and returns its output """
+
+    def run(script, args):
+        command = [sys.executable, os.path.join(ROOT, script), "--no-cache", "--no-results"] + args
+        return subprocess.run(command, cwd=str(corpus), check=True, stdout=subprocess.PIPE,
+                              universal_newlines=True).stdout.strip()
+
+    return run
@@ -0,0 +1,85 @@
+import pytest
+
+import profiling
+import drop_score
+import alignment_store
+
+
+def csr_lists(alignments):
+    """ Returns the list with the sorted indeces of each sentence of alignments in CSR layout """
+
+    ixs, offsets = alignments
+    ixs, offsets = ixs.tolist(), offsets.tolist()
+
+    return [ixs[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+@pytest.mark.parametrize("name", ["src_ref0.align", "src_ref1.align", "src_mt.align"])
+@pytest.mark.parametrize("index", [0, 1])
+def test_csr_alignments_match_text(corpus, name, index):
+
+    expected = [sorted(set(int(pair.split("-")[index]) for pair in line.split()))
+                for line in open(str(corpus / name), 'r')]
+
+    assert csr_lists(drop_score.load_alignments(str(corpus / name), index)) == expected
+
+
+def test_union_alignments(corpus):
+
+    all_alignments = [drop_score.load_alignments(str(corpus / name), 0) for name in ["src_ref0.align", "src_ref1.align"]]
+    expected = [sorted(set(x) | set(y)) for x, y in zip(*[csr_lists(alignments) for alignments in all_alignments])]
+
+    assert csr_lists(drop_score.union_alignments(all_alignments)) == expected
+
+
+def test_parse_alignments_skips_headers():
+
+    data = b"<header>\n0-1 2-0 2-3\n\n1-1\n"
+
+    assert csr_lists(drop_score.parse_alignments(data, 0)) == [[0, 2], [], [1]]
+    assert csr_lists(drop_score.parse_alignments(data, 1)) == [[0, 1, 3], [], [1]]
+
+
+def test_parse_alignments_counts_pairs(corpus):
+
+    profiler = profiling.Profiler()
+    names = ["src_ref0.align", "src_ref1.align", "src_mt.align"]
+    for name in names:
+        drop_score.load_alignments(str(corpus / name), 0, profiler)
+
+    expected = sum(len(line.split()) for name in names for line in open(str(corpus / name), 'r'))
+
+    assert profiler.counters["alignment_pairs"] == expected
+
+
+def test_alignment_store_matches_text(corpus, tmp_path):
+
+    paths = [str(corpus / "src_ref0.align"), str(corpus / "src_ref1.align")]
+    store_path = str(tmp_path / "src_ref.alignbin")
+    drop_score.convert_alignments(paths, store_path)
+
+    store = alignment_store.load_alignment_store(store_path)
+    for ix, path in enumerate(paths):
+        for index, side in enumerate(drop_score.ALIGNMENT_SIDES):
+            assert csr_lists(store.csr("{}{}".format(side, ix))) == csr_lists(drop_score.load_alignments(path, index))
+
+    assert csr_lists(drop_score.load_reference_alignments([store_path])) == \
+        csr_lists(drop_score.load_reference_alignments(paths))
+
+    # A store converted from a single file can replace it
+    single_path = str(tmp_path / "src_mt.alignbin")
+    drop_score.convert_alignments([str(corpus / "src_mt.align")], single_path)
+
+    assert csr_lists(drop_score.load_alignments(single_path, 0)) == \
+        csr_lists(drop_score.load_alignments(str(corpus / "src_mt.align"), 0))
+
+
+def test_alignment_store_output_matches_text(corpus, run_script, tmp_path):
+
+    store_path = str(tmp_path / "src_ref.alignbin")
+    drop_score.convert_alignments([str(corpus / "src_ref0.align"), str(corpus / "src_ref1.align")], store_path)
+    args = ["--src_mt_align", "src_mt.align", "--ref_path", "ref0", "ref1", "--cnd_path", "mt",
+            "--filter_stopwords", "--stopwords_path", "stop", "--src_path", "src"]
+
+    assert run_script("drop_score.py", ["--src_ref_align", store_path] + args) == \
+        run_script("drop_score.py", ["--src_ref_align", "src_ref0.align", "src_ref1.align"] + args)
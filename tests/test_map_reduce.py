@@ -0,0 +1,84 @@
+import pytest
+
+import sharding
+import rep_score
+import drop_score
+
+from conftest import NR_SENTENCES
+
+SHARDS = [(0, 37), (37, 38), (38, 120), (120, NR_SENTENCES)]
+
+
+def reduce_partials(tmp_path, metric, shared_keys, statistics):
+    """ Writes the partial statistics of each shard (in reverse order) and reads them back """
+
+    paths = list()
+    for ix, partial in enumerate(reversed(statistics)):
+        path = str(tmp_path / "{}.{}.json".format(metric, ix))
+        sharding.write_partial(path, metric, partial)
+        paths.append(path)
+
+    return sharding.read_partials(paths, metric, shared_keys)
+
+
+@pytest.mark.parametrize("n_grams_list", [[2], [1, 2, 3]])
+@pytest.mark.parametrize("engine", ["python", "numpy"])
+@pytest.mark.parametrize("weights", [(1.0, 2.0, 0.0), (0.5, 3.0, 1.5)])
+def test_rep_reduce_matches_serial(corpus, run_script, tmp_path, n_grams_list, engine, weights):
+
+    w1, w2, w3 = weights
+    references = [str(corpus / "ref0"), str(corpus / "ref1")]
+    candidate = str(corpus / "mt")
+
+    statistics = [rep_score.map_statistics(references, candidate, n_grams_list, engine, lines, bool(w3))
+                  for lines in SHARDS]
+    partials = reduce_partials(tmp_path, "rep", ["n", "nr_references"], statistics)
+    total_values, nw_ref, nw_can = rep_score.reduce_statistics(partials, w1, w2, w3)
+
+    serial = run_script("rep_score.py", ["-n"] + [str(n) for n in n_grams_list] +
+                        ["-w1", str(w1), "-w2", str(w2), "-w3", str(w3), "-r", "ref0", "ref1", "-p", "mt"])
+
+    assert rep_score.format_rep_scores(total_values, n_grams_list, nw_ref, nw_can) == serial
+
+
+@pytest.mark.parametrize("stopwords_paths", [None, ["stop"], ["stop", "stop2"]])
+def test_drop_reduce_matches_serial(corpus, run_script, tmp_path, stopwords_paths):
+
+    src_ref_align = [str(corpus / "src_ref0.align"), str(corpus / "src_ref1.align")]
+    ref_path = [str(corpus / "ref0"), str(corpus / "ref1")]
+    paths = [str(corpus / path) for path in stopwords_paths] if stopwords_paths else None
+
+    statistics = [drop_score.map_statistics(src_ref_align, str(corpus / "src_mt.align"), ref_path,
+                                            str(corpus / "mt"), str(corpus / "src"), paths, lines)
+                  for lines in SHARDS]
+    partials = reduce_partials(tmp_path, "drop", ["stopwords", "nr_references"], statistics)
+    counts, nw_ref, nw_can = drop_score.reduce_statistics(partials)
+
+    args = ["--src_ref_align", "src_ref0.align", "src_ref1.align", "--src_mt_align", "src_mt.align",
+            "--ref_path", "ref0", "ref1", "--cnd_path", "mt"]
+    if stopwords_paths:
+        args += ["--filter_stopwords", "--stopwords_path"] + paths + ["--src_path", "src"]
+    serial = run_script("drop_score.py", args)
+
+    assert drop_score.format_drop_scores(counts, nw_ref, nw_can, paths) == serial
+
+
+def test_reduce_rejects_missing_shard(corpus, tmp_path):
+
+    references = [str(corpus / "ref0")]
+    statistics = [rep_score.map_statistics(references, str(corpus / "mt"), [2], "python", lines)
+                  for lines in [SHARDS[0], SHARDS[2]]]
+
+    with pytest.raises(AssertionError):
+        reduce_partials(tmp_path, "rep", ["n", "nr_references"], statistics)
+
+
+def test_reduce_w3_requires_tandem(corpus, tmp_path):
+
+    references = [str(corpus / "ref0")]
+    statistics = [rep_score.map_statistics(references, str(corpus / "mt"), [2], "python", lines)
+                  for lines in SHARDS]
+    partials = reduce_partials(tmp_path, "rep", ["n", "nr_references"], statistics)
+
+    with pytest.raises(AssertionError):
+        rep_score.reduce_statistics(partials, 1.0, 2.0, 1.0)
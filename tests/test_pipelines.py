@@ -0,0 +1,54 @@
+import os
+import sys
+
+import pytest
+
+import stub_aligner
+import align_pipeline
+
+from conftest import ROOT, write_lines
+
+SYSTEMS = ["mt", "ref1"]
+
+
+@pytest.fixture(scope="module")
+def stub_alignments(corpus):
+    """ Writes the alignments of the source with each system given by stub_aligner.py, as
+        align_pipeline.py and orchestrate.py compute them, and returns their names """
+
+    src_lines = list(open(str(corpus / "src"), 'r'))
+    names = list()
+
+    for system in SYSTEMS:
+        pairs = align_pipeline.aligner_input(src_lines, list(open(str(corpus / system), 'r')))
+        write_lines(str(corpus / "src_{}.stub.align".format(system)), [stub_aligner.stub_alignment(pair) for pair in pairs])
+        names.append("src_{}.stub.align".format(system))
+
+    return names
+
+
+def pipeline_args(extra):
+
+    aligner = "{} {}".format(sys.executable, os.path.join(ROOT, "stub_aligner.py"))
+
+    return ["--aligner", aligner, "--src_path", "src", "--src_ref_align", "src_ref0.align", "src_ref1.align",
+            "-r", "ref0", "ref1", "-p"] + SYSTEMS + extra
+
+
+@pytest.mark.parametrize("extra", [[], ["-n", "1", "3", "--filter_stopwords", "--stopwords_path", "stop"]])
+def test_align_pipeline_matches_batch_score(run_script, stub_alignments, extra):
+
+    batch_args = ["--src_ref_align", "src_ref0.align", "src_ref1.align", "--src_mt_align"] + stub_alignments + \
+                 ["-r", "ref0", "ref1", "-p"] + SYSTEMS + extra
+    if "--filter_stopwords" in extra:
+        batch_args += ["--src_path", "src"]
+
+    assert run_script("align_pipeline.py", pipeline_args(["--aligner-workers", "2"] + extra)) == \
+        run_script("batch_score.py", batch_args)
+
+
+@pytest.mark.parametrize("extra", [[], ["-n", "1", "3", "--filter_stopwords", "--stopwords_path", "stop"]])
+def test_orchestrate_matches_align_pipeline(run_script, extra):
+
+    assert run_script("orchestrate.py", pipeline_args(["--workers", "1", "--aligner-workers", "2"] + extra)) == \
+        run_script("align_pipeline.py", pipeline_args(extra))
@@ -0,0 +1,122 @@
+import os
+import importlib.util
+
+import pytest
+
+import rep_score
+import corpus_store
+
+from conftest import ROOT
+
+# The scoring functions of the original script, which match each n-gram with a linear scan
+spec = importlib.util.spec_from_file_location("rep_score_uni", os.path.join(ROOT, "backup", "rep_score_uni.py"))
+baseline = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(baseline)
+
+
+def baseline_counts(sentence_list, n_grams):
+    return baseline.count_repetitions(baseline.create_ngram_sentence_list(sentence_list, n_grams), 0)
+
+
+def baseline_scores(ref, pred, n_grams):
+    """ Returns the per-sentence n-gram and consecutive words scores of the original script
+        against a single reference """
+
+    return (baseline.n_gram_score(baseline_counts(ref, n_grams), baseline_counts(pred, n_grams)),
+            baseline.consecutive_words_score(baseline_counts(ref, 2), baseline_counts(pred, 2)))
+
+
+@pytest.mark.parametrize("reference", ["ref0", "ref1"])
+@pytest.mark.parametrize("n_grams", [1, 2, 3])
+def test_profile_scores_match_baseline(sentences, reference, n_grams):
+
+    ref, pred = sentences[reference], sentences["mt"]
+    profiles = rep_score.build_reference_profile_lists([ref], [n_grams])
+    n_gram_scores, consec_scores = rep_score.profile_multi_rep_scores(profiles, pred, [n_grams])
+
+    assert (n_gram_scores[n_grams], consec_scores) == baseline_scores(ref, pred, n_grams)
+
+
+def test_profile_scores_of_the_reference_itself(sentences):
+
+    # A prediction that repeats only what the reference repeats is not penalized
+    ref = sentences["ref0"]
+    n_gram_scores, consec_scores = rep_score.profile_multi_rep_scores(
+        rep_score.build_reference_profile_lists([ref], [1, 2, 3]), ref, [1, 2, 3])
+
+    assert all(sum(scores) == 0 for scores in n_gram_scores.values())
+    assert sum(consec_scores) == 0
+
+
+@pytest.mark.parametrize("n_grams_list", [[2], [1, 3]])
+def test_fused_scores_match_per_reference_minimum(sentences, n_grams_list):
+
+    refs, pred = [sentences["ref0"], sentences["ref1"]], sentences["mt"]
+    n_gram_scores, consec_scores = rep_score.profile_multi_rep_scores(
+        rep_score.build_reference_profile_lists(refs, n_grams_list), pred, n_grams_list)
+
+    # Each score is the minimum over the scores against each reference on its own
+    single = [rep_score.profile_multi_rep_scores(rep_score.build_reference_profile_lists([ref], n_grams_list),
+                                                 pred, n_grams_list) for ref in refs]
+
+    for n_grams in n_grams_list:
+        assert n_gram_scores[n_grams] == [min(x) for x in zip(*[scores[n_grams] for scores, _ in single])]
+        assert n_gram_scores[n_grams] == [min(x) for x in zip(*[baseline_scores(ref, pred, n_grams)[0]
+                                                                 for ref in refs])]
+    assert consec_scores == [min(x) for x in zip(*[scores for _, scores in single])]
+
+
+def test_fused_tandem_scores_match_per_reference_minimum(sentences):
+
+    refs, pred = [sentences["ref0"], sentences["ref1"]], sentences["mt"]
+    tandem_scores = rep_score.profile_tandem_scores(rep_score.build_tandem_profile_list(refs), pred)
+    single = [rep_score.profile_tandem_scores(rep_score.build_tandem_profile_list([ref]), pred) for ref in refs]
+
+    assert tandem_scores == [min(x) for x in zip(*single)]
+    assert sum(tandem_scores) > 0
+
+
+@pytest.mark.parametrize("references", [["ref0"], ["ref0", "ref1"]])
+def test_numpy_engine_matches_python_engine(corpus, sentences, references):
+
+    refs, pred = [sentences[name] for name in references], sentences["mt"]
+    n_grams_list = [1, 2, 3]
+
+    expected = rep_score.sentence_list_rep_scores(refs, pred, n_grams_list, "python")[:2]
+
+    assert rep_score.numpy_multi_rep_scores(refs, pred, n_grams_list) == expected
+
+    # Scored in blocks that do not divide the number of sentences
+    ref_corpora = [corpus_store.load_corpus(str(corpus / name)) for name in references]
+    pred_corpus = corpus_store.load_corpus(str(corpus / "mt"))
+    n_gram_scores, consec_scores = rep_score.corpus_rep_scores(ref_corpora, pred_corpus, n_grams_list, block_size=37)
+
+    assert (dict((n_grams, [int(x) for x in scores]) for n_grams, scores in n_gram_scores.items()),
+            [int(x) for x in consec_scores]) == expected
+
+
+def test_numpy_engine_output_matches_python_engine(run_script):
+
+    args = ["-n", "1", "2", "3", "-w3", "1.5", "-r", "ref0", "ref1", "-p", "mt"]
+
+    assert run_script("rep_score.py", args + ["--engine", "numpy"]) == run_script("rep_score.py", args)
+
+
+@pytest.mark.parametrize("args", [["-r", "ref0", "-p", "mt"],
+                                  ["-n", "1", "2", "3", "-w1", "0.5", "-w3", "1.5", "-r", "ref0", "ref1", "-p", "mt"]])
+def test_stream_output_matches_default(run_script, args):
+
+    assert run_script("rep_score.py", args + ["--stream"]) == run_script("rep_score.py", args)
+
+
+def test_stream_rep_score_matches_profile_scores(corpus, sentences):
+
+    refs, pred = [sentences["ref0"], sentences["ref1"]], sentences["mt"]
+    n_grams_list = [1, 2]
+
+    n_gram_scores, consec_scores = rep_score.sentence_list_rep_scores(refs, pred, n_grams_list, "python")[:2]
+    total_values, nw_ref, nw_can = rep_score.stream_rep_score([str(corpus / "ref0"), str(corpus / "ref1")],
+                                                              str(corpus / "mt"), n_grams_list, 1.0, 2.0)
+
+    assert total_values == rep_score.calculate_total_values(n_gram_scores, consec_scores, 1.0, 2.0)
+    assert (nw_ref, nw_can) == ([sum(map(len, ref)) for ref in refs], sum(map(len, pred)))